@@ -1,4 +1,5 @@
 from flask import Flask
+import os
 from pymongo import MongoClient
 from blueprints.logins import auth_bp
 from blueprints.manager.manager import mang_bp
@@ -14,6 +15,22 @@ from blueprints.supervisor.progress_routes import progress_bp
 from blueprints.supervisor.safety_reports_routes import safety_reports_bp   
 from blueprints.supervisor.new_workers_routes import new_workers_bp   
 from blueprints.chat import chat_bp
+from utils.indexes import init_indexes
+from utils.migrations import init_migrations
+from utils.user_resolver import init_identity_map
+from utils.user_directory import UserDirectory
+from utils.fanout import init_fanout
+from utils.auth import init_auth
+from utils.ollama_client import init_ollama
+from utils.conversation_store import ConversationStore
+from utils.chat_history import make_summarizer
+from utils.response_cache import ResponseCache
+from utils.generation_scheduler import GenerationScheduler
+from utils.stream_registry import StreamRegistry
+from blueprints.notifications import socketio, relay_change, REPORT_TYPES
+from utils.events import EventBus
+from utils.live_counters import LiveCounters, DASHBOARD_COUNTERS
+from utils.change_feed import ChangeFeed
 
 app = Flask(__name__)
 
@@ -28,6 +45,81 @@ app.config["TASKS_COLLECTION"] = db["tasks"]
 app.config['ATTENDANCE_COLLECTION'] = db["attendance"]
 app.config['SAFETY_COLLECTION'] = db["safety"]
 app.config['EMERGENCY_COLLECTION'] = db["emergencies"]
+# Tombstones of deleted documents, for processes following changes by polling
+app.config["DELETIONS_COLLECTION"] = db["deletions"]
+
+# Documents fetched per cursor batch by streaming exports
+app.config["EXPORT_BATCH_SIZE"] = 500
+
+# In-process user cache (by id, email and role); write routes invalidate it
+app.config["USER_DIRECTORY"] = UserDirectory(db["users"], ttl=300, max_users=5000)
+
+# Bounded thread pool for running independent reads side by side
+app.config["FANOUT_MAX_WORKERS"] = 8
+init_fanout(app)
+
+# Create the indexes the routes query on (also: `flask --app app ensure-indexes`)
+init_indexes(app)
+
+# Backfill documents written by older versions of the routes (also: `flask --app app migrate`)
+init_migrations(app)
+
+# Decode the bearer token once per request into g.claims (verified tokens are cached until exp)
+app.config["TOKEN_CACHE_SIZE"] = 1024
+init_auth(app)
+
+# Shared keep-alive client for the local Ollama server used by /chat
+app.config["OLLAMA_BASE_URL"] = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+app.config["OLLAMA_CONNECT_TIMEOUT"] = 3.05
+app.config["OLLAMA_READ_TIMEOUT"] = 120
+init_ollama(app)
+
+# Ollama can only run a couple of generations at once: the rest wait in a per-user round-robin
+# queue, and requests beyond the queue limits are turned away with 429/503
+app.config["GENERATION_SCHEDULER"] = GenerationScheduler(max_concurrent=2, max_queue=20, max_per_user=2, max_wait=30)
+
+# Open chat streams by stream id (for cancelling) and counters for delivered/cancelled/wasted tokens
+app.config["STREAM_REGISTRY"] = StreamRegistry()
+
+# Server-side chat sessions: clients send a sessionId instead of re-sending the history.
+# Prompts keep the newest turns within CHAT_TOKEN_BUDGET; older ones are summarized in the background.
+app.config["CHAT_TOKEN_BUDGET"] = 3000
+app.config["CONVERSATION_STORE"] = ConversationStore(
+    ttl=1800,
+    max_sessions=1000,
+    token_budget=app.config["CHAT_TOKEN_BUDGET"],
+    summarize=make_summarizer(app.config["OLLAMA_CLIENT"], app.config["GENERATION_SCHEDULER"])
+)
+
+# Exact-match cache of assistant replies (same model, normalized message and prior conversation)
+app.config["RESPONSE_CACHE"] = ResponseCache(max_entries=500, ttl=3600)
+
+# In-process change events: write routes publish the collection they changed
+app.config["EVENT_BUS"] = EventBus(app.logger)
+
+# Dashboard counters shared by /dashboard/stream subscribers and /dashboard/stats;
+# a change to a collection marks its counters for one shared recount
+app.config["LIVE_COUNTERS"] = LiveCounters(app, debounce=0.5, refresh_interval=60)
+for topic in {topic for topic, _, _ in DASHBOARD_COUNTERS.values()}:
+    app.config["EVENT_BUS"].subscribe(topic, app.config["LIVE_COUNTERS"].mark_dirty)
+
+# Writes from every worker process (and from outside the app) reach the bus through the change feed:
+# MongoDB change streams on a replica set, else polling the updatedAt stamps of a standalone server.
+# The user cache and Socket.IO clients follow those changes; the counters above get them too.
+app.config["CHANGE_FEED_POLL_INTERVAL"] = 2
+app.config["CHANGE_FEED"] = ChangeFeed(
+    app,
+    app.config["EVENT_BUS"],
+    [db["users"], db["tasks"], db["attendance"], db["safety"], db["emergencies"]],
+    deletions=db["deletions"],
+    poll_interval=app.config["CHANGE_FEED_POLL_INTERVAL"]
+)
+app.config["EVENT_BUS"].subscribe("users", app.config["USER_DIRECTORY"].apply_change)
+for topic in REPORT_TYPES:
+    app.config["EVENT_BUS"].subscribe(topic, relay_change)
+
+# Per-request user identity map (reports X-User-Map-Hits / X-User-Map-Misses)
+init_identity_map(app)
 
 # Register blueprint
 app.register_blueprint(auth_bp, url_prefix="/api")
@@ -45,5 +137,13 @@ app.register_blueprint(safety_reports_bp, url_prefix="/api")
 app.register_blueprint(new_workers_bp, url_prefix="/api")
 app.register_blueprint(chat_bp, url_prefix="/api")
 
+# Socket.IO server for live alert notifications (namespace /alerts, JWT-authenticated rooms);
+# alert_update events for the same alert within the window are merged into one
+app.config["ALERT_COALESCE_WINDOW"] = 0.5
+socketio.init_app(app)
+
+# Start following changes once everything that subscribes to them is set up
+app.config["CHANGE_FEED"].start()
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
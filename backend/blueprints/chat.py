@@ -1,15 +1,92 @@
 # app.py (Flask Backend)
-from flask import Flask, request, jsonify, Response,Blueprint
+from flask import Flask, request, jsonify, Response,Blueprint, g
 from flask_cors import CORS
 import requests
 import json
+import time
+from utils.ollama_client import get_ollama_client
+from utils.conversation_store import get_conversation_store
+from utils.chat_history import split_to_budget, summary_message
+from utils.response_cache import get_response_cache, cache_key, replay_chunks
+from utils.generation_scheduler import get_generation_scheduler, SchedulerRejected
+from utils.stream_registry import get_stream_registry
+from utils.auth import auth_required, STAFF_ROLES
+
+# Seconds between queue-position events while a stream waits for a model slot
+QUEUE_EVENT_INTERVAL = 1
 
 # -------------------- Flask App --------------------
 chat_bp = Blueprint("chat", __name__)
 
+# Helper function to build the llama3 prompt from chat messages
+def build_prompt(messages):
+    prompt_text = ""
+    for msg in messages:
+        prompt_text += f"{msg['role']}: {msg['content']}\n"
+    prompt_text += "assistant:"
+    return prompt_text
+
+# Helper function to turn a chat request into (prompt, ollama options, conversation, prior messages)
+def prepare_turn(data, user_message):
+    """
+    Clients send only the new message and a server-side session id (`sessionId`).
+    The whole-`history` form is deprecated: it is kept for app builds from before
+    sessions and will be removed once those are no longer in use
+    """
+    store = get_conversation_store()
+
+    if 'history' in data:
+        conversation_history = data.get('history') or []
+        conversation_history.append({"role": "user", "content": user_message})
+        # Only the newest turns that fit the token budget go into the prompt
+        _, window = split_to_budget(conversation_history, store.token_budget)
+        return build_prompt(window), {}, {"history": conversation_history}, window[:-1]
+
+    session_id = data.get('sessionId')
+    session = store.get(session_id)
+    if session is None:
+        # Unknown or expired ids start over rather than failing the message
+        session_id = store.create()
+        session = {"context": None, "summary": None, "messages": []}
+
+    # Rolling summary of the folded turns, then the recent window
+    prior_messages = session["messages"]
+    if session["summary"]:
+        prior_messages = [summary_message(session["summary"])] + prior_messages
+
+    new_message = [{"role": "user", "content": user_message}]
+    if session["context"]:
+        # Ollama's context already holds the earlier turns; only turns answered from the reply
+        # cache since then and the new message are evaluated
+        return build_prompt(session["unseen"] + new_message), {"context": session["context"]}, {"sessionId": session_id}, prior_messages
+    return build_prompt(prior_messages + new_message), {}, {"sessionId": session_id}, prior_messages
+
+# Helper function to pick who a generation is queued for (fairness is per user, not per request).
+# The chat routes require a token: an address is shared by everyone behind the same NAT or proxy,
+# and a client-chosen sessionId could be rotated to dodge the limits.
+def requester_key():
+    return g.claims["email"]
+
+# Helper function to turn a scheduler rejection into an error response
+def rejection_response(e):
+    response = jsonify({"error": e.message})
+    if e.retry_after:
+        response.headers["Retry-After"] = str(e.retry_after)
+    return response, e.status
+
+# Helper function to save a finished turn to its session or legacy history
+# (a reply without a context, e.g. from the reply cache, leaves the session's context in place)
+def finish_turn(store, conversation, user_message, reply, context):
+    if "history" in conversation:
+        conversation["history"].append({"role": "assistant", "content": reply})
+    else:
+        store.append_turn(conversation["sessionId"], user_message, reply, context, keep_context=context is None)
+    return conversation
+
 # -------------------- Chat Endpoints --------------------
 
 @chat_bp.route('/chat', methods=['POST'])
+@auth_required()
 def chat_with_llama3():
     """
     API endpoint to chat with Llama3 model (non-streaming)
@@ -17,42 +94,44 @@ def chat_with_llama3():
     try:
         data = request.json
         user_message = data.get('message')
-        conversation_history = data.get('history', [])
 
         if not user_message:
             return jsonify({"error": "Message is required"}), 400
 
-        # Append the user's message
-        conversation_history.append({"role": "user", "content": user_message})
-
-        # Build prompt
-        prompt_text = ""
-        for msg in conversation_history:
-            prompt_text += f"{msg['role']}: {msg['content']}\n"
-        prompt_text += "assistant:"
+        prompt_text, options, conversation, prior_messages = prepare_turn(data, user_message)
 
-        # Ollama API call
-        ollama_api_url = "http://localhost:11434/api/generate"
-        payload = {
-            "model": "llama3",
-            "prompt": prompt_text,
-            "stream": False
-        }
+        ollama_client = get_ollama_client()
+        response_cache = get_response_cache()
+        key = cache_key(ollama_client.model, user_message, prior_messages)
 
-        response = requests.post(ollama_api_url, json=payload)
-        response.raise_for_status()
+        # Same question after the same conversation: answer without a generation
+        assistant_reply, age = response_cache.get(key)
+        if assistant_reply is not None:
+            conversation = finish_turn(get_conversation_store(), conversation, user_message, assistant_reply, None)
+            response = jsonify({"reply": assistant_reply, **conversation})
+            response.headers["X-Cache"] = "HIT"
+            response.headers["Age"] = str(age)
+            return response
 
-        response_data = response.json()
+        # Ollama API call (pooled keep-alive connection, bounded connect/read timeouts),
+        # once the scheduler grants a model slot
+        with get_generation_scheduler().slot(requester_key()):
+            response_data = ollama_client.generate(prompt_text, **options)
         assistant_reply = response_data.get('response', '')
+        response_cache.put(key, assistant_reply)
 
-        # Append assistant reply to history
-        conversation_history.append({"role": "assistant", "content": assistant_reply})
+        # Record the reply in the session (or append it to the legacy history)
+        conversation = finish_turn(get_conversation_store(), conversation, user_message,
+                                   assistant_reply, response_data.get('context'))
 
-        return jsonify({
-            "reply": assistant_reply,
-            "history": conversation_history
-        })
+        response = jsonify({"reply": assistant_reply, **conversation})
+        response.headers["X-Cache"] = "MISS"
+        return response
 
+    except SchedulerRejected as e:
+        return rejection_response(e)
+    except requests.exceptions.Timeout as e:
+        return jsonify({"error": f"Ollama API timed out: {str(e)}"}), 504
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Ollama API error: {str(e)}"}), 500
     except Exception as e:
@@ -60,6 +139,7 @@ def chat_with_llama3():
 
 
 @chat_bp.route('/chat/stream', methods=['POST'])
+@auth_required()
 def chat_with_llama3_stream():
     """
     Stream response from Llama3 model
@@ -67,50 +147,132 @@ def chat_with_llama3_stream():
     try:
         data = request.json
         user_message = data.get('message')
-        conversation_history = data.get('history', [])
 
         if not user_message:
             return jsonify({"error": "Message is required"}), 400
 
-        # Append the user's message
-        conversation_history.append({"role": "user", "content": user_message})
+        prompt_text, options, conversation, prior_messages = prepare_turn(data, user_message)
+
+        # The generator runs after the request context is gone, so grab the client and stores now
+        ollama_client = get_ollama_client()
+        store = get_conversation_store()
+        response_cache = get_response_cache()
+        key = cache_key(ollama_client.model, user_message, prior_messages)
+
+        cached_reply, age = response_cache.get(key)
+        if cached_reply is not None:
+            # Replay the cached answer in the same chunk/done events a live stream sends
+            def replay():
+                for chunk in replay_chunks(cached_reply):
+                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+                finished = finish_turn(store, conversation, user_message, cached_reply, None)
+                yield f"data: {json.dumps({'done': True, 'full_response': cached_reply, **finished})}\n\n"
+
+            return Response(replay(), mimetype='text/event-stream', headers={"X-Cache": "HIT", "Age": str(age)})
 
-        # Build prompt
-        prompt_text = ""
-        for msg in conversation_history:
-            prompt_text += f"{msg['role']}: {msg['content']}\n"
-        prompt_text += "assistant:"
+        # Admission is decided now so an overloaded server answers 429/503 instead of an open stream
+        scheduler = get_generation_scheduler()
+        try:
+            ticket = scheduler.enqueue(requester_key())
+        except SchedulerRejected as e:
+            return rejection_response(e)
 
-        ollama_api_url = "http://localhost:11434/api/generate"
-        payload = {
-            "model": "llama3",
-            "prompt": prompt_text,
-            "stream": True
-        }
+        # The stream id lets the client cancel via /chat/stream/<id>/cancel
+        registry = get_stream_registry()
+        stream_id, cancel_event = registry.open()
 
         def generate():
+            # Left as "disconnected" if the server closes this generator because the client went away
+            outcome = "disconnected"
+            tokens = 0
+            upstream = None
             try:
-                response = requests.post(ollama_api_url, json=payload, stream=True)
-                response.raise_for_status()
+                yield f"data: {json.dumps({'streamId': stream_id})}\n\n"
+
+                # Tell the client where it stands until a model slot frees up
+                while not scheduler.wait(ticket, 0):
+                    if cancel_event.is_set():
+                        outcome = "cancelled"
+                        yield f"data: {json.dumps({'cancelled': True})}\n\n"
+                        return
+                    if time.monotonic() - ticket.enqueued_at > scheduler.max_wait:
+                        outcome = "failed"
+                        scheduler.expire(ticket)
+                        yield f"data: {json.dumps({'error': 'Timed out waiting for the assistant, try again shortly'})}\n\n"
+                        return
+                    yield f"data: {json.dumps({'queued': True, 'position': scheduler.position(ticket)})}\n\n"
+                    scheduler.wait(ticket, QUEUE_EVENT_INTERVAL)
 
                 full_response = ""
-                for line in response.iter_lines():
-                    if line:
-                        json_data = json.loads(line)
-                        content = json_data.get('response', '')
-                        full_response += content
-                        yield f"data: {json.dumps({'chunk': content})}\n\n"
+                context = None
+                upstream = ollama_client.stream_generate(prompt_text, **options)
+                for json_data in upstream:
+                    if cancel_event.is_set():
+                        outcome = "cancelled"
+                        yield f"data: {json.dumps({'cancelled': True, 'full_response': full_response})}\n\n"
+                        return
+                    content = json_data.get('response', '')
+                    full_response += content
+                    if json_data.get('done'):
+                        context = json_data.get('context')
+                    else:
+                        tokens += 1
+                    yield f"data: {json.dumps({'chunk': content})}\n\n"
 
                 # Send final full response
-                conversation_history.append({"role": "assistant", "content": full_response})
-                yield f"data: {json.dumps({'done': True, 'full_response': full_response, 'history': conversation_history})}\n\n"
+                outcome = "completed"
+                response_cache.put(key, full_response)
+                finished = finish_turn(store, conversation, user_message, full_response, context)
+                yield f"data: {json.dumps({'done': True, 'full_response': full_response, **finished})}\n\n"
 
             except Exception as e:
+                outcome = "failed"
                 yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            finally:
+                # Closing the upstream response drops the Ollama connection, which stops the generation
+                if upstream is not None:
+                    upstream.close()
+                scheduler.release(ticket)
+                registry.close(stream_id, outcome, tokens)
 
-        return Response(generate(), mimetype='text/event-stream')
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={"X-Cache": "MISS", "X-Stream-Id": stream_id})
 
     except Exception as e:
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
 
+@chat_bp.route('/chat/stream/<stream_id>/cancel', methods=['POST'])
+@auth_required()
+def cancel_chat_stream(stream_id):
+    """
+    Stop an open chat stream; its model slot is freed as soon as the stream notices
+    """
+    if not get_stream_registry().cancel(stream_id):
+        return jsonify({"error": "Stream not found"}), 404
+    return jsonify({"message": "Stream cancelled"})
+
+
+@chat_bp.route('/chat/stats', methods=['GET'])
+@auth_required(*STAFF_ROLES)
+def chat_stats():
+    """
+    Stream outcomes and token counters, plus scheduler, cache and session figures
+    """
+    return jsonify({
+        "streams": get_stream_registry().stats(),
+        "scheduler": get_generation_scheduler().stats(),
+        "cache": get_response_cache().stats(),
+        "sessions": get_conversation_store().stats()
+    })
+
+
+@chat_bp.route('/chat/session/<session_id>', methods=['DELETE'])
+@auth_required()
+def end_chat_session(session_id):
+    """
+    Drop a server-side chat session
+    """
+    if not get_conversation_store().delete(session_id):
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({"message": "Session ended"})
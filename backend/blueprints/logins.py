@@ -28,6 +28,8 @@ def login():
         if user.get("password") == data.get("password"):
             # Generate JWT token
             token = jwt.encode({
+                "uid": str(user["_id"]),
+                "uver": user.get("version", 0),  # compared with the directory copy to spot stale role/name claims
                 "email": user["email"],
                 "role": user["role"],
                 "name": user["name"],
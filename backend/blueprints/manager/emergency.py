@@ -1,30 +1,20 @@
 # emergency_routes.py
 from flask import Blueprint, request, jsonify, current_app
-import jwt
 import datetime
 from bson import ObjectId
 from datetime import datetime
 import re
+from utils.auth import verify_token, auth_required, STAFF_ROLES
+from utils.stats import facet_stats
+from utils.pagination import CursorError, page_params, paginate_find, page_response
+from utils.user_resolver import load_users, get_user_by_id
+from blueprints.notifications import send_new_report_notification, send_alert_update_notification
+from utils.events import publish_change
+from utils.change_feed import touch, stamped_update
 
 # Blueprint instance
 emergency_bp = Blueprint("emergency", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -44,26 +34,28 @@ def emergencies():
     
     if request.method == "GET":
         try:
-            # Get all emergency records with user details
-            records = list(emergency_col.find({}).sort("timestamp", -1))
+            # Keyset pagination (`limit` / `after`); without them the full list is returned
+            try:
+                limit, after = page_params()
+            except CursorError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            # Get all emergency records (or one page of them) with user details
+            next_cursor = None
+            if limit:
+                records, next_cursor = paginate_find(emergency_col, {}, "timestamp", limit, after)
+            else:
+                records = list(emergency_col.find({}).sort("timestamp", -1))
+            
+            # Resolve all referenced users in one batch
+            users = load_users(users_col, records, ["reportedBy", "workerId", "assignedTo"])
             
             # Enrich records with user information
             enriched_records = []
             for record in records:
-                # Get reporter info
-                reporter = None
-                if is_valid_objectid(record.get("reportedBy", "")):
-                    reporter = users_col.find_one({"_id": ObjectId(record["reportedBy"])})
-                
-                # Get worker info
-                worker = None
-                if is_valid_objectid(record.get("workerId", "")):
-                    worker = users_col.find_one({"_id": ObjectId(record["workerId"])})
-                
-                # Get assigned to info
-                assigned_to = None
-                if is_valid_objectid(record.get("assignedTo", "")):
-                    assigned_to = users_col.find_one({"_id": ObjectId(record["assignedTo"])})
+                reporter = users.by_id(record.get("reportedBy", ""))
+                worker = users.by_id(record.get("workerId", ""))
+                assigned_to = users.by_id(record.get("assignedTo", ""))
                 
                 enriched_record = {
                     "_id": str(record["_id"]),
@@ -86,6 +78,8 @@ def emergencies():
                 }
                 enriched_records.append(enriched_record)
             
+            if limit:
+                return page_response(enriched_records, next_cursor), 200
             return jsonify(enriched_records), 200
             
         except Exception as e:
@@ -110,7 +104,7 @@ def emergencies():
             worker_name = "Unknown Worker"
             if data.get("workerId"):
                 if is_valid_objectid(data["workerId"]):
-                    worker = users_col.find_one({"_id": ObjectId(data["workerId"])})
+                    worker = get_user_by_id(users_col, data["workerId"])
                     if worker:
                         worker_name = worker["name"]
                 else:
@@ -136,10 +130,12 @@ def emergencies():
             }
             
             # Insert the emergency report
-            result = emergency_col.insert_one(emergency_record)
+            result = emergency_col.insert_one(touch(emergency_record))
+            publish_change("emergencies", "insert", id=str(result.inserted_id))
             
             # Return the created record
             created_record = emergency_col.find_one({"_id": result.inserted_id})
+            send_new_report_notification("emergency", created_record)
             enriched_record = {
                 "_id": str(created_record["_id"]),
                 "workerId": created_record["workerId"],
@@ -165,15 +161,12 @@ def emergencies():
             return jsonify({"error": "Failed to report emergency"}), 500
 
 @emergency_bp.route("/emergencies/<emergency_id>", methods=["PUT"])
+@auth_required()
 def emergency_detail(emergency_id):
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         if request.method == "PUT":
             data = request.json
             
@@ -192,10 +185,9 @@ def emergency_detail(emergency_id):
             if "assignedTo" in data:
                 update_data["assignedTo"] = data["assignedTo"]
                 # Resolve assigned to name
-                if data["assignedTo"] and is_valid_objectid(data["assignedTo"]):
-                    assigned_user = users_col.find_one({"_id": ObjectId(data["assignedTo"])})
-                    if assigned_user:
-                        update_data["assignedToName"] = assigned_user["name"]
+                assigned_user = get_user_by_id(users_col, data["assignedTo"])
+                if assigned_user:
+                    update_data["assignedToName"] = assigned_user["name"]
             if "priority" in data:
                 update_data["priority"] = data["priority"]
             if "resolved" in data:
@@ -206,22 +198,21 @@ def emergency_detail(emergency_id):
                 update_data["resolution"] = data["resolution"]
             
             # Update the emergency report
-            result = emergency_col.update_one(
-                {"_id": ObjectId(emergency_id)}, 
-                {"$set": update_data}
-            )
+            result = emergency_col.update_one(*stamped_update({"_id": ObjectId(emergency_id)}, update_data))
             
             if result.modified_count:
+                publish_change("emergencies", "update", id=emergency_id)
+                send_alert_update_notification(f"emergency-{emergency_id}", update_data, previous=emergency)
+                
                 # Return updated record
                 updated_record = emergency_col.find_one({"_id": ObjectId(emergency_id)})
                 
                 # Get assigned to name if not already set
                 assigned_to_name = updated_record.get("assignedToName", "Unassigned")
                 if not assigned_to_name and updated_record.get("assignedTo"):
-                    if is_valid_objectid(updated_record["assignedTo"]):
-                        assigned_user = users_col.find_one({"_id": ObjectId(updated_record["assignedTo"])})
-                        if assigned_user:
-                            assigned_to_name = assigned_user["name"]
+                    assigned_user = get_user_by_id(users_col, updated_record["assignedTo"])
+                    if assigned_user:
+                        assigned_to_name = assigned_user["name"]
                 
                 enriched_record = {
                     "_id": str(updated_record["_id"]),
@@ -255,50 +246,48 @@ def emergency_detail(emergency_id):
 
 # ---------------- EMERGENCY STATS ----------------
 @emergency_bp.route("/emergencies/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def emergency_stats():
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get today's date for filtering
         today = datetime.now().date()
         today_start = datetime(today.year, today.month, today.day)
         today_end = datetime(today.year, today.month, today.day, 23, 59, 59)
         
-        # Calculate statistics
-        total_emergencies = emergency_col.count_documents({})
-        today_emergencies = emergency_col.count_documents({
-            "timestamp": {
-                "$gte": today_start.isoformat(),
-                "$lte": today_end.isoformat()
-            }
+        # Calculate statistics in a single $facet round trip
+        stats = facet_stats(emergency_col, {
+            "total": {},
+            "today": {
+                "timestamp": {
+                    "$gte": today_start.isoformat(),
+                    "$lte": today_end.isoformat()
+                }
+            },
+            "open": {"status": "Open"},
+            "inProgress": {"status": "In Progress"},
+            "resolved": {"resolved": True},
+            # Count by type
+            "sos": {"type": "SOS"},
+            "accident": {"type": "Accident"},
+            "medical": {"type": "Medical"},
+            "safety": {"type": "Safety"},
+            "other": {"type": {"$nin": ["SOS", "Accident", "Medical", "Safety"]}}
         })
-        open_emergencies = emergency_col.count_documents({"status": "Open"})
-        in_progress_emergencies = emergency_col.count_documents({"status": "In Progress"})
-        resolved_emergencies = emergency_col.count_documents({"resolved": True})
-        
-        # Count by type
-        sos_count = emergency_col.count_documents({"type": "SOS"})
-        accident_count = emergency_col.count_documents({"type": "Accident"})
-        medical_count = emergency_col.count_documents({"type": "Medical"})
-        safety_count = emergency_col.count_documents({"type": "Safety"})
-        other_count = emergency_col.count_documents({"type": {"$nin": ["SOS", "Accident", "Medical", "Safety"]}})
         
         return jsonify({
-            "totalEmergencies": total_emergencies,
-            "todayEmergencies": today_emergencies,
-            "openEmergencies": open_emergencies,
-            "inProgressEmergencies": in_progress_emergencies,
-            "resolvedEmergencies": resolved_emergencies,
+            "totalEmergencies": stats["total"],
+            "todayEmergencies": stats["today"],
+            "openEmergencies": stats["open"],
+            "inProgressEmergencies": stats["inProgress"],
+            "resolvedEmergencies": stats["resolved"],
             "byType": {
-                "SOS": sos_count,
-                "Accident": accident_count,
-                "Medical": medical_count,
-                "Safety": safety_count,
-                "Other": other_count
+                "SOS": stats["sos"],
+                "Accident": stats["accident"],
+                "Medical": stats["medical"],
+                "Safety": stats["safety"],
+                "Other": stats["other"]
             }
         }), 200
         
@@ -308,19 +297,13 @@ def emergency_stats():
 
 # ---------------- GET ASSIGNABLE USERS ----------------
 @emergency_bp.route("/emergencies/assignable-users", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_assignable_users():
-    users_col = current_app.config["USERS_COLLECTION"]
+    user_directory = current_app.config["USER_DIRECTORY"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get users who can be assigned to emergencies (Managers and Supervisors)
-        users = list(users_col.find(
-            {"role": {"$in": ["Manager", "Supervisor"]}}, 
-            {"_id": 1, "name": 1, "email": 1, "role": 1}
-        ))
+        users = user_directory.list_users(["Manager", "Supervisor"])
         
         # Format response
         users_list = []
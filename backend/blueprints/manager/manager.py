@@ -1,27 +1,23 @@
 # manager.py
-from flask import Blueprint, request, jsonify, current_app
-import jwt
+from flask import Blueprint, request, jsonify, current_app, Response
 import datetime
+import json
 from bson import ObjectId
 from datetime import datetime, date
+from utils.auth import verify_token, auth_required, resolve_identity, STAFF_ROLES
+from utils.work_hours import with_minutes
+from utils.fanout import fan_out, FanoutTimeout
+from utils.pagination import CursorError, page_params, paginate_find, page_response
+from utils.user_resolver import load_users, get_user_by_id
+from blueprints.notifications import send_new_report_notification, send_alert_update_notification
+from utils.live_counters import DASHBOARD_COUNTERS, dashboard_queries
+from utils.events import publish_change
+from utils.change_feed import touch, stamped_update, record_deletion, STAMP_PROJECTION
 
-mang_bp = Blueprint("mang", __name__)
+# Seconds between keep-alive comments on an idle dashboard stream
+DASHBOARD_HEARTBEAT = 15
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
+mang_bp = Blueprint("mang", __name__)
 
 # ---------------- REGISTER ----------------
 @mang_bp.route("/register", methods=["POST"])
@@ -39,18 +35,17 @@ def register():
         "role": data.get("role")  # Worker / Supervisor / Manager
     }
 
+    user = touch(user)
     users.insert_one(user)
+    current_app.config["USER_DIRECTORY"].add(user)
     return jsonify({"message": "User registered successfully"}), 201
 
 # ---------------- PROFILE ----------------
 @mang_bp.route("/profile", methods=["GET"])
+@auth_required()
 def profile():
-    decoded, error_response, status_code = verify_token()
-    if error_response:
-        return error_response, status_code
-
     users = current_app.config["USERS_COLLECTION"]
-    user = users.find_one({"email": decoded["email"]})
+    user = resolve_identity(users)
     if not user:
         return jsonify({"error": "User not found"}), 404
         
@@ -62,37 +57,60 @@ def profile():
 
 # ---------------- DASHBOARD STATS ----------------
 @mang_bp.route("/dashboard/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_dashboard_stats():
-    decoded, error_response, status_code = verify_token()
-    if error_response:
-        return error_response, status_code
-    
     # Get today's date for filtering
     today = date.today().isoformat()
     
-    # Count pending tasks
-    tasks_col = current_app.config["TASKS_COLLECTION"]
-    pending_tasks = tasks_col.count_documents({"status": {"$in": ["pending", "in-progress"]}})
-    
-    # Count today's attendance
-    attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
-    today_attendance = attendance_col.count_documents({"date": today})
-    
-    # Count unresolved safety issues
-    safety_col = current_app.config["SAFETY_COLLECTION"]
-    safety_issues = safety_col.count_documents({"resolved": False})
+    # Counters nothing has changed since the live dashboard last counted them need no queries
+    live_counters = current_app.config.get("LIVE_COUNTERS")
+    counts = live_counters.fresh_values() if live_counters else None
     
-    # Count active emergencies
-    emergency_col = current_app.config["EMERGENCY_COLLECTION"]
-    active_emergencies = emergency_col.count_documents({"resolved": False})
+    if counts is None:
+        marks = live_counters.snapshot_marks() if live_counters else None
+        # The four counts are independent, so run them side by side
+        try:
+            counts = fan_out(dashboard_queries(current_app.config, DASHBOARD_COUNTERS, today))
+        except FanoutTimeout as e:
+            current_app.logger.error(f"Dashboard stats timeout: {str(e)}")
+            return jsonify({"error": "Dashboard stats timed out"}), 504
+        if live_counters:
+            live_counters.offer(counts, marks, today)
     
     return jsonify({
-        "pendingTasks": pending_tasks,
-        "todayAttendance": today_attendance,
-        "safetyIssues": safety_issues,
-        "activeEmergencies": active_emergencies
+        "pendingTasks": counts["pendingTasks"],
+        "todayAttendance": counts["todayAttendance"],
+        "safetyIssues": counts["safetyIssues"],
+        "activeEmergencies": counts["activeEmergencies"]
     }), 200
 
+@mang_bp.route("/dashboard/stream", methods=["GET"])
+@auth_required(*STAFF_ROLES)
+def stream_dashboard_stats():
+    """Server-Sent Events: the counters once, then only the ones that changed"""
+    live_counters = current_app.config["LIVE_COUNTERS"]
+    
+    def generate():
+        live_counters.subscribe()
+        try:
+            sent = {}
+            version = 0
+            while True:
+                version, values = live_counters.wait(version, DASHBOARD_HEARTBEAT)
+                delta = {name: count for name, count in values.items() if sent.get(name) != count}
+                if not delta:
+                    yield ": keep-alive\n\n"
+                elif not sent:
+                    yield f"data: {json.dumps({'snapshot': values})}\n\n"
+                else:
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+                sent = values
+        finally:
+            live_counters.unsubscribe()
+    
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ---------------- ATTENDANCE ----------------
 from bson.objectid import ObjectId
 from flask import Blueprint, jsonify, current_app, request
@@ -104,7 +122,18 @@ def attendance():
     users_col = current_app.config["USERS_COLLECTION"]
 
     if request.method == "GET":
-        records = list(attendance_col.find({}))
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+
+        next_cursor = None
+        if limit:
+            records, next_cursor = paginate_find(attendance_col, {}, "timestamp", limit, after)
+        else:
+            records = list(attendance_col.find({}))
+        users = load_users(users_col, records, ["workerId"])
         attendance_list = []
 
         for rec in records:
@@ -113,7 +142,7 @@ def attendance():
                 # Skip record if workerId is missing
                 continue
 
-            worker = users_col.find_one({"_id": ObjectId(worker_id)})
+            worker = users.by_id(worker_id)
             attendance_list.append({
                 "workerId": worker_id,
                 "name": worker["name"] if worker else "Unknown",
@@ -124,6 +153,8 @@ def attendance():
                 "timestamp": rec.get("timestamp")
             })
 
+        if limit:
+            return page_response(attendance_list, next_cursor), 200
         return jsonify(attendance_list), 200
 
     elif request.method == "POST":
@@ -136,7 +167,8 @@ def attendance():
             return jsonify({"error": "workerId is required"}), 400
 
         data["timestamp"] = datetime.now().isoformat()
-        result = attendance_col.insert_one(data)
+        result = attendance_col.insert_one(touch(with_minutes(data)))
+        publish_change("attendance", "insert", id=str(result.inserted_id))
         return jsonify({"message": "Attendance recorded successfully", "id": str(result.inserted_id)}), 201
 
 # ---------------- TASKS ----------------
@@ -145,7 +177,19 @@ def tasks():
     tasks_col = current_app.config["TASKS_COLLECTION"]
     
     if request.method == "GET":
-        records = list(tasks_col.find({}, {"_id": 0}))
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if limit:
+            records, next_cursor = paginate_find(tasks_col, {}, "createdAt", limit, after, STAMP_PROJECTION)
+            for record in records:
+                record.pop("_id")
+            return page_response(records, next_cursor), 200
+
+        records = list(tasks_col.find({}, {**STAMP_PROJECTION, "_id": 0}))
         return jsonify(records), 200
     
     elif request.method == "POST":
@@ -154,31 +198,27 @@ def tasks():
             return error_response, status_code
             
         data = request.json
-        # Add creation timestamp to the task
-        data["created_at"] = datetime.now().isoformat()
+        # Add creation timestamp to the task (the field /tasks pages are sorted on)
+        data["createdAt"] = datetime.now().isoformat()
         data["status"] = data.get("status", "pending")
         
         # Insert the task
-        result = tasks_col.insert_one(data)
+        result = tasks_col.insert_one(touch(data))
+        publish_change("tasks", "insert", id=str(result.inserted_id))
         return jsonify({"message": "Task created successfully", "id": str(result.inserted_id)}), 201
 
 @mang_bp.route("/tasks/<task_id>", methods=["PUT", "DELETE"])
+@auth_required()
 def task_detail(task_id):
     tasks_col = current_app.config["TASKS_COLLECTION"]
     
-    decoded, error_response, status_code = verify_token()
-    if error_response:
-        return error_response, status_code
-    
     if request.method == "PUT":
         data = request.json
         # Update the task
-        result = tasks_col.update_one(
-            {"_id": ObjectId(task_id)}, 
-            {"$set": data}
-        )
+        result = tasks_col.update_one(*stamped_update({"_id": ObjectId(task_id)}, data))
         
         if result.modified_count:
+            publish_change("tasks", "update", id=task_id)
             return jsonify({"message": "Task updated successfully"}), 200
         else:
             return jsonify({"error": "Task not found or no changes made"}), 404
@@ -187,6 +227,8 @@ def task_detail(task_id):
         result = tasks_col.delete_one({"_id": ObjectId(task_id)})
         
         if result.deleted_count:
+            record_deletion(tasks_col, task_id)
+            publish_change("tasks", "delete", id=task_id)
             return jsonify({"message": "Task deleted successfully"}), 200
         else:
             return jsonify({"error": "Task not found"}), 404
@@ -197,7 +239,19 @@ def emergencies():
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     
     if request.method == "GET":
-        records = list(emergency_col.find({}, {"_id": 0}))
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if limit:
+            records, next_cursor = paginate_find(emergency_col, {}, "timestamp", limit, after, STAMP_PROJECTION)
+            for record in records:
+                record.pop("_id")
+            return page_response(records, next_cursor), 200
+
+        records = list(emergency_col.find({}, {**STAMP_PROJECTION, "_id": 0}))
         return jsonify(records), 200
     
     elif request.method == "POST":
@@ -210,27 +264,55 @@ def emergencies():
         data["reported_at"] = datetime.now().isoformat()
         data["resolved"] = data.get("resolved", False)
         
-        # Insert the emergency report
+        # Insert the emergency report (insert_one adds the _id to `data`)
+        data = touch(data)
         result = emergency_col.insert_one(data)
+        publish_change("emergencies", "insert", id=str(result.inserted_id))
+        send_new_report_notification("emergency", data)
         return jsonify({"message": "Emergency reported successfully", "id": str(result.inserted_id)}), 201
 
 @mang_bp.route("/emergencies/<emergency_id>", methods=["PUT"])
+@auth_required()
 def emergency_detail(emergency_id):
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     
-    decoded, error_response, status_code = verify_token()
-    if error_response:
-        return error_response, status_code
-    
     if request.method == "PUT":
         data = request.json
+        
+        # Load the report first: its current assignee has to hear about a reassignment
+        if not ObjectId.is_valid(emergency_id):
+            return jsonify({"error": "Invalid emergency ID"}), 400
+        emergency = emergency_col.find_one({"_id": ObjectId(emergency_id)})
+        if not emergency:
+            return jsonify({"error": "Emergency not found"}), 404
+        
+        # Prepare update data (only the fields a report update may change)
+        update_data = {}
+        if "status" in data:
+            update_data["status"] = data["status"]
+        if "assignedTo" in data:
+            update_data["assignedTo"] = data["assignedTo"]
+            # Resolve assigned to name
+            assigned_user = get_user_by_id(current_app.config["USERS_COLLECTION"], data["assignedTo"])
+            if assigned_user:
+                update_data["assignedToName"] = assigned_user["name"]
+        if "priority" in data:
+            update_data["priority"] = data["priority"]
+        if "resolved" in data:
+            update_data["resolved"] = data["resolved"]
+            if data["resolved"]:
+                update_data["resolvedAt"] = datetime.now().isoformat()
+        if "resolution" in data:
+            update_data["resolution"] = data["resolution"]
+        if not update_data:
+            return jsonify({"error": "No valid fields to update"}), 400
+        
         # Update the emergency report
-        result = emergency_col.update_one(
-            {"_id": ObjectId(emergency_id)}, 
-            {"$set": data}
-        )
+        result = emergency_col.update_one(*stamped_update({"_id": ObjectId(emergency_id)}, update_data))
         
         if result.modified_count:
+            publish_change("emergencies", "update", id=emergency_id)
+            send_alert_update_notification(f"emergency-{emergency_id}", update_data, previous=emergency)
             return jsonify({"message": "Emergency report updated successfully"}), 200
         else:
             return jsonify({"error": "Emergency not found or no changes made"}), 404
\ No newline at end of file
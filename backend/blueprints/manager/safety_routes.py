@@ -1,30 +1,19 @@
 # safety_routes.py
 from flask import Blueprint, request, jsonify, current_app
-import jwt
 import datetime
 from bson import ObjectId
 from datetime import datetime
 import re
+from utils.auth import verify_token, auth_required, STAFF_ROLES
+from utils.stats import facet_stats
+from utils.user_resolver import load_users, get_user_by_id, get_user_by_email
+from blueprints.notifications import send_new_report_notification, send_alert_update_notification
+from utils.events import publish_change
+from utils.change_feed import touch, stamped_update
 
 # Blueprint instance
 safety_bp = Blueprint("safety", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -47,12 +36,13 @@ def safety_compliance():
             # Get all safety compliance records with user details
             records = list(safety_col.find({}))
             
+            # Resolve all referenced workers in one batch
+            users = load_users(users_col, records, ["workerId"])
+            
             # Enrich records with user information
             enriched_records = []
             for record in records:
-                user = None
-                if is_valid_objectid(record["workerId"]):
-                    user = users_col.find_one({"_id": ObjectId(record["workerId"])})
+                user = users.by_id(record["workerId"])
                 
                 enriched_record = {
                     "_id": str(record["_id"]),
@@ -94,14 +84,14 @@ def safety_compliance():
             
             if is_valid_objectid(data["workerId"]):
                 # Try to find by ObjectId
-                worker = users_col.find_one({"_id": ObjectId(data["workerId"])})
+                worker = get_user_by_id(users_col, data["workerId"])
                 if worker:
                     worker_name = worker["name"]
                 else:
                     worker_name = f"Unknown (ID: {data['workerId']})"
             else:
                 # Try to find by email or name
-                worker_by_email = users_col.find_one({"email": data["workerId"]})
+                worker_by_email = get_user_by_email(users_col, data["workerId"])
                 if worker_by_email:
                     worker = worker_by_email
                     worker_name = worker_by_email["name"]
@@ -139,10 +129,12 @@ def safety_compliance():
             }
             
             # Insert the safety report
-            result = safety_col.insert_one(safety_record)
+            result = safety_col.insert_one(touch(safety_record))
+            publish_change("safety", "insert", id=str(result.inserted_id))
             
             # Return the created record
             created_record = safety_col.find_one({"_id": result.inserted_id})
+            send_new_report_notification("safety", created_record)
             enriched_record = {
                 "_id": str(created_record["_id"]),
                 "workerId": created_record["workerId"],
@@ -166,15 +158,12 @@ def safety_compliance():
             return jsonify({"error": "Failed to create safety compliance report"}), 500
 
 @safety_bp.route("/safety/compliance/<report_id>", methods=["PUT"])
+@auth_required()
 def safety_compliance_detail(report_id):
     safety_col = current_app.config["SAFETY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         if request.method == "PUT":
             data = request.json
             
@@ -210,12 +199,12 @@ def safety_compliance_detail(report_id):
                     update_data["vest"] = data["vest"]
             
             # Update the safety report
-            result = safety_col.update_one(
-                {"_id": ObjectId(report_id)}, 
-                {"$set": update_data}
-            )
+            result = safety_col.update_one(*stamped_update({"_id": ObjectId(report_id)}, update_data))
             
             if result.modified_count:
+                publish_change("safety", "update", id=report_id)
+                send_alert_update_notification(f"safety-{report_id}", update_data, previous=report)
+                
                 # Return updated record
                 updated_record = safety_col.find_one({"_id": ObjectId(report_id)})
                 
@@ -245,19 +234,13 @@ def safety_compliance_detail(report_id):
 
 # ---------------- GET WORKERS FOR AUTOCOMPLETE ----------------
 @safety_bp.route("/safety/workers", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_workers():
-    users_col = current_app.config["USERS_COLLECTION"]
+    user_directory = current_app.config["USER_DIRECTORY"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get all workers (users with role "Worker")
-        workers = list(users_col.find(
-            {"role": "Worker"}, 
-            {"_id": 1, "name": 1, "email": 1}
-        ))
+        workers = user_directory.list_users(["Worker"])
         
         # Format response
         workers_list = []
@@ -277,37 +260,36 @@ def get_workers():
 
 # ---------------- SAFETY STATS ----------------
 @safety_bp.route("/safety/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def safety_stats():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get today's date for filtering
         today = datetime.now().date()
         today_start = datetime(today.year, today.month, today.day)
         today_end = datetime(today.year, today.month, today.day, 23, 59, 59)
         
-        # Calculate statistics
-        total_reports = safety_col.count_documents({})
-        today_reports = safety_col.count_documents({
-            "timestamp": {
-                "$gte": today_start.isoformat(),
-                "$lte": today_end.isoformat()
-            }
+        # Calculate statistics in a single $facet round trip
+        stats = facet_stats(safety_col, {
+            "total": {},
+            "today": {
+                "timestamp": {
+                    "$gte": today_start.isoformat(),
+                    "$lte": today_end.isoformat()
+                }
+            },
+            "unresolved": {"resolved": False},
+            "helmet": {"helmet": False},
+            "vest": {"vest": False}
         })
-        unresolved_reports = safety_col.count_documents({"resolved": False})
-        helmet_violations = safety_col.count_documents({"helmet": False})
-        vest_violations = safety_col.count_documents({"vest": False})
         
         return jsonify({
-            "totalReports": total_reports,
-            "todayReports": today_reports,
-            "unresolvedReports": unresolved_reports,
-            "helmetViolations": helmet_violations,
-            "vestViolations": vest_violations
+            "totalReports": stats["total"],
+            "todayReports": stats["today"],
+            "unresolvedReports": stats["unresolved"],
+            "helmetViolations": stats["helmet"],
+            "vestViolations": stats["vest"]
         }), 200
         
     except Exception as e:
@@ -1,21 +1,217 @@
 # notifications.py
-from flask_socketio import SocketIO, emit
+from flask import current_app, request
+from flask_socketio import SocketIO, emit, join_room, ConnectionRefusedError
+from bson import ObjectId
 import datetime
+import threading
+import jwt
+from utils.auth import decode_token, STAFF_ROLES
 
 socketio = SocketIO()
 
+# ---------------- ROOMS ----------------
+# Every connection joins role:<role> and user:<email> (plus user:<user id> for tokens
+# that carry it), so alerts reach staff and their assignee instead of every phone.
+
+def role_room(role):
+    return f"role:{role}"
+
+def user_room(user):
+    return f"user:{user}"
+
+# Helper function to pick the rooms an alert notification goes to: all staff, plus the assignees
+def alert_rooms(*assignees):
+    rooms = {role_room(role) for role in STAFF_ROLES}
+    rooms.update(user_room(assignee) for assignee in assignees if assignee)
+    return rooms
+
+@socketio.on('connect', namespace='/alerts')
+def alerts_connect(auth=None):
+    """Authenticate the client with its JWT and put it in its role and user rooms"""
+    token = (auth or {}).get("token") or request.headers.get("Authorization") or request.args.get("token")
+    if not token:
+        raise ConnectionRefusedError("Missing token")
+    if token.startswith("Bearer "):
+        token = token[7:]
+    
+    try:
+        claims = decode_token(token)
+    except jwt.ExpiredSignatureError:
+        raise ConnectionRefusedError("Token expired")
+    except jwt.InvalidTokenError:
+        raise ConnectionRefusedError("Invalid token")
+    
+    join_room(role_room(claims.get("role")))
+    join_room(user_room(claims.get("email")))
+    if claims.get("uid"):
+        join_room(user_room(claims["uid"]))
+
+# Helper function to emit an event; a failed notification must never fail the write that triggered it
+def _emit(event, payload, rooms, namespace='/alerts'):
+    try:
+        socketio.emit(event, payload, namespace=namespace, to=sorted(rooms))
+    except Exception as e:
+        current_app.logger.error(f"Notification error ({event}): {str(e)}")
+
+# ---------------- UPDATE COALESCING ----------------
+class UpdateCoalescer:
+    """Merges alert_update events for the same alert raised within `window` seconds into one"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}       # alert id -> {"updates", "rooms", "count"}
+
+    def add(self, alert_id, update_data, rooms, window):
+        """Queue an update; the first one for an alert schedules the merged event `window` seconds later"""
+        with self.lock:
+            entry = self.pending.get(alert_id)
+            if entry:
+                entry["updates"].update(update_data)
+                entry["rooms"].update(rooms)
+                entry["count"] += 1
+                return
+            self.pending[alert_id] = {"updates": dict(update_data), "rooms": set(rooms), "count": 1}
+        socketio.start_background_task(self._flush_later, current_app._get_current_object(), alert_id, window)
+
+    def merge_bulk(self, alert_ids, update_data):
+        """Apply a bulk change to pending updates, so their later event doesn't carry older values"""
+        with self.lock:
+            for alert_id in alert_ids:
+                if alert_id in self.pending:
+                    self.pending[alert_id]["updates"].update(update_data)
+
+    # Helper function run as a background task: wait out the window, then send the merged update
+    def _flush_later(self, app, alert_id, window):
+        socketio.sleep(window)
+        with self.lock:
+            entry = self.pending.pop(alert_id, None)
+        if entry:
+            with app.app_context():
+                _emit('alert_update', {
+                    'alertId': alert_id,
+                    'updates': entry["updates"],
+                    'coalesced': entry["count"],
+                    'timestamp': datetime.datetime.now().isoformat()
+                }, entry["rooms"])
+
+coalescer = UpdateCoalescer()
+
+# ---------------- ALERT FORMAT ----------------
+def format_safety_alert(alert, reporter=None):
+    """Safety report in the /alerts list format"""
+    return {
+        "_id": f"safety-{str(alert['_id'])}",
+        "type": "safety",
+        "title": "Safety Violation",
+        "description": f"Worker {alert.get('workerName', 'Unknown')} violated safety protocols: {', '.join(alert.get('violations', []))}",
+        "priority": "high" if len(alert.get('violations', [])) > 1 else "medium",
+        "status": alert.get("status", "Pending Review").lower().replace(" ", "-"),
+        "location": alert.get("location", "Unknown Location"),
+        "reportedBy": alert.get("reportedBy", ""),
+        "reportedByName": reporter["name"] if reporter else alert.get("reportedByName", "Unknown"),
+        "timestamp": alert.get("timestamp", ""),
+        "assignedTo": alert.get("assignedTo", ""),
+        "assignedToName": alert.get("assignedToName", ""),
+        "originalId": str(alert["_id"]),
+        "originalType": "safety"
+    }
+
+def format_emergency_alert(alert, reporter=None, assigned_to=None):
+    """Emergency report in the /alerts list format"""
+    return {
+        "_id": f"emergency-{str(alert['_id'])}",
+        "type": "emergency",
+        "title": f"{alert.get('type', 'Emergency')} Alert",
+        "description": alert.get("description", f"{alert.get('type', 'Emergency')} reported at {alert.get('location', 'unknown location')}"),
+        "priority": alert.get("priority", "medium").lower(),
+        "status": alert.get("status", "Open").lower().replace(" ", "-"),
+        "location": alert.get("location", "Unknown Location"),
+        "reportedBy": alert.get("reportedBy", ""),
+        "reportedByName": reporter["name"] if reporter else alert.get("reportedByName", "Unknown"),
+        "timestamp": alert.get("timestamp", ""),
+        "assignedTo": alert.get("assignedTo", ""),
+        "assignedToName": assigned_to["name"] if assigned_to else alert.get("assignedToName", "Unassigned"),
+        "originalId": str(alert["_id"]),
+        "originalType": "emergency"
+    }
+
+# ---------------- ALERT NOTIFICATIONS ----------------
+# Clients keep their /alerts and /emergencies lists current from these deltas:
+#   new_alert          {alert}                  a created report, in the /alerts list format
+#   alert_update       {alertId, updates}       the stored fields changed (merged over ALERT_COALESCE_WINDOW)
+#   alerts_bulk_update {alertIds, updates}      the same change applied to several alerts
+# They go to the Manager/Supervisor rooms and the rooms of the alert's assignees.
+
 def send_alert_notification(alert_data):
     """Send real-time alert notification to connected supervisors"""
-    socketio.emit('new_alert', {
+    _emit('new_alert', {
         'alert': alert_data,
         'timestamp': datetime.datetime.now().isoformat(),
         'message': 'New alert requires attention'
-    }, namespace='/alerts')
+    }, alert_rooms(alert_data.get("assignedTo")))
+
+def send_new_report_notification(report_type, record):
+    """Send new_alert for a newly inserted "safety" or "emergency" report"""
+    try:
+        formatter = format_safety_alert if report_type == "safety" else format_emergency_alert
+        alert_data = formatter(record)
+    except Exception as e:
+        current_app.logger.error(f"Notification error (new_alert): {str(e)}")
+        return
+    send_alert_notification(alert_data)
 
-def send_alert_update_notification(alert_id, update_data):
-    """Send alert update notification"""
-    socketio.emit('alert_update', {
-        'alertId': alert_id,
+def send_alert_update_notification(alert_id, update_data, previous=None):
+    """Send alert update notification (`previous` is the document before the write, to reach its old assignee)"""
+    rooms = alert_rooms(update_data.get("assignedTo"), (previous or {}).get("assignedTo"))
+    window = current_app.config.get("ALERT_COALESCE_WINDOW", 0)
+    if not window:
+        _emit('alert_update', {
+            'alertId': alert_id,
+            'updates': update_data,
+            'timestamp': datetime.datetime.now().isoformat()
+        }, rooms)
+        return
+    
+    try:
+        coalescer.add(alert_id, update_data, rooms, window)
+    except Exception as e:
+        current_app.logger.error(f"Notification error (alert_update): {str(e)}")
+
+def send_bulk_alert_update_notification(alert_ids, update_data, previous_assignees=()):
+    """Send one notification for every alert a bulk action changed"""
+    coalescer.merge_bulk(alert_ids, update_data)
+    _emit('alerts_bulk_update', {
+        'alertIds': alert_ids,
         'updates': update_data,
         'timestamp': datetime.datetime.now().isoformat()
-    }, namespace='/alerts')
\ No newline at end of file
+    }, alert_rooms(update_data.get("assignedTo"), *previous_assignees))
+
+# ---------------- CHANGES FROM OTHER PROCESSES ----------------
+# Each worker process only reaches its own Socket.IO clients, so reports written by another
+# worker (or outside the app) are relayed here from the change feed. Writes made by this
+# process are notified by the route that made them and arrive here as echoes.
+
+# Collection topic -> report type
+REPORT_TYPES = {"safety": "safety", "emergencies": "emergency"}
+
+# Helper function to make Mongo values (ObjectId, datetime) safe to emit
+def _plain(value):
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+def relay_change(topic, event):
+    """Event-bus callback: send new_alert / alert_update for a report another process wrote"""
+    if event.get("source") == "local" or event.get("echo") or topic not in REPORT_TYPES:
+        return
+    report_type = REPORT_TYPES[topic]
+    if event.get("op") == "insert" and event.get("document"):
+        send_new_report_notification(report_type, _plain(event["document"]))
+    elif event.get("op") == "update" and event.get("updates"):
+        send_alert_update_notification(f"{report_type}-{event['id']}", _plain(event["updates"]))
@@ -1,30 +1,23 @@
 # alerts_routes.py
-from flask import Blueprint, request, jsonify, current_app
-import jwt
+from flask import Blueprint, request, jsonify, current_app, g
 import datetime
 from bson import ObjectId
 from datetime import datetime, timedelta
 import re
+from utils.auth import auth_required, STAFF_ROLES
+from utils.stats import facet_stats
+from utils.pagination import CursorError, page_params, keyset_query, sort_spec, keyset_sort_key, cursor_after, page_response
+from utils.user_resolver import load_users, get_user_by_id
+from utils.events import publish_change
+from utils.change_feed import touch, stamped_update, UPDATED_FROM
+from blueprints.notifications import (
+    format_safety_alert, format_emergency_alert,
+    send_alert_update_notification, send_bulk_alert_update_notification
+)
 
 # Blueprint instance
 alerts_bp = Blueprint("alerts", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -38,28 +31,29 @@ def is_valid_objectid(objectid_str):
 
 # ---------------- ALERTS MANAGEMENT ----------------
 @alerts_bp.route("/alerts", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_alerts():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters for filtering
         status_filter = request.args.get('status', 'all')
         type_filter = request.args.get('type', 'all')
         priority_filter = request.args.get('priority', 'all')
         
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Get unresolved safety violations
         safety_query = {"resolved": False}
         if status_filter != 'all':
             safety_query["status"] = status_filter.title()
         
-        safety_alerts = list(safety_col.find(safety_query))
-        
         # Get unresolved emergencies
         emergency_query = {"resolved": False}
         if status_filter != 'all':
@@ -67,70 +61,50 @@ def get_alerts():
         if priority_filter != 'all':
             emergency_query["priority"] = priority_filter.title()
         
-        emergency_alerts = list(emergency_col.find(emergency_query))
+        next_cursor = None
+        if limit:
+            # Take one page from each collection, merge newest first and keep the first `limit`
+            safety_alerts = []
+            emergency_alerts = []
+            if type_filter in ['all', 'safety']:
+                safety_alerts = list(safety_col.find(keyset_query(safety_query, "timestamp", after))
+                                     .sort(sort_spec("timestamp")).limit(limit + 1))
+            if type_filter in ['all', 'emergency']:
+                emergency_alerts = list(emergency_col.find(keyset_query(emergency_query, "timestamp", after))
+                                        .sort(sort_spec("timestamp")).limit(limit + 1))
+            page = sorted(safety_alerts + emergency_alerts, key=keyset_sort_key, reverse=True)
+            if len(page) > limit:
+                page = page[:limit]
+                next_cursor = cursor_after(page[-1], "timestamp")
+            page_ids = {alert["_id"] for alert in page}
+            safety_alerts = [alert for alert in safety_alerts if alert["_id"] in page_ids]
+            emergency_alerts = [alert for alert in emergency_alerts if alert["_id"] in page_ids]
+        else:
+            safety_alerts = list(safety_col.find(safety_query))
+            emergency_alerts = list(emergency_col.find(emergency_query))
+        
+        # Resolve reporters and assignees for both alert types in one batch
+        users = load_users(users_col, safety_alerts + emergency_alerts, ["reportedBy", "assignedTo"])
         
         # Transform safety violations to alert format
-        formatted_safety_alerts = []
-        for alert in safety_alerts:
-            # Get reporter info
-            reporter = None
-            if is_valid_objectid(alert.get("reportedBy", "")):
-                reporter = users_col.find_one({"_id": ObjectId(alert["reportedBy"])})
-            
-            # Get worker info
-            worker = None
-            if is_valid_objectid(alert.get("workerId", "")):
-                worker = users_col.find_one({"_id": ObjectId(alert["workerId"])})
-            
-            formatted_safety_alerts.append({
-                "_id": f"safety-{str(alert['_id'])}",
-                "type": "safety",
-                "title": "Safety Violation",
-                "description": f"Worker {alert.get('workerName', 'Unknown')} violated safety protocols: {', '.join(alert.get('violations', []))}",
-                "priority": "high" if len(alert.get('violations', [])) > 1 else "medium",
-                "status": alert.get("status", "Pending Review").lower().replace(" ", "-"),
-                "location": alert.get("location", "Unknown Location"),
-                "reportedBy": alert.get("reportedBy", ""),
-                "reportedByName": reporter["name"] if reporter else alert.get("reportedByName", "Unknown"),
-                "timestamp": alert.get("timestamp", ""),
-                "assignedTo": alert.get("assignedTo", ""),
-                "assignedToName": alert.get("assignedToName", ""),
-                "originalId": str(alert["_id"]),
-                "originalType": "safety"
-            })
+        formatted_safety_alerts = [
+            format_safety_alert(alert, users.by_id(alert.get("reportedBy", "")))
+            for alert in safety_alerts
+        ]
         
         # Transform emergencies to alert format
-        formatted_emergency_alerts = []
-        for alert in emergency_alerts:
-            # Get reporter info
-            reporter = None
-            if is_valid_objectid(alert.get("reportedBy", "")):
-                reporter = users_col.find_one({"_id": ObjectId(alert["reportedBy"])})
-            
-            # Get assigned to info
-            assigned_to = None
-            if is_valid_objectid(alert.get("assignedTo", "")):
-                assigned_to = users_col.find_one({"_id": ObjectId(alert["assignedTo"])})
-            
-            formatted_emergency_alerts.append({
-                "_id": f"emergency-{str(alert['_id'])}",
-                "type": "emergency",
-                "title": f"{alert.get('type', 'Emergency')} Alert",
-                "description": alert.get("description", f"{alert.get('type', 'Emergency')} reported at {alert.get('location', 'unknown location')}"),
-                "priority": alert.get("priority", "medium").lower(),
-                "status": alert.get("status", "Open").lower().replace(" ", "-"),
-                "location": alert.get("location", "Unknown Location"),
-                "reportedBy": alert.get("reportedBy", ""),
-                "reportedByName": reporter["name"] if reporter else alert.get("reportedByName", "Unknown"),
-                "timestamp": alert.get("timestamp", ""),
-                "assignedTo": alert.get("assignedTo", ""),
-                "assignedToName": assigned_to["name"] if assigned_to else alert.get("assignedToName", "Unassigned"),
-                "originalId": str(alert["_id"]),
-                "originalType": "emergency"
-            })
+        formatted_emergency_alerts = [
+            format_emergency_alert(alert, users.by_id(alert.get("reportedBy", "")), users.by_id(alert.get("assignedTo", "")))
+            for alert in emergency_alerts
+        ]
         
         # Combine and sort alerts by timestamp (newest first)
         all_alerts = formatted_safety_alerts + formatted_emergency_alerts
+        if limit:
+            # Keep the (timestamp, _id) order the cursor was built from
+            position = {str(alert["_id"]): index for index, alert in enumerate(page)}
+            all_alerts.sort(key=lambda x: position[x["originalId"]])
+            return page_response(all_alerts, next_cursor), 200
         all_alerts.sort(key=lambda x: x["timestamp"], reverse=True)
         
         # Apply type filter
@@ -145,16 +119,13 @@ def get_alerts():
 
 # ---------------- ALERT ACTIONS ----------------
 @alerts_bp.route("/alerts/<alert_id>", methods=["PUT"])
+@auth_required(*STAFF_ROLES)
 def update_alert(alert_id):
     safety_col = current_app.config["SAFETY_COLLECTION"]
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         data = request.json
         
         # Parse alert ID to determine type
@@ -182,10 +153,9 @@ def update_alert(alert_id):
         if "assignedTo" in data:
             update_data["assignedTo"] = data["assignedTo"]
             # Resolve assigned to name
-            if data["assignedTo"] and is_valid_objectid(data["assignedTo"]):
-                assigned_user = users_col.find_one({"_id": ObjectId(data["assignedTo"])})
-                if assigned_user:
-                    update_data["assignedToName"] = assigned_user["name"]
+            assigned_user = get_user_by_id(users_col, data["assignedTo"])
+            if assigned_user:
+                update_data["assignedToName"] = assigned_user["name"]
         if "resolution" in data:
             update_data["resolution"] = data["resolution"]
         if "resolved" in data:
@@ -194,12 +164,12 @@ def update_alert(alert_id):
                 update_data["resolvedAt"] = datetime.now().isoformat()
         
         # Update the alert
-        result = collection.update_one(
-            {"_id": ObjectId(original_id)}, 
-            {"$set": update_data}
-        )
+        result = collection.update_one(*stamped_update({"_id": ObjectId(original_id)}, update_data))
         
         if result.modified_count:
+            publish_change(collection.name, "update", id=original_id)
+            send_alert_update_notification(alert_id, update_data, previous=alert)
+            
             # Return updated alert
             updated_alert = collection.find_one({"_id": ObjectId(original_id)})
             
@@ -215,15 +185,9 @@ def update_alert(alert_id):
                 description = updated_alert.get("description", f"{updated_alert.get('type', 'Emergency')} reported at {updated_alert.get('location', 'unknown location')}")
                 priority = updated_alert.get("priority", "medium").lower()
             
-            # Get reporter info
-            reporter = None
-            if is_valid_objectid(updated_alert.get("reportedBy", "")):
-                reporter = users_col.find_one({"_id": ObjectId(updated_alert["reportedBy"])})
-            
-            # Get assigned to info
-            assigned_to = None
-            if is_valid_objectid(updated_alert.get("assignedTo", "")):
-                assigned_to = users_col.find_one({"_id": ObjectId(updated_alert["assignedTo"])})
+            # Get reporter and assigned to info (assignee is usually already loaded above)
+            reporter = get_user_by_id(users_col, updated_alert.get("reportedBy", ""))
+            assigned_to = get_user_by_id(users_col, updated_alert.get("assignedTo", ""))
             
             formatted_alert = {
                 "_id": alert_id,
@@ -256,69 +220,46 @@ def update_alert(alert_id):
 
 # ---------------- ALERT STATS ----------------
 @alerts_bp.route("/alerts/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def alert_stats():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get today's date for filtering
         today = datetime.now().date()
         today_start = datetime(today.year, today.month, today.day)
         today_end = datetime(today.year, today.month, today.day, 23, 59, 59)
         
-        # Calculate statistics for safety alerts
-        total_safety = safety_col.count_documents({"resolved": False})
-        today_safety = safety_col.count_documents({
-            "timestamp": {
-                "$gte": today_start.isoformat(),
-                "$lte": today_end.isoformat()
-            },
-            "resolved": False
-        })
+        today_range = {
+            "$gte": today_start.isoformat(),
+            "$lte": today_end.isoformat()
+        }
         
-        # Calculate statistics for emergency alerts
-        total_emergency = emergency_col.count_documents({"resolved": False})
-        today_emergency = emergency_col.count_documents({
-            "timestamp": {
-                "$gte": today_start.isoformat(),
-                "$lte": today_end.isoformat()
-            },
-            "resolved": False
-        })
+        # Counters shared by both alert sources
+        alert_spec = {
+            "unresolved": {"resolved": False},
+            "today": {"timestamp": today_range, "resolved": False},
+            "resolvedToday": {"resolvedAt": today_range, "resolved": True}
+        }
         
-        # Count critical emergencies
-        critical_emergencies = emergency_col.count_documents({
-            "priority": "Critical",
-            "resolved": False
+        # One $facet round trip per collection
+        safety_stats = facet_stats(safety_col, alert_spec)
+        emergency_stats = facet_stats(emergency_col, {
+            **alert_spec,
+            "critical": {"priority": "Critical", "resolved": False}
         })
         
-        # Count resolved today
-        resolved_today = emergency_col.count_documents({
-            "resolvedAt": {
-                "$gte": today_start.isoformat(),
-                "$lte": today_end.isoformat()
-            },
-            "resolved": True
-        }) + safety_col.count_documents({
-            "resolvedAt": {
-                "$gte": today_start.isoformat(),
-                "$lte": today_end.isoformat()
-            },
-            "resolved": True
-        })
+        total_alerts = safety_stats["unresolved"] + emergency_stats["unresolved"]
         
         return jsonify({
-            "totalAlerts": total_safety + total_emergency,
-            "pendingAlerts": total_safety + total_emergency,  # All are pending resolution
-            "criticalAlerts": critical_emergencies,
-            "resolvedToday": resolved_today,
-            "safetyAlerts": total_safety,
-            "emergencyAlerts": total_emergency,
-            "todayAlerts": today_safety + today_emergency
+            "totalAlerts": total_alerts,
+            "pendingAlerts": total_alerts,  # All are pending resolution
+            "criticalAlerts": emergency_stats["critical"],
+            "resolvedToday": safety_stats["resolvedToday"] + emergency_stats["resolvedToday"],
+            "safetyAlerts": safety_stats["unresolved"],
+            "emergencyAlerts": emergency_stats["unresolved"],
+            "todayAlerts": safety_stats["today"] + emergency_stats["today"]
         }), 200
         
     except Exception as e:
@@ -327,14 +268,13 @@ def alert_stats():
 
 # ---------------- BULK ALERT ACTIONS ----------------
 @alerts_bp.route("/alerts/bulk", methods=["POST"])
+@auth_required(*STAFF_ROLES)
 def bulk_alert_actions():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        decoded = g.claims
         
         data = request.json
         alert_ids = data.get("alertIds", [])
@@ -349,60 +289,102 @@ def bulk_alert_actions():
             "details": []
         }
         
+        # Prepare update based on action
+        update_data = {}
+        if action == "acknowledge":
+            update_data["status"] = "In Progress"
+        elif action == "resolve":
+            update_data["status"] = "Resolved"
+            update_data["resolved"] = True
+            update_data["resolvedAt"] = datetime.now().isoformat()
+            update_data["resolution"] = "Bulk resolution by supervisor"
+        elif action == "assign-to-me":
+            update_data["assignedTo"] = decoded.get("email", "")
+            update_data["assignedToName"] = decoded.get("name", "Current User")
+            update_data["status"] = "In Progress"
+        
+        # Group alert IDs by the collection their prefix points at
+        outcomes = {}
+        ids_by_prefix = {"safety-": {}, "emergency-": {}}
         for alert_id in alert_ids:
+            if not isinstance(alert_id, str) or alert_id in outcomes:
+                continue
+            prefix = next((p for p in ids_by_prefix if alert_id.startswith(p)), None)
+            if not prefix:
+                outcomes[alert_id] = "Invalid alert ID format"
+                continue
+            
+            # Validate alert ID
+            original_id = alert_id[len(prefix):]
+            if not ObjectId.is_valid(original_id):
+                outcomes[alert_id] = "Invalid alert ID"
+            elif not update_data:
+                outcomes[alert_id] = "Invalid action"
+            else:
+                ids_by_prefix[prefix][alert_id] = ObjectId(original_id)
+                outcomes[alert_id] = None
+        
+        # Only alerts not already in the target state count as changed, as with update_one's modified_count
+        needs_change = {"$or": [{field: {"$ne": value}} for field, value in update_data.items()]}
+        collections = {"safety-": safety_col, "emergency-": emergency_col}
+        previous_assignees = set()
+        for prefix, ids in ids_by_prefix.items():
+            if not ids:
+                continue
             try:
-                # Parse alert ID to determine type
-                if alert_id.startswith("safety-"):
-                    original_id = alert_id.replace("safety-", "")
-                    collection = safety_col
-                elif alert_id.startswith("emergency-"):
-                    original_id = alert_id.replace("emergency-", "")
-                    collection = emergency_col
-                else:
-                    results["failed"] += 1
-                    results["details"].append({"alertId": alert_id, "error": "Invalid alert ID format"})
-                    continue
-                
-                # Validate alert exists
-                if not ObjectId.is_valid(original_id):
-                    results["failed"] += 1
-                    results["details"].append({"alertId": alert_id, "error": "Invalid alert ID"})
-                    continue
+                collection = collections[prefix]
+                query = {"_id": {"$in": list(ids.values())}, **needs_change}
+                before = {}
+                if "assignedTo" in update_data:
+                    # Reassigning overwrites who had the alert, so that has to be read first
+                    before = {doc["_id"]: doc.get("assignedTo") for doc in collection.find(query, {"_id": 1, "assignedTo": 1})}
                 
-                # Prepare update based on action
-                update_data = {}
-                if action == "acknowledge":
-                    update_data["status"] = "In Progress"
-                elif action == "resolve":
-                    update_data["status"] = "Resolved"
-                    update_data["resolved"] = True
-                    update_data["resolvedAt"] = datetime.now().isoformat()
-                    update_data["resolution"] = "Bulk resolution by supervisor"
-                elif action == "assign-to-me":
-                    update_data["assignedTo"] = decoded.get("email", "")
-                    update_data["assignedToName"] = decoded.get("name", "Current User")
-                    update_data["status"] = "In Progress"
+                # The write's own stamp (unique per write) marks exactly the alerts this update changed
+                stamped = touch(update_data)
+                result = collection.update_many(query, {"$set": stamped})
+                if result.modified_count == len(ids) and "assignedTo" in update_data:
+                    # Every alert changed, and who had them was read above
+                    changed = {object_id: before.get(object_id) for object_id in ids.values()}
+                elif result.modified_count:
+                    marked = {"_id": {"$in": list(ids.values())}, UPDATED_FROM: stamped[UPDATED_FROM]}
+                    changed = {
+                        doc["_id"]: before.get(doc["_id"], doc.get("assignedTo"))
+                        for doc in collection.find(marked, {"_id": 1, "assignedTo": 1})
+                    }
                 else:
-                    results["failed"] += 1
-                    results["details"].append({"alertId": alert_id, "error": "Invalid action"})
-                    continue
-                
-                # Update the alert
-                result = collection.update_one(
-                    {"_id": ObjectId(original_id)}, 
-                    {"$set": update_data}
-                )
-                
+                    changed = {}
+                previous_assignees.update(assignee for assignee in changed.values() if assignee)
                 if result.modified_count:
-                    results["successful"] += 1
-                    results["details"].append({"alertId": alert_id, "status": "success"})
-                else:
-                    results["failed"] += 1
-                    results["details"].append({"alertId": alert_id, "error": "Alert not found or no changes made"})
-                    
+                    publish_change(collection.name, "bulk")
+                for alert_id, object_id in ids.items():
+                    outcomes[alert_id] = None if object_id in changed else "Alert not found or no changes made"
             except Exception as e:
+                for alert_id in ids:
+                    outcomes[alert_id] = str(e)
+        
+        # One notification for everything the action changed
+        changed_ids = [alert_id for alert_id, error in outcomes.items() if error is None]
+        if changed_ids:
+            send_bulk_alert_update_notification(changed_ids, update_data, previous_assignees)
+        
+        # Per-ID outcomes in request order
+        reported = set()
+        for alert_id in alert_ids:
+            if not isinstance(alert_id, str):
+                error = "Invalid alert ID format"
+            else:
+                error = outcomes[alert_id]
+                if not error and alert_id in reported:
+                    # Repeated ID: the first occurrence already made the change
+                    error = "Alert not found or no changes made"
+                reported.add(alert_id)
+            
+            if error:
                 results["failed"] += 1
-                results["details"].append({"alertId": alert_id, "error": str(e)})
+                results["details"].append({"alertId": alert_id, "error": error})
+            else:
+                results["successful"] += 1
+                results["details"].append({"alertId": alert_id, "status": "success"})
         
         return jsonify({
             "message": f"Bulk action completed: {results['successful']} successful, {results['failed']} failed",
@@ -1,30 +1,21 @@
 # attendance_routes.py
-from flask import Blueprint, request, jsonify, current_app
-import jwt
+from flask import Blueprint, request, jsonify, current_app, g
 import datetime
 from bson import ObjectId
 from datetime import datetime, date
 import re
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from utils.auth import auth_required, STAFF_ROLES
+from utils.pagination import CursorError, page_params, paginate_find, page_response
+from utils.work_hours import time_to_minutes, with_minutes, has_times_expr, worked_minutes_expr
+from utils.user_resolver import load_users, get_user_by_id, get_user_by_email
+from utils.events import publish_change
+from utils.change_feed import touch, stamped_update, record_deletion
 
 # Blueprint instance
 attendance_bp = Blueprint("attendance", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -38,15 +29,12 @@ def is_valid_objectid(objectid_str):
 
 # ---------------- GET ATTENDANCE RECORDS ----------------
 @attendance_bp.route("/attendance", methods=["GET"])
+@auth_required()
 def get_attendance():
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters for filtering
         worker_id = request.args.get('workerId')
         start_date = request.args.get('startDate')
@@ -66,18 +54,26 @@ def get_attendance():
         if status:
             query["status"] = status
         
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Get attendance records
-        records = list(attendance_col.find(query))
+        next_cursor = None
+        if limit:
+            records, next_cursor = paginate_find(attendance_col, query, "timestamp", limit, after)
+        else:
+            records = list(attendance_col.find(query))
+        
+        # Resolve workers by ID (or email as fallback) in one batch
+        users = load_users(users_col, records, ["workerId"])
         
         # Enrich records with worker information
         enriched_records = []
         for record in records:
-            worker = None
-            if is_valid_objectid(record["workerId"]):
-                worker = users_col.find_one({"_id": ObjectId(record["workerId"])})
-            else:
-                # Try to find by email as fallback
-                worker = users_col.find_one({"email": record["workerId"]})
+            worker = users.get(record["workerId"])
             
             # Calculate hours worked
             hours_worked = 0
@@ -99,6 +95,8 @@ def get_attendance():
             }
             enriched_records.append(enriched_record)
         
+        if limit:
+            return page_response(enriched_records, next_cursor), 200
         return jsonify(enriched_records), 200
         
     except Exception as e:
@@ -107,14 +105,13 @@ def get_attendance():
 
 # ---------------- CREATE ATTENDANCE RECORD ----------------
 @attendance_bp.route("/attendance", methods=["POST"])
+@auth_required()
 def create_attendance():
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        decoded = g.claims
             
         data = request.json
         
@@ -129,7 +126,7 @@ def create_attendance():
         worker_name = "Unknown Worker"
         
         if is_valid_objectid(data["workerId"]):
-            worker = users_col.find_one({"_id": ObjectId(data["workerId"])})
+            worker = get_user_by_id(users_col, data["workerId"])
             if worker:
                 worker_name = worker["name"]
                 data["workerId"] = str(worker["_id"])  # Store ID as string
@@ -137,7 +134,7 @@ def create_attendance():
                 worker_name = f"Unknown (ID: {data['workerId']})"
         else:
             # Try to find by email
-            worker = users_col.find_one({"email": data["workerId"]})
+            worker = get_user_by_email(users_col, data["workerId"])
             if worker:
                 worker_name = worker["name"]
                 data["workerId"] = str(worker["_id"])  # Store ID instead of email
@@ -173,7 +170,8 @@ def create_attendance():
         }
         
         # Insert the attendance record
-        result = attendance_col.insert_one(attendance_record)
+        result = attendance_col.insert_one(touch(with_minutes(attendance_record)))
+        publish_change("attendance", "insert", id=str(result.inserted_id))
         
         # Calculate hours worked for response
         hours_worked = calculate_hours_worked(attendance_record["checkIn"], attendance_record["checkOut"])
@@ -201,15 +199,12 @@ def create_attendance():
 
 # ---------------- UPDATE ATTENDANCE RECORD ----------------
 @attendance_bp.route("/attendance/<record_id>", methods=["PUT"])
+@auth_required()
 def update_attendance(record_id):
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate record ID
         if not ObjectId.is_valid(record_id):
             return jsonify({"error": "Invalid record ID"}), 400
@@ -236,12 +231,11 @@ def update_attendance(record_id):
                 return jsonify({"error": f"Invalid status. Must be one of: {', '.join(valid_statuses)}"}), 400
         
         # Update the attendance record
-        result = attendance_col.update_one(
-            {"_id": ObjectId(record_id)}, 
-            {"$set": update_data}
-        )
+        result = attendance_col.update_one(*stamped_update({"_id": ObjectId(record_id)}, with_minutes(update_data)))
         
         if result.modified_count:
+            publish_change("attendance", "update", id=record_id)
+            
             # Return updated record
             updated_record = attendance_col.find_one({"_id": ObjectId(record_id)})
             
@@ -252,9 +246,7 @@ def update_attendance(record_id):
             )
             
             # Find worker information
-            worker = None
-            if is_valid_objectid(updated_record["workerId"]):
-                worker = users_col.find_one({"_id": ObjectId(updated_record["workerId"])})
+            worker = get_user_by_id(users_col, updated_record["workerId"])
             
             response_record = {
                 "_id": str(updated_record["_id"]),
@@ -283,14 +275,11 @@ def update_attendance(record_id):
 
 # ---------------- DELETE ATTENDANCE RECORD ----------------
 @attendance_bp.route("/attendance/<record_id>", methods=["DELETE"])
+@auth_required(*STAFF_ROLES)
 def delete_attendance(record_id):
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate record ID
         if not ObjectId.is_valid(record_id):
             return jsonify({"error": "Invalid record ID"}), 400
@@ -299,6 +288,8 @@ def delete_attendance(record_id):
         result = attendance_col.delete_one({"_id": ObjectId(record_id)})
         
         if result.deleted_count:
+            record_deletion(attendance_col, record_id)
+            publish_change("attendance", "delete", id=record_id)
             return jsonify({"message": "Attendance record deleted successfully"}), 200
         else:
             return jsonify({"error": "Attendance record not found"}), 404
@@ -309,14 +300,11 @@ def delete_attendance(record_id):
 
 # ---------------- ATTENDANCE STATS ----------------
 @attendance_bp.route("/attendance/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def attendance_stats():
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters
         start_date = request.args.get('startDate')
         end_date = request.args.get('endDate')
@@ -329,21 +317,34 @@ def attendance_stats():
         if start_date and end_date:
             query["date"] = {"$gte": start_date, "$lte": end_date}
         
-        # Get all matching records
-        records = list(attendance_col.find(query))
-        
-        # Calculate statistics
-        total_records = len(records)
-        present_count = len([r for r in records if r["status"] == "Present"])
-        absent_count = len([r for r in records if r["status"] == "Absent"])
-        late_count = len([r for r in records if r["status"] == "Late"])
-        leave_count = len([r for r in records if r["status"] == "Leave"])
-        half_day_count = len([r for r in records if r["status"] == "Half Day"])
+        # Count statuses and sum worked minutes on the server
+        def status_count(status):
+            return {"$sum": {"$cond": [{"$eq": ["$status", status]}, 1, 0]}}
+        
+        timed_present = {"$and": [{"$eq": ["$status", "Present"]}, has_times_expr()]}
+        pipeline = [
+            {"$match": query},
+            {"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "present": status_count("Present"),
+                "absent": status_count("Absent"),
+                "late": status_count("Late"),
+                "leave": status_count("Leave"),
+                "halfDay": status_count("Half Day"),
+                # Average hours only cover present records with both times set
+                "timedPresent": {"$sum": {"$cond": [timed_present, 1, 0]}},
+                "workedMinutes": {"$sum": {"$cond": [timed_present, worked_minutes_expr(), 0]}}
+            }}
+        ]
+        stats = next(attendance_col.aggregate(pipeline), None) or {
+            "total": 0, "present": 0, "absent": 0, "late": 0, "leave": 0, "halfDay": 0,
+            "timedPresent": 0, "workedMinutes": 0
+        }
         
-        # Calculate average hours worked for present records
-        present_records = [r for r in records if r["status"] == "Present" and r.get("checkIn") and r.get("checkOut")]
-        total_hours = sum(calculate_hours_worked(r["checkIn"], r["checkOut"]) for r in present_records)
-        average_hours = total_hours / len(present_records) if present_records else 0
+        total_records = stats["total"]
+        present_count = stats["present"]
+        average_hours = stats["workedMinutes"] / 60 / stats["timedPresent"] if stats["timedPresent"] else 0
         
         # Calculate attendance rate
         attendance_rate = (present_count / total_records * 100) if total_records > 0 else 0
@@ -351,10 +352,10 @@ def attendance_stats():
         return jsonify({
             "totalRecords": total_records,
             "presentCount": present_count,
-            "absentCount": absent_count,
-            "lateCount": late_count,
-            "leaveCount": leave_count,
-            "halfDayCount": half_day_count,
+            "absentCount": stats["absent"],
+            "lateCount": stats["late"],
+            "leaveCount": stats["leave"],
+            "halfDayCount": stats["halfDay"],
             "attendanceRate": round(attendance_rate, 2),
             "averageHours": round(average_hours, 2)
         }), 200
@@ -365,15 +366,12 @@ def attendance_stats():
 
 # ---------------- TODAY'S ATTENDANCE ----------------
 @attendance_bp.route("/attendance/today", methods=["GET"])
+@auth_required()
 def today_attendance():
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get today's date
         today = date.today().isoformat()
         
@@ -383,10 +381,13 @@ def today_attendance():
         # Get all workers to check who hasn't marked attendance
         all_workers = list(users_col.find({"role": "Worker"}, {"_id": 1, "name": 1, "email": 1}))
         
+        # Resolve today's workers in one batch
+        users = load_users(users_col, records, ["workerId"])
+        
         # Enrich today's records
         today_records = []
         for record in records:
-            worker = users_col.find_one({"_id": ObjectId(record["workerId"])})
+            worker = users.by_id(record["workerId"])
             hours_worked = calculate_hours_worked(record.get("checkIn", ""), record.get("checkOut", ""))
             
             today_records.append({
@@ -429,14 +430,13 @@ def today_attendance():
 
 # ---------------- BULK ATTENDANCE UPDATE ----------------
 @attendance_bp.route("/attendance/bulk", methods=["POST"])
+@auth_required(*STAFF_ROLES)
 def bulk_attendance():
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        decoded = g.claims
             
         data = request.json
         
@@ -452,82 +452,85 @@ def bulk_attendance():
             "failed": []
         }
         
+        # Validate entries
+        valid_entries = []
         for entry in entries:
-            try:
-                # Validate entry
-                if "workerId" not in entry or "status" not in entry:
-                    results["failed"].append({
-                        "workerId": entry.get("workerId", "unknown"),
-                        "error": "Missing workerId or status"
-                    })
-                    continue
-                
-                # Validate worker exists
-                worker = None
-                if is_valid_objectid(entry["workerId"]):
-                    worker = users_col.find_one({"_id": ObjectId(entry["workerId"])})
-                else:
-                    worker = users_col.find_one({"email": entry["workerId"]})
-                
-                if not worker:
-                    results["failed"].append({
-                        "workerId": entry["workerId"],
-                        "error": "Worker not found"
-                    })
-                    continue
-                
-                # Check if record already exists
-                existing_record = attendance_col.find_one({
-                    "workerId": str(worker["_id"]),
-                    "date": date_str
+            if "workerId" not in entry or "status" not in entry:
+                results["failed"].append({
+                    "workerId": entry.get("workerId", "unknown"),
+                    "error": "Missing workerId or status"
                 })
-                
-                if existing_record:
-                    # Update existing record
-                    update_data = {
+            else:
+                valid_entries.append(entry)
+        
+        # Resolve every worker in one batched query
+        workers = load_users(users_col, valid_entries, ["workerId"])
+        
+        # One upsert per worker, keyed on (workerId, date); a later entry for the same worker wins
+        operations = []
+        op_index_by_worker = {}
+        resolved_entries = []
+        timestamp = datetime.now().isoformat()
+        for entry in valid_entries:
+            worker = workers.get(entry["workerId"])
+            if not worker:
+                results["failed"].append({
+                    "workerId": entry["workerId"],
+                    "error": "Worker not found"
+                })
+                continue
+            
+            worker_id = str(worker["_id"])
+            operation = UpdateOne(
+                {"workerId": worker_id, "date": date_str},
+                {
+                    "$set": touch(with_minutes({
                         "status": entry["status"],
                         "checkIn": entry.get("checkIn", ""),
                         "checkOut": entry.get("checkOut", ""),
                         "notes": entry.get("notes", "")
-                    }
-                    
-                    attendance_col.update_one(
-                        {"_id": existing_record["_id"]},
-                        {"$set": update_data}
-                    )
-                    
-                    results["successful"].append({
-                        "workerId": str(worker["_id"]),
+                    })),
+                    "$setOnInsert": {
                         "workerName": worker["name"],
-                        "action": "updated"
-                    })
-                else:
-                    # Create new record
-                    attendance_record = {
-                        "workerId": str(worker["_id"]),
-                        "workerName": worker["name"],
-                        "date": date_str,
-                        "status": entry["status"],
-                        "checkIn": entry.get("checkIn", ""),
-                        "checkOut": entry.get("checkOut", ""),
-                        "notes": entry.get("notes", ""),
                         "createdBy": decoded["email"],
                         "createdByName": decoded.get("name", "Unknown"),
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": timestamp
                     }
-                    
-                    attendance_col.insert_one(attendance_record)
-                    
-                    results["successful"].append({
-                        "workerId": str(worker["_id"]),
-                        "workerName": worker["name"],
-                        "action": "created"
-                    })
-                    
-            except Exception as e:
+                },
+                upsert=True
+            )
+            if worker_id in op_index_by_worker:
+                operations[op_index_by_worker[worker_id]] = operation
+            else:
+                op_index_by_worker[worker_id] = len(operations)
+                operations.append(operation)
+            resolved_entries.append((entry, worker))
+        
+        # Send every upsert in a single unordered round trip
+        upserted_indexes = set()
+        write_errors = {}
+        if operations:
+            try:
+                result = attendance_col.bulk_write(operations, ordered=False)
+                upserted_indexes = set(result.upserted_ids)
+            except BulkWriteError as e:
+                upserted_indexes = {upsert["index"] for upsert in e.details.get("upserted", [])}
+                write_errors = {error["index"]: error.get("errmsg", "Write failed") for error in e.details.get("writeErrors", [])}
+            publish_change("attendance", "bulk")
+        
+        # Report each entry against the outcome of its worker's upsert
+        for entry, worker in resolved_entries:
+            index = op_index_by_worker[str(worker["_id"])]
+            if index in write_errors:
                 results["failed"].append({
-                    "workerId": entry.get("workerId", "unknown"),
-                    "error": str(e)
+                    "workerId": entry["workerId"],
+                    "error": write_errors[index]
+                })
+            else:
+                results["successful"].append({
+                    "workerId": str(worker["_id"]),
+                    "workerName": worker["name"],
+                    "action": "created" if index in upserted_indexes else "updated"
                 })
         
         return jsonify({
@@ -544,15 +547,13 @@ def calculate_hours_worked(check_in, check_out):
     if not check_in or not check_out:
         return 0
     
-    try:
-        # Parse time strings (format: "HH:MM")
-        in_time = datetime.strptime(check_in, "%H:%M")
-        out_time = datetime.strptime(check_out, "%H:%M")
-        
-        # Calculate difference in hours
-        time_diff = out_time - in_time
-        hours_worked = time_diff.total_seconds() / 3600
-        
-        return max(0, hours_worked)  # Ensure non-negative
-    except:
-        return 0
\ No newline at end of file
+    # Parse time strings (format: "HH:MM")
+    in_minutes = time_to_minutes(check_in)
+    out_minutes = time_to_minutes(check_out)
+    if in_minutes is None or out_minutes is None:
+        return 0
+    
+    # Calculate difference in hours
+    hours_worked = (out_minutes - in_minutes) / 60
+    
+    return max(0, hours_worked)  # Ensure non-negative
\ No newline at end of file
@@ -1,30 +1,17 @@
 # new_workers_routes.py
 from flask import Blueprint, request, jsonify, current_app
-import jwt
 import datetime
 from bson import ObjectId
 from datetime import datetime
 import re
+from utils.auth import auth_required, STAFF_ROLES
+from utils.user_directory import versioned_update, USER_PROJECTION
+from utils.change_feed import touch, record_deletion
+from utils.pagination import CursorError, page_params, paginate_find, page_response
 
 # Blueprint instance
 new_workers_bp = Blueprint("new_workers", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -38,14 +25,11 @@ def is_valid_objectid(objectid_str):
 
 # ---------------- NEW WORKERS MANAGEMENT ----------------
 @new_workers_bp.route("/new-workers", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_new_workers():
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters for filtering
         status_filter = request.args.get('status', 'all')
         team_filter = request.args.get('team', 'all')
@@ -64,8 +48,18 @@ def get_new_workers():
         if team_filter != 'all':
             query["team"] = team_filter
         
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Get new workers with sorting (newest first)
-        new_workers = list(users_col.find(query, {"password": 0}).sort("created_at", -1))
+        next_cursor = None
+        if limit:
+            new_workers, next_cursor = paginate_find(users_col, query, "created_at", limit, after, USER_PROJECTION)
+        else:
+            new_workers = list(users_col.find(query, USER_PROJECTION).sort("created_at", -1))
         
         # Enrich with additional data
         enriched_workers = []
@@ -101,6 +95,8 @@ def get_new_workers():
             }
             enriched_workers.append(enriched_worker)
         
+        if limit:
+            return page_response(enriched_workers, next_cursor), 200
         return jsonify(enriched_workers), 200
         
     except Exception as e:
@@ -108,14 +104,12 @@ def get_new_workers():
         return jsonify({"error": "Failed to fetch new workers"}), 500
 
 @new_workers_bp.route("/new-workers", methods=["POST"])
+@auth_required(*STAFF_ROLES)
 def create_new_worker():
     users_col = current_app.config["USERS_COLLECTION"]
+    user_directory = current_app.config["USER_DIRECTORY"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         data = request.json
         
         # Validate required fields
@@ -156,10 +150,11 @@ def create_new_worker():
         }
         
         # Insert new worker
-        result = users_col.insert_one(new_worker)
+        result = users_col.insert_one(touch(new_worker))
         
         # Return created worker (without password)
-        created_worker = users_col.find_one({"_id": result.inserted_id}, {"password": 0})
+        created_worker = users_col.find_one({"_id": result.inserted_id}, USER_PROJECTION)
+        user_directory.add(created_worker)
         
         return jsonify({
             "message": "New worker created successfully",
@@ -178,14 +173,12 @@ def create_new_worker():
         return jsonify({"error": "Failed to create new worker"}), 500
 
 @new_workers_bp.route("/new-workers/<worker_id>", methods=["PUT"])
+@auth_required(*STAFF_ROLES)
 def update_new_worker(worker_id):
     users_col = current_app.config["USERS_COLLECTION"]
+    user_directory = current_app.config["USER_DIRECTORY"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         data = request.json
         
         # Validate worker ID
@@ -210,15 +203,13 @@ def update_new_worker(worker_id):
             if field in data:
                 update_data[field] = data[field]
         
-        # Update the worker
-        result = users_col.update_one(
-            {"_id": ObjectId(worker_id)}, 
-            {"$set": update_data}
-        )
+        # Update the worker (bumps its version so older tokens re-check it)
+        result = users_col.update_one(*versioned_update(worker_id, update_data))
         
         if result.modified_count:
             # Get updated worker
-            updated_worker = users_col.find_one({"_id": ObjectId(worker_id)}, {"password": 0})
+            updated_worker = users_col.find_one({"_id": ObjectId(worker_id)}, USER_PROJECTION)
+            user_directory.replace(worker, updated_worker)
             
             return jsonify({
                 "message": "Worker updated successfully",
@@ -239,14 +230,12 @@ def update_new_worker(worker_id):
         return jsonify({"error": "Failed to update worker"}), 500
 
 @new_workers_bp.route("/new-workers/<worker_id>", methods=["DELETE"])
+@auth_required(*STAFF_ROLES)
 def delete_new_worker(worker_id):
     users_col = current_app.config["USERS_COLLECTION"]
+    user_directory = current_app.config["USER_DIRECTORY"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate worker ID
         if not ObjectId.is_valid(worker_id):
             return jsonify({"error": "Invalid worker ID"}), 400
@@ -258,8 +247,10 @@ def delete_new_worker(worker_id):
         
         # Delete the worker
         result = users_col.delete_one({"_id": ObjectId(worker_id)})
+        user_directory.invalidate(worker)
         
         if result.deleted_count:
+            record_deletion(users_col, worker_id)
             return jsonify({"message": "Worker deleted successfully"}), 200
         else:
             return jsonify({"error": "Worker not found"}), 404
@@ -269,14 +260,11 @@ def delete_new_worker(worker_id):
         return jsonify({"error": "Failed to delete worker"}), 500
 
 @new_workers_bp.route("/new-workers/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def new_workers_stats():
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get date range for new workers (last 30 days)
         thirty_days_ago = (datetime.now() - datetime.timedelta(days=30)).isoformat()
         
@@ -380,12 +368,9 @@ def new_workers_stats():
         return jsonify({"error": "Failed to fetch new workers statistics"}), 500
 
 @new_workers_bp.route("/new-workers/onboarding-checklist", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_onboarding_checklist():
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Standard onboarding checklist for new workers
         onboarding_checklist = [
             {
@@ -1,42 +1,30 @@
 # progress_routes.py
-from flask import Blueprint, request, jsonify, current_app
-import jwt
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 import datetime
 from bson import ObjectId
 from datetime import datetime, timedelta
 import re
+import csv
+import io
+import json
+from utils.auth import auth_required, STAFF_ROLES
+from utils.stats import facet_stats
+from utils.fanout import fan_out, FanoutTimeout
+from utils.user_directory import USER_PROJECTION
+from utils.change_feed import STAMP_PROJECTION
 
 # Blueprint instance
 progress_bp = Blueprint("progress", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # ---------------- PROGRESS REPORTS ----------------
 @progress_bp.route("/progress/reports", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_progress_reports():
     tasks_col = current_app.config["TASKS_COLLECTION"]
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters
         start_date = request.args.get('startDate')
         end_date = request.args.get('endDate')
@@ -54,11 +42,11 @@ def get_progress_reports():
         # Get all workers
         workers = list(users_col.find({"role": "Worker"}, {"_id": 1, "name": 1, "email": 1}))
         
-        # Get tasks data
-        tasks = list(tasks_col.find({}))
+        # Get tasks data (only the fields the report reads)
+        tasks = tasks_col.find({}, REPORT_TASK_PROJECTION)
         
         # Get attendance data
-        attendance = list(attendance_col.find(date_filter))
+        attendance = attendance_col.find(date_filter, REPORT_ATTENDANCE_PROJECTION)
         
         # Calculate statistics
         report_data = generate_progress_report(workers, tasks, attendance, start_date, end_date)
@@ -70,57 +58,50 @@ def get_progress_reports():
         return jsonify({"error": "Failed to generate progress reports"}), 500
 
 @progress_bp.route("/progress/summary", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_progress_summary():
     tasks_col = current_app.config["TASKS_COLLECTION"]
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get date range (default: last 30 days)
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=30)
         
-        # Get tasks summary
-        tasks_summary = {
-            "total": tasks_col.count_documents({}),
-            "completed": tasks_col.count_documents({"status": {"$in": ["Completed", "Approved"]}}),
-            "in_progress": tasks_col.count_documents({"status": "In Progress"}),
-            "pending": tasks_col.count_documents({"status": "Pending"}),
-            "overdue": tasks_col.count_documents({
-                "deadline": {"$lt": end_date.isoformat()},
-                "status": {"$nin": ["Completed", "Approved"]}
-            })
-        }
+        date_range = {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
         
-        # Get attendance summary
-        attendance_summary = {
-            "total_days": attendance_col.count_documents({
-                "date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
-            }),
-            "present": attendance_col.count_documents({
-                "date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
-                "status": "Present"
+        # Task, attendance and productivity figures come from independent reads, so run them side by side
+        results = fan_out({
+            # Get tasks summary
+            "tasks": lambda: facet_stats(tasks_col, {
+                "total": {},
+                "completed": {"status": {"$in": ["Completed", "Approved"]}},
+                "in_progress": {"status": "In Progress"},
+                "pending": {"status": "Pending"},
+                "overdue": {
+                    "deadline": {"$lt": end_date.isoformat()},
+                    "status": {"$nin": ["Completed", "Approved"]}
+                }
             }),
-            "absent": attendance_col.count_documents({
-                "date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
-                "status": "Absent"
-            }),
-            "late": attendance_col.count_documents({
-                "date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()},
-                "status": "Late"
-            })
-        }
-        
-        # Calculate productivity metrics
-        completed_tasks = tasks_col.find({
-            "status": {"$in": ["Completed", "Approved"]},
-            "completedAt": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
+            # Get attendance summary
+            "attendance": lambda: facet_stats(attendance_col, {
+                "total_days": {},
+                "present": {"status": "Present"},
+                "absent": {"status": "Absent"},
+                "late": {"status": "Late"}
+            }, match={"date": date_range}),
+            # Calculate productivity metrics
+            "completed_tasks": lambda: list(tasks_col.find({
+                "status": {"$in": ["Completed", "Approved"]},
+                "completedAt": date_range
+            }, {"_id": 0, "createdAt": 1, "completedAt": 1}))
         })
         
-        total_completed = completed_tasks.count()
+        tasks_summary = results["tasks"]
+        attendance_summary = results["attendance"]
+        completed_tasks = results["completed_tasks"]
+        
+        total_completed = len(completed_tasks)
         avg_completion_time = calculate_average_completion_time(completed_tasks)
         
         summary = {
@@ -139,93 +120,165 @@ def get_progress_summary():
         
         return jsonify(summary), 200
         
+    except FanoutTimeout as e:
+        current_app.logger.error(f"Progress summary timeout: {str(e)}")
+        return jsonify({"error": "Progress summary timed out"}), 504
     except Exception as e:
         current_app.logger.error(f"Progress summary error: {str(e)}")
         return jsonify({"error": "Failed to generate progress summary"}), 500
 
 @progress_bp.route("/progress/export", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def export_progress_report():
     tasks_col = current_app.config["TASKS_COLLECTION"]
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
+    batch_size = current_app.config.get("EXPORT_BATCH_SIZE", 500)
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters
         start_date = request.args.get('startDate')
         end_date = request.args.get('endDate')
         report_type = request.args.get('type', 'csv')
         
-        # Generate report data
-        workers = list(users_col.find({"role": "Worker"}))
-        tasks = list(tasks_col.find({}))
-        attendance = list(attendance_col.find({
+        if report_type == "json":
+            report_type = "ndjson"
+        if report_type not in EXPORT_FORMATS:
+            return jsonify({"error": f"Invalid export type. Must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+        
+        attendance_filter = {
             "date": {"$gte": start_date, "$lte": end_date}
-        })) if start_date and end_date else list(attendance_col.find({}))
+        } if start_date and end_date else {}
         
-        report_data = generate_export_data(workers, tasks, attendance, report_type)
+        # Server-side cursors, read lazily while the response is written
+        sections = [
+            ("workers", lambda: users_col.find({"role": "Worker"}, USER_PROJECTION).batch_size(batch_size)),
+            ("tasks", lambda: tasks_col.find({}, STAMP_PROJECTION).batch_size(batch_size)),
+            ("attendance", lambda: attendance_col.find(attendance_filter, STAMP_PROJECTION).batch_size(batch_size))
+        ]
         
-        return jsonify({
-            "data": report_data,
-            "format": report_type,
-            "generated_at": datetime.now().isoformat()
-        }), 200
+        generated_at = datetime.now().isoformat()
+        if report_type == "csv":
+            rows = generate_csv_export(sections, batch_size)
+        else:
+            rows = generate_ndjson_export(sections, batch_size, {
+                "type": "meta",
+                "startDate": start_date,
+                "endDate": end_date,
+                "generated_at": generated_at
+            })
+        
+        filename = f"progress-report-{generated_at[:10]}.{report_type}"
+        return Response(
+            stream_with_context(rows),
+            mimetype=EXPORT_FORMATS[report_type],
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                "X-Accel-Buffering": "no"
+            }
+        )
         
     except Exception as e:
         current_app.logger.error(f"Export progress error: {str(e)}")
         return jsonify({"error": "Failed to export progress report"}), 500
 
 # Helper functions
+COMPLETED_STATUSES = ("Completed", "Approved")
+
+# Fields generate_progress_report reads
+REPORT_TASK_PROJECTION = {"_id": 0, "assignedTo": 1, "status": 1, "deadline": 1}
+REPORT_ATTENDANCE_PROJECTION = {"_id": 0, "workerId": 1, "status": 1}
+
+# Helper function to bucket tasks by assignee and summarise them in one pass
+def group_tasks(tasks):
+    """({assignedTo: {"assigned", "completed"}}, task summary)"""
+    today = datetime.now().date()
+    groups = {}
+    summary = {"total": 0, "completed": 0, "in_progress": 0, "pending": 0, "overdue": 0}
+    
+    for task in tasks:
+        status = task.get("status")
+        completed = status in COMPLETED_STATUSES
+        
+        group = groups.setdefault(task.get("assignedTo"), {"assigned": 0, "completed": 0})
+        group["assigned"] += 1
+        
+        summary["total"] += 1
+        if completed:
+            group["completed"] += 1
+            summary["completed"] += 1
+        elif status == "In Progress":
+            summary["in_progress"] += 1
+        elif status == "Pending":
+            summary["pending"] += 1
+        
+        if (task.get("deadline") and not completed and
+                datetime.strptime(task["deadline"], "%Y-%m-%d").date() < today):
+            summary["overdue"] += 1
+    
+    return groups, summary
+
+# Helper function to bucket attendance by worker and summarise it in one pass
+def group_attendance(attendance):
+    """({workerId: {"records", "present"}}, {status: count}, total records)"""
+    groups = {}
+    status_counts = {}
+    total = 0
+    
+    for record in attendance:
+        status = record.get("status")
+        group = groups.setdefault(record.get("workerId"), {"records": 0, "present": 0})
+        group["records"] += 1
+        if status == "Present":
+            group["present"] += 1
+        status_counts[status] = status_counts.get(status, 0) + 1
+        total += 1
+    
+    return groups, status_counts, total
+
 def generate_progress_report(workers, tasks, attendance, start_date, end_date):
     """Generate comprehensive progress report"""
     
+    task_groups, task_status_count = group_tasks(tasks)
+    attendance_groups, attendance_counts, attendance_total = group_attendance(attendance)
+    empty_tasks = {"assigned": 0, "completed": 0}
+    empty_attendance = {"records": 0, "present": 0}
+    
     # Worker performance analysis
     worker_performance = []
     for worker in workers:
         worker_id = str(worker["_id"])
         
-        # Tasks assigned to this worker
-        worker_tasks = [t for t in tasks if t.get("assignedTo") == worker_id or t.get("assignedTo") == worker.get("email")]
-        completed_tasks = [t for t in worker_tasks if t.get("status") in ["Completed", "Approved"]]
+        # Tasks assigned to this worker, by id or by email
+        by_id = task_groups.get(worker_id, empty_tasks)
+        by_email = task_groups.get(worker.get("email"), empty_tasks) if worker.get("email") != worker_id else empty_tasks
+        worker_tasks = {
+            "assigned": by_id["assigned"] + by_email["assigned"],
+            "completed": by_id["completed"] + by_email["completed"]
+        }
         
         # Attendance for this worker
-        worker_attendance = [a for a in attendance if a.get("workerId") == worker_id]
-        present_days = len([a for a in worker_attendance if a.get("status") == "Present"])
+        worker_attendance = attendance_groups.get(worker_id, empty_attendance)
         
         worker_performance.append({
             "worker_id": worker_id,
             "worker_name": worker.get("name", "Unknown"),
-            "tasks_assigned": len(worker_tasks),
-            "tasks_completed": len(completed_tasks),
-            "completion_rate": (len(completed_tasks) / len(worker_tasks) * 100) if len(worker_tasks) > 0 else 0,
-            "attendance_days": present_days,
+            "tasks_assigned": worker_tasks["assigned"],
+            "tasks_completed": worker_tasks["completed"],
+            "completion_rate": (worker_tasks["completed"] / worker_tasks["assigned"] * 100) if worker_tasks["assigned"] > 0 else 0,
+            "attendance_days": worker_attendance["present"],
             "performance_score": calculate_performance_score(worker_tasks, worker_attendance)
         })
     
-    # Project progress analysis
-    task_status_count = {
-        "total": len(tasks),
-        "completed": len([t for t in tasks if t.get("status") in ["Completed", "Approved"]]),
-        "in_progress": len([t for t in tasks if t.get("status") == "In Progress"]),
-        "pending": len([t for t in tasks if t.get("status") == "Pending"]),
-        "overdue": len([t for t in tasks if 
-            t.get("deadline") and 
-            datetime.strptime(t["deadline"], "%Y-%m-%d").date() < datetime.now().date() and
-            t.get("status") not in ["Completed", "Approved"]
-        ])
-    }
-    
     # Attendance summary
+    present = attendance_counts.get("Present", 0)
     attendance_summary = {
-        "total_records": len(attendance),
-        "present": len([a for a in attendance if a.get("status") == "Present"]),
-        "absent": len([a for a in attendance if a.get("status") == "Absent"]),
-        "late": len([a for a in attendance if a.get("status") == "Late"]),
-        "leave": len([a for a in attendance if a.get("status") == "Leave"]),
-        "attendance_rate": (len([a for a in attendance if a.get("status") == "Present"]) / len(attendance) * 100) if len(attendance) > 0 else 0
+        "total_records": attendance_total,
+        "present": present,
+        "absent": attendance_counts.get("Absent", 0),
+        "late": attendance_counts.get("Late", 0),
+        "leave": attendance_counts.get("Leave", 0),
+        "attendance_rate": (present / attendance_total * 100) if attendance_total > 0 else 0
     }
     
     return {
@@ -239,17 +292,15 @@ def generate_progress_report(workers, tasks, attendance, start_date, end_date):
         "generated_at": datetime.now().isoformat()
     }
 
-def calculate_performance_score(tasks, attendance):
-    """Calculate worker performance score"""
-    if not tasks:
+def calculate_performance_score(task_counts, attendance_counts):
+    """Calculate worker performance score from grouped task/attendance counts"""
+    if not task_counts["assigned"]:
         return 0
     
-    completed_tasks = len([t for t in tasks if t.get("status") in ["Completed", "Approved"]])
-    task_score = (completed_tasks / len(tasks)) * 50
+    task_score = (task_counts["completed"] / task_counts["assigned"]) * 50
     
-    if attendance:
-        present_days = len([a for a in attendance if a.get("status") == "Present"])
-        attendance_score = (present_days / len(attendance)) * 50
+    if attendance_counts["records"]:
+        attendance_score = (attendance_counts["present"] / attendance_counts["records"]) * 50
     else:
         attendance_score = 0
     
@@ -273,23 +324,58 @@ def calculate_average_completion_time(completed_tasks):
     
     return round(total_days / count, 2) if count > 0 else 0
 
-def generate_export_data(workers, tasks, attendance, format_type):
-    """Generate data for export in various formats"""
+# ---------------- STREAMING EXPORT ----------------
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# CSV columns per section (NDJSON rows carry the whole document under "record")
+EXPORT_COLUMNS = {
+    "workers": ["_id", "name", "email", "phone", "status", "created_at"],
+    "tasks": ["_id", "taskName", "description", "assignedTo", "status", "priority", "deadline", "createdAt", "completedAt"],
+    "attendance": ["_id", "workerId", "workerName", "date", "status", "checkIn", "checkOut", "notes"]
+}
+
+def generate_csv_export(sections, batch_size):
+    """Yield CSV text for each section (a section row, a header row, then one row per document)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
     
-    if format_type == "csv":
-        # Generate CSV-like structure
-        return {
-            "workers": len(workers),
-            "tasks": len(tasks),
-            "attendance_records": len(attendance),
-            "export_format": "csv",
-            "data_available": True
-        }
-    else:
-        # Default JSON structure
-        return {
-            "workers": workers,
-            "tasks": tasks,
-            "attendance": attendance,
-            "export_format": "json"
-        }
\ No newline at end of file
+    for index, (section, open_cursor) in enumerate(sections):
+        columns = EXPORT_COLUMNS[section]
+        if index:
+            writer.writerow([])
+        writer.writerow(["section", section])
+        writer.writerow(columns)
+        # Send the header straight away so the client sees the first byte before any query returns
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        
+        pending = 0
+        for doc in open_cursor():
+            writer.writerow(["" if doc.get(column) is None else str(doc[column]) for column in columns])
+            pending += 1
+            if pending >= batch_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if pending:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+def generate_ndjson_export(sections, batch_size, meta):
+    """Yield one JSON object per line: {"type": section, "record": document}"""
+    yield json.dumps(meta) + "\n"
+    
+    for section, open_cursor in sections:
+        lines = []
+        for doc in open_cursor():
+            doc["_id"] = str(doc["_id"])
+            # Nested, so a document's own fields (emergencies have a `type`) can't clobber the tag
+            lines.append(json.dumps({"type": section, "record": doc}, default=str))
+            if len(lines) >= batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
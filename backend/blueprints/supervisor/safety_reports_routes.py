@@ -1,30 +1,20 @@
 # safety_reports_routes.py
-from flask import Blueprint, request, jsonify, current_app
-import jwt
+from flask import Blueprint, request, jsonify, current_app, g
 import datetime
 from bson import ObjectId
 from datetime import datetime, timedelta
 import re
+from utils.auth import auth_required, STAFF_ROLES
+from utils.stats import facet_stats
+from utils.pagination import CursorError, page_params, paginate_find, page_response
+from utils.user_resolver import load_users, get_user, get_user_by_id, get_user_by_email
+from utils.events import publish_change
+from utils.change_feed import stamped_update
+from blueprints.notifications import send_alert_update_notification
 
 # Blueprint instance
 safety_reports_bp = Blueprint("safety_reports", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -38,15 +28,12 @@ def is_valid_objectid(objectid_str):
 
 # ---------------- SAFETY REPORTS ----------------
 @safety_reports_bp.route("/safety-reports", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_safety_reports():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get query parameters for filtering
         status_filter = request.args.get('status', 'all')
         resolved_filter = request.args.get('resolved', 'all')
@@ -83,21 +70,27 @@ def get_safety_reports():
             except ValueError:
                 pass
         
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Get safety reports with sorting (newest first)
-        reports = list(safety_col.find(query).sort("timestamp", -1))
+        next_cursor = None
+        if limit:
+            reports, next_cursor = paginate_find(safety_col, query, "timestamp", limit, after)
+        else:
+            reports = list(safety_col.find(query).sort("timestamp", -1))
+        
+        # Resolve workers and reporters in one batch
+        users = load_users(users_col, reports, ["workerId", "reportedBy"])
         
         # Enrich reports with additional worker information
         enriched_reports = []
         for report in reports:
-            # Get worker details
-            worker = None
-            if is_valid_objectid(report.get("workerId", "")):
-                worker = users_col.find_one({"_id": ObjectId(report["workerId"])})
-            
-            # Get reporter details
-            reporter = None
-            if report.get("reportedBy"):
-                reporter = users_col.find_one({"email": report["reportedBy"]})
+            worker = users.by_id(report.get("workerId", ""))
+            reporter = users.by_email(report.get("reportedBy"))
             
             enriched_report = {
                 "_id": str(report["_id"]),
@@ -124,6 +117,8 @@ def get_safety_reports():
             }
             enriched_reports.append(enriched_report)
         
+        if limit:
+            return page_response(enriched_reports, next_cursor), 200
         return jsonify(enriched_reports), 200
         
     except Exception as e:
@@ -131,15 +126,12 @@ def get_safety_reports():
         return jsonify({"error": "Failed to fetch safety reports"}), 500
 
 @safety_reports_bp.route("/safety-reports/<report_id>", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_safety_report(report_id):
     safety_col = current_app.config["SAFETY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate report ID
         if not ObjectId.is_valid(report_id):
             return jsonify({"error": "Invalid report ID"}), 400
@@ -149,23 +141,10 @@ def get_safety_report(report_id):
         if not report:
             return jsonify({"error": "Safety report not found"}), 404
         
-        # Get worker details
-        worker = None
-        if is_valid_objectid(report.get("workerId", "")):
-            worker = users_col.find_one({"_id": ObjectId(report["workerId"])})
-        
-        # Get reporter details
-        reporter = None
-        if report.get("reportedBy"):
-            reporter = users_col.find_one({"email": report["reportedBy"]})
-        
-        # Get resolver details if resolved
-        resolver = None
-        if report.get("resolvedBy"):
-            if is_valid_objectid(report["resolvedBy"]):
-                resolver = users_col.find_one({"_id": ObjectId(report["resolvedBy"])})
-            else:
-                resolver = users_col.find_one({"email": report["resolvedBy"]})
+        # Get worker, reporter and resolver details (each user is loaded once)
+        worker = get_user_by_id(users_col, report.get("workerId", ""))
+        reporter = get_user_by_email(users_col, report.get("reportedBy"))
+        resolver = get_user(users_col, report.get("resolvedBy"))
         
         # Get worker's safety history
         worker_safety_history = []
@@ -224,14 +203,13 @@ def get_safety_report(report_id):
         return jsonify({"error": "Failed to fetch safety report"}), 500
 
 @safety_reports_bp.route("/safety-reports/<report_id>", methods=["PUT"])
+@auth_required(*STAFF_ROLES)
 def update_safety_report(report_id):
     safety_col = current_app.config["SAFETY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        decoded = g.claims
         
         data = request.json
         
@@ -259,7 +237,7 @@ def update_safety_report(report_id):
                 update_data["resolvedAt"] = datetime.now().isoformat()
                 update_data["resolvedBy"] = decoded.get("email", "")
                 # Get resolver name
-                resolver = users_col.find_one({"email": decoded.get("email", "")})
+                resolver = get_user_by_email(users_col, decoded.get("email", ""))
                 if resolver:
                     update_data["resolvedByName"] = resolver["name"]
         
@@ -276,24 +254,19 @@ def update_safety_report(report_id):
             update_data["severity"] = data["severity"]
         
         # Update the safety report
-        result = safety_col.update_one(
-            {"_id": ObjectId(report_id)}, 
-            {"$set": update_data}
-        )
+        result = safety_col.update_one(*stamped_update({"_id": ObjectId(report_id)}, update_data))
         
         if result.modified_count:
+            publish_change("safety", "update", id=report_id)
+            # Same alert_update the /alerts routes send (the report is an alert there)
+            send_alert_update_notification(f"safety-{report_id}", update_data, previous=report)
+            
             # Get updated report
             updated_report = safety_col.find_one({"_id": ObjectId(report_id)})
             
-            # Get worker details
-            worker = None
-            if is_valid_objectid(updated_report.get("workerId", "")):
-                worker = users_col.find_one({"_id": ObjectId(updated_report["workerId"])})
-            
-            # Get reporter details
-            reporter = None
-            if updated_report.get("reportedBy"):
-                reporter = users_col.find_one({"email": updated_report["reportedBy"]})
+            # Get worker and reporter details (the reporter is often the resolver loaded above)
+            worker = get_user_by_id(users_col, updated_report.get("workerId", ""))
+            reporter = get_user_by_email(users_col, updated_report.get("reportedBy"))
             
             enriched_report = {
                 "_id": str(updated_report["_id"]),
@@ -326,14 +299,11 @@ def update_safety_report(report_id):
         return jsonify({"error": "Failed to update safety report"}), 500
 
 @safety_reports_bp.route("/safety-reports/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def safety_reports_stats():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get date range from query parameters (default to last 30 days)
         days = int(request.args.get('days', 30))
         start_date = (datetime.now() - timedelta(days=days)).date()
@@ -342,81 +312,80 @@ def safety_reports_stats():
         start_datetime = datetime.combine(start_date, datetime.min.time())
         end_datetime = datetime.combine(end_date, datetime.max.time())
         
-        # Calculate statistics
-        total_reports = safety_col.count_documents({})
-        
-        # Reports in date range
-        recent_reports = safety_col.count_documents({
-            "timestamp": {
-                "$gte": start_datetime.isoformat(),
-                "$lte": end_datetime.isoformat()
-            }
-        })
-        
-        unresolved_reports = safety_col.count_documents({"resolved": False})
-        resolved_reports = safety_col.count_documents({"resolved": True})
-        
-        # Count by violation type
-        helmet_violations = safety_col.count_documents({"helmet": False})
-        vest_violations = safety_col.count_documents({"vest": False})
-        
-        # Count by status
-        pending_reviews = safety_col.count_documents({"status": "Pending Review"})
-        in_progress_reports = safety_col.count_documents({"status": "In Progress"})
-        resolved_status_reports = safety_col.count_documents({"status": "Resolved"})
-        
-        # Count by severity
-        low_severity = safety_col.count_documents({"severity": "low"})
-        medium_severity = safety_col.count_documents({"severity": "medium"})
-        high_severity = safety_col.count_documents({"severity": "high"})
-        critical_severity = safety_col.count_documents({"severity": "critical"})
-        
-        # Weekly trends (last 4 weeks)
-        weekly_trends = []
+        # Weekly trends (last 4 weeks), oldest first
+        weeks = []
         for i in range(4):
             week_start = (datetime.now() - timedelta(weeks=i+1)).date()
             week_end = (datetime.now() - timedelta(weeks=i)).date()
-            
-            week_start_dt = datetime.combine(week_start, datetime.min.time())
-            week_end_dt = datetime.combine(week_end, datetime.max.time())
-            
-            week_count = safety_col.count_documents({
+            weeks.append((f"Week {4-i}", week_start, week_end))
+        weeks.reverse()
+        
+        spec = {
+            "total": {},
+            # Reports in date range
+            "recent": {
                 "timestamp": {
-                    "$gte": week_start_dt.isoformat(),
-                    "$lte": week_end_dt.isoformat()
+                    "$gte": start_datetime.isoformat(),
+                    "$lte": end_datetime.isoformat()
                 }
-            })
-            
-            weekly_trends.append({
-                "week": f"Week {4-i}",
-                "startDate": week_start.isoformat(),
-                "endDate": week_end.isoformat(),
-                "count": week_count
-            })
+            },
+            "unresolved": {"resolved": False},
+            "resolved": {"resolved": True},
+            # Count by violation type
+            "helmet": {"helmet": False},
+            "vest": {"vest": False},
+            "both": {"helmet": False, "vest": False},
+            # Count by status
+            "pending": {"status": "Pending Review"},
+            "inProgress": {"status": "In Progress"},
+            "resolvedStatus": {"status": "Resolved"},
+            # Count by severity
+            "low": {"severity": "low"},
+            "medium": {"severity": "medium"},
+            "high": {"severity": "high"},
+            "critical": {"severity": "critical"}
+        }
+        for week, week_start, week_end in weeks:
+            spec[week] = {
+                "timestamp": {
+                    "$gte": datetime.combine(week_start, datetime.min.time()).isoformat(),
+                    "$lte": datetime.combine(week_end, datetime.max.time()).isoformat()
+                }
+            }
         
-        # Reverse to show chronological order
-        weekly_trends.reverse()
+        # Calculate statistics in a single $facet round trip
+        stats = facet_stats(safety_col, spec)
+        
+        weekly_trends = [{
+            "week": week,
+            "startDate": week_start.isoformat(),
+            "endDate": week_end.isoformat(),
+            "count": stats[week]
+        } for week, week_start, week_end in weeks]
+        
+        total_reports = stats["total"]
+        resolved_reports = stats["resolved"]
         
         return jsonify({
             "totalReports": total_reports,
-            "recentReports": recent_reports,
-            "unresolvedReports": unresolved_reports,
+            "recentReports": stats["recent"],
+            "unresolvedReports": stats["unresolved"],
             "resolvedReports": resolved_reports,
             "violationTypes": {
-                "helmet": helmet_violations,
-                "vest": vest_violations,
-                "both": safety_col.count_documents({"helmet": False, "vest": False})
+                "helmet": stats["helmet"],
+                "vest": stats["vest"],
+                "both": stats["both"]
             },
             "statusBreakdown": {
-                "pending": pending_reviews,
-                "inProgress": in_progress_reports,
-                "resolved": resolved_status_reports
+                "pending": stats["pending"],
+                "inProgress": stats["inProgress"],
+                "resolved": stats["resolvedStatus"]
             },
             "severityBreakdown": {
-                "low": low_severity,
-                "medium": medium_severity,
-                "high": high_severity,
-                "critical": critical_severity
+                "low": stats["low"],
+                "medium": stats["medium"],
+                "high": stats["high"],
+                "critical": stats["critical"]
             },
             "weeklyTrends": weekly_trends,
             "timeRange": {
@@ -432,15 +401,12 @@ def safety_reports_stats():
         return jsonify({"error": "Failed to fetch safety reports statistics"}), 500
 
 @safety_reports_bp.route("/safety-reports/workers", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_workers_with_violations():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get workers with safety violations
         pipeline = [
             {
@@ -464,12 +430,13 @@ def get_workers_with_violations():
         
         workers_with_violations = list(safety_col.aggregate(pipeline))
         
+        # Resolve worker details in one batch
+        users = load_users(users_col, workers_with_violations, ["_id"])
+        
         # Enrich with worker details
         enriched_workers = []
         for worker in workers_with_violations:
-            worker_details = None
-            if is_valid_objectid(worker["_id"]):
-                worker_details = users_col.find_one({"_id": ObjectId(worker["_id"])})
+            worker_details = users.by_id(worker["_id"])
             
             # Flatten violations list
             all_violations = []
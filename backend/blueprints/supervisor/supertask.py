@@ -1,30 +1,19 @@
 # task_routes.py
 from flask import Blueprint, request, jsonify, current_app
-import jwt
 import datetime
 from bson import ObjectId
 from datetime import datetime
 import re
+from utils.auth import verify_token, auth_required, STAFF_ROLES
+from utils.stats import facet_stats
+from utils.pagination import CursorError, page_params, paginate_find, page_response
+from utils.user_resolver import load_users, get_user, get_user_by_id, get_user_by_email
+from utils.events import publish_change
+from utils.change_feed import touch, stamped_update, record_deletion
 
 # Blueprint instance
 task_bp = Blueprint("tasks", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -48,18 +37,26 @@ def tasks():
             if error_response:
                 return error_response, status_code
             
-            # Get all tasks
-            tasks = list(tasks_col.find({}))
+            # Keyset pagination (`limit` / `after`); without them the full list is returned
+            try:
+                limit, after = page_params()
+            except CursorError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            # Get all tasks (or one page of them)
+            next_cursor = None
+            if limit:
+                tasks, next_cursor = paginate_find(tasks_col, {}, "createdAt", limit, after)
+            else:
+                tasks = list(tasks_col.find({}))
+            
+            # Resolve assignees by email (original format) or ID in one batch
+            users = load_users(users_col, tasks, ["assignedTo"])
             
             # Enrich tasks with user information
             enriched_tasks = []
             for task in tasks:
-                # Try to find user by email (original format) or ID
-                user = None
-                if is_valid_objectid(task["assignedTo"]):
-                    user = users_col.find_one({"_id": ObjectId(task["assignedTo"])})
-                else:
-                    user = users_col.find_one({"email": task["assignedTo"]})
+                user = users.get(task["assignedTo"])
                 
                 enriched_task = {
                     "_id": str(task["_id"]),
@@ -77,6 +74,8 @@ def tasks():
                 }
                 enriched_tasks.append(enriched_task)
             
+            if limit:
+                return page_response(enriched_tasks, next_cursor), 200
             return jsonify(enriched_tasks), 200
             
         except Exception as e:
@@ -104,7 +103,7 @@ def tasks():
             
             if is_valid_objectid(data["assignedTo"]):
                 # Try to find by ObjectId
-                user = users_col.find_one({"_id": ObjectId(data["assignedTo"])})
+                user = get_user_by_id(users_col, data["assignedTo"])
                 if user:
                     assigned_to_name = user["name"]
                     data["assignedTo"] = user["email"]  # Store email for consistency
@@ -112,7 +111,7 @@ def tasks():
                     assigned_to_name = f"Unknown (ID: {data['assignedTo']})"
             else:
                 # Try to find by email
-                user = users_col.find_one({"email": data["assignedTo"]})
+                user = get_user_by_email(users_col, data["assignedTo"])
                 if user:
                     assigned_to_name = user["name"]
                 else:
@@ -135,8 +134,9 @@ def tasks():
             }
             
             # Insert the task
-            result = tasks_col.insert_one(task)
+            result = tasks_col.insert_one(touch(task))
             task["_id"] = str(result.inserted_id)
+            publish_change("tasks", "insert", id=task["_id"])
             
             # Remove internal fields from response
             response_task = {k: v for k, v in task.items() if k not in ["createdBy", "createdByName"]}
@@ -151,15 +151,12 @@ def tasks():
             return jsonify({"error": "Failed to create task"}), 500
 
 @task_bp.route("/tasks/<task_id>", methods=["GET", "PUT", "DELETE"])
+@auth_required()
 def task_detail(task_id):
     tasks_col = current_app.config["TASKS_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         if not ObjectId.is_valid(task_id):
             return jsonify({"error": "Invalid task ID"}), 400
             
@@ -169,11 +166,7 @@ def task_detail(task_id):
         
         if request.method == "GET":
             # Find user information
-            user = None
-            if is_valid_objectid(task["assignedTo"]):
-                user = users_col.find_one({"_id": ObjectId(task["assignedTo"])})
-            else:
-                user = users_col.find_one({"email": task["assignedTo"]})
+            user = get_user(users_col, task["assignedTo"])
             
             enriched_task = {
                 "_id": str(task["_id"]),
@@ -209,14 +202,14 @@ def task_detail(task_id):
             if "assignedTo" in data:
                 user = None
                 if is_valid_objectid(data["assignedTo"]):
-                    user = users_col.find_one({"_id": ObjectId(data["assignedTo"])})
+                    user = get_user_by_id(users_col, data["assignedTo"])
                     if user:
                         update_data["assignedTo"] = user["email"]  # Store email for consistency
                         update_data["assignedToName"] = user["name"]
                     else:
                         update_data["assignedToName"] = f"Unknown (ID: {data['assignedTo']})"
                 else:
-                    user = users_col.find_one({"email": data["assignedTo"]})
+                    user = get_user_by_email(users_col, data["assignedTo"])
                     if user:
                         update_data["assignedToName"] = user["name"]
                     else:
@@ -230,21 +223,16 @@ def task_detail(task_id):
                     update_data["completedAt"] = ""
             
             # Update the task
-            result = tasks_col.update_one(
-                {"_id": ObjectId(task_id)}, 
-                {"$set": update_data}
-            )
+            result = tasks_col.update_one(*stamped_update({"_id": ObjectId(task_id)}, update_data))
             
             if result.modified_count:
+                publish_change("tasks", "update", id=task_id)
+                
                 # Return updated task
                 updated_task = tasks_col.find_one({"_id": ObjectId(task_id)})
                 
-                # Find user information for response
-                user = None
-                if is_valid_objectid(updated_task["assignedTo"]):
-                    user = users_col.find_one({"_id": ObjectId(updated_task["assignedTo"])})
-                else:
-                    user = users_col.find_one({"email": updated_task["assignedTo"]})
+                # Find user information for response (reuses the assignee loaded above)
+                user = get_user(users_col, updated_task["assignedTo"])
                 
                 enriched_task = {
                     "_id": str(updated_task["_id"]),
@@ -272,6 +260,8 @@ def task_detail(task_id):
             result = tasks_col.delete_one({"_id": ObjectId(task_id)})
             
             if result.deleted_count:
+                record_deletion(tasks_col, task_id)
+                publish_change("tasks", "delete", id=task_id)
                 return jsonify({"message": "Task deleted successfully"}), 200
             else:
                 return jsonify({"error": "Task not found"}), 404
@@ -282,37 +272,36 @@ def task_detail(task_id):
 
 # ---------------- TASK STATS ----------------
 @task_bp.route("/tasks/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def task_stats():
     tasks_col = current_app.config["TASKS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
-        # Calculate statistics
-        total_tasks = tasks_col.count_documents({})
-        pending_tasks = tasks_col.count_documents({"status": "Pending"})
-        in_progress_tasks = tasks_col.count_documents({"status": "In Progress"})
-        completed_tasks = tasks_col.count_documents({"status": "Completed"})
-        approved_tasks = tasks_col.count_documents({"status": "Approved"})
-        rejected_tasks = tasks_col.count_documents({"status": "Rejected"})
-        
-        # Count overdue tasks (deadline is in the past and status is not completed/approved)
         today = datetime.now().date().isoformat()
-        overdue_tasks = tasks_col.count_documents({
-            "deadline": {"$lt": today},
-            "status": {"$nin": ["Completed", "Approved"]}
+        
+        # Calculate statistics in a single $facet round trip
+        stats = facet_stats(tasks_col, {
+            "total": {},
+            "pending": {"status": "Pending"},
+            "inProgress": {"status": "In Progress"},
+            "completed": {"status": "Completed"},
+            "approved": {"status": "Approved"},
+            "rejected": {"status": "Rejected"},
+            # Overdue: deadline is in the past and status is not completed/approved
+            "overdue": {
+                "deadline": {"$lt": today},
+                "status": {"$nin": ["Completed", "Approved"]}
+            }
         })
         
         return jsonify({
-            "totalTasks": total_tasks,
-            "pendingTasks": pending_tasks,
-            "inProgressTasks": in_progress_tasks,
-            "completedTasks": completed_tasks,
-            "approvedTasks": approved_tasks,
-            "rejectedTasks": rejected_tasks,
-            "overdueTasks": overdue_tasks
+            "totalTasks": stats["total"],
+            "pendingTasks": stats["pending"],
+            "inProgressTasks": stats["inProgress"],
+            "completedTasks": stats["completed"],
+            "approvedTasks": stats["approved"],
+            "rejectedTasks": stats["rejected"],
+            "overdueTasks": stats["overdue"]
         }), 200
         
     except Exception as e:
@@ -321,21 +310,14 @@ def task_stats():
 
 # ---------------- USER TASKS ----------------
 @task_bp.route("/tasks/user/<user_identifier>", methods=["GET"])
+@auth_required()
 def user_tasks(user_identifier):
     tasks_col = current_app.config["TASKS_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Find user by ID or email
-        user = None
-        if is_valid_objectid(user_identifier):
-            user = users_col.find_one({"_id": ObjectId(user_identifier)})
-        else:
-            user = users_col.find_one({"email": user_identifier})
+        user = get_user(users_col, user_identifier)
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -1,18 +1,18 @@
 # supervisor_routes.py (if you have a separate supervisor blueprint)
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
+from utils.auth import auth_required, STAFF_ROLES
 
 sup_bp = Blueprint("supervisor", __name__)
 
 @sup_bp.route("/supervisor/alerts/assigned", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_assigned_alerts():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     emergency_col = current_app.config["EMERGENCY_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        decoded = g.claims
         
         # Get alerts assigned to current supervisor
         supervisor_email = decoded.get("email", "")
@@ -1,30 +1,17 @@
 # team_routes.py
 from flask import Blueprint, request, jsonify, current_app
-import jwt
 import datetime
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+from utils.auth import auth_required, resolve_identity, STAFF_ROLES
+from utils.user_directory import versioned_update, USER_PROJECTION
+from utils.stats import grouped_counts
+from utils.fanout import fan_out, FanoutTimeout
 
 # Blueprint instance
 team_bp = Blueprint("team", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # Helper function to validate ObjectId
 def is_valid_objectid(objectid_str):
     """Check if a string is a valid MongoDB ObjectId"""
@@ -38,18 +25,16 @@ def is_valid_objectid(objectid_str):
 
 # ---------------- TEAM MANAGEMENT ----------------
 @team_bp.route("/team/members", methods=["GET"])
+@auth_required()
 def get_team_members():
     users_col = current_app.config["USERS_COLLECTION"]
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     tasks_col = current_app.config["TASKS_COLLECTION"]
+    safety_col = current_app.config["SAFETY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get the current user's role to determine which team members to show
-        current_user = users_col.find_one({"email": decoded["email"]})
+        current_user = resolve_identity(users_col)
         if not current_user:
             return jsonify({"error": "User not found"}), 404
         
@@ -63,43 +48,50 @@ def get_team_members():
             query = {"role": {"$in": ["Worker", "Supervisor"]}}
         else:
             # Workers can only see themselves
-            query = {"email": decoded["email"]}
+            query = {"email": current_user["email"]}
         
         # Get team members
         team_members = list(users_col.find(query, {
-            "password": 0,  # Exclude password
+            **USER_PROJECTION,  # Exclude password and change-feed stamps
             "created_at": 0  # Exclude created_at if not needed
         }))
         
         # Get today's date for attendance and stats
         today = datetime.now().date().isoformat()
+        member_ids = [str(member["_id"]) for member in team_members]
+        
+        # Today's attendance for the whole team in one query
+        attendance_by_worker = {}
+        for record in attendance_col.find(
+            {"workerId": {"$in": member_ids}, "date": today},
+            {"workerId": 1, "status": 1, "checkIn": 1, "checkOut": 1}
+        ):
+            attendance_by_worker.setdefault(record["workerId"], record)
+        
+        # Task counts grouped by assignee and status
+        task_counts = grouped_counts(tasks_col, {
+            "assignedTo": {"$in": member_ids},
+            "status": {"$in": ["pending", "in-progress", "completed"]}
+        }, ["assignedTo", "status"])
+        
+        # Unresolved safety violations grouped by worker
+        safety_counts = grouped_counts(safety_col, {
+            "workerId": {"$in": member_ids},
+            "resolved": False
+        }, "workerId")
         
         # Enrich team members with additional data
         enriched_members = []
         for member in team_members:
-            # Get today's attendance
-            attendance = attendance_col.find_one({
-                "workerId": str(member["_id"]),
-                "date": today
-            })
+            member_id = str(member["_id"])
+            attendance = attendance_by_worker.get(member_id)
             
             # Get task statistics
-            assigned_tasks = tasks_col.count_documents({
-                "assignedTo": str(member["_id"]),
-                "status": {"$in": ["pending", "in-progress"]}
-            })
-            
-            completed_tasks = tasks_col.count_documents({
-                "assignedTo": str(member["_id"]),
-                "status": "completed"
-            })
+            assigned_tasks = task_counts.get((member_id, "pending"), 0) + task_counts.get((member_id, "in-progress"), 0)
+            completed_tasks = task_counts.get((member_id, "completed"), 0)
             
             # Get safety violations count
-            safety_col = current_app.config["SAFETY_COLLECTION"]
-            safety_violations = safety_col.count_documents({
-                "workerId": str(member["_id"]),
-                "resolved": False
-            })
+            safety_violations = safety_counts.get(member_id, 0)
             
             enriched_member = {
                 "_id": str(member["_id"]),
@@ -127,6 +119,7 @@ def get_team_members():
         return jsonify({"error": "Failed to fetch team members"}), 500
 
 @team_bp.route("/team/members/<member_id>", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_team_member(member_id):
     users_col = current_app.config["USERS_COLLECTION"]
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
@@ -134,42 +127,45 @@ def get_team_member(member_id):
     safety_col = current_app.config["SAFETY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate member ID
         if not ObjectId.is_valid(member_id):
             return jsonify({"error": "Invalid member ID"}), 400
         
-        # Get team member
-        member = users_col.find_one({"_id": ObjectId(member_id)}, {"password": 0})
+        seven_days_ago = (datetime.now().date() - timedelta(days=7)).isoformat()
+        
+        # The member and its history are independent reads, so run them side by side
+        results = fan_out({
+            # Get team member
+            "member": lambda: users_col.find_one({"_id": ObjectId(member_id)}, USER_PROJECTION),
+            # Get attendance history (last 7 days)
+            "attendance": lambda: list(attendance_col.find({
+                "workerId": member_id,
+                "date": {"$gte": seven_days_ago}
+            }).sort("date", -1)),
+            # Get current tasks
+            "current_tasks": lambda: list(tasks_col.find({
+                "assignedTo": member_id,
+                "status": {"$in": ["pending", "in-progress"]}
+            }).sort("due_date", 1)),
+            # Get completed tasks (last 10)
+            "completed_tasks": lambda: list(tasks_col.find({
+                "assignedTo": member_id,
+                "status": "completed"
+            }).sort("completed_at", -1).limit(10)),
+            # Get safety violations
+            "safety": lambda: list(safety_col.find({
+                "workerId": member_id
+            }).sort("timestamp", -1).limit(5))
+        })
+        
+        member = results["member"]
         if not member:
             return jsonify({"error": "Team member not found"}), 404
         
-        # Get attendance history (last 7 days)
-        seven_days_ago = (datetime.now().date() - datetime.timedelta(days=7)).isoformat()
-        attendance_history = list(attendance_col.find({
-            "workerId": member_id,
-            "date": {"$gte": seven_days_ago}
-        }).sort("date", -1))
-        
-        # Get current tasks
-        current_tasks = list(tasks_col.find({
-            "assignedTo": member_id,
-            "status": {"$in": ["pending", "in-progress"]}
-        }).sort("due_date", 1))
-        
-        # Get completed tasks (last 10)
-        completed_tasks = list(tasks_col.find({
-            "assignedTo": member_id,
-            "status": "completed"
-        }).sort("completed_at", -1).limit(10))
-        
-        # Get safety violations
-        safety_violations = list(safety_col.find({
-            "workerId": member_id
-        }).sort("timestamp", -1).limit(5))
+        attendance_history = results["attendance"]
+        current_tasks = results["current_tasks"]
+        completed_tasks = results["completed_tasks"]
+        safety_violations = results["safety"]
         
         # Format response
         member_details = {
@@ -219,19 +215,20 @@ def get_team_member(member_id):
         
         return jsonify(member_details), 200
         
+    except FanoutTimeout as e:
+        current_app.logger.error(f"Team member fetch timeout: {str(e)}")
+        return jsonify({"error": "Team member details timed out"}), 504
     except Exception as e:
         current_app.logger.error(f"Team member fetch error: {str(e)}")
         return jsonify({"error": "Failed to fetch team member details"}), 500
 
 @team_bp.route("/team/members/<member_id>", methods=["PUT"])
+@auth_required(*STAFF_ROLES)
 def update_team_member(member_id):
     users_col = current_app.config["USERS_COLLECTION"]
+    user_directory = current_app.config["USER_DIRECTORY"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate member ID
         if not ObjectId.is_valid(member_id):
             return jsonify({"error": "Invalid member ID"}), 400
@@ -251,15 +248,13 @@ def update_team_member(member_id):
             if field in data:
                 update_data[field] = data[field]
         
-        # Update the team member
-        result = users_col.update_one(
-            {"_id": ObjectId(member_id)}, 
-            {"$set": update_data}
-        )
+        # Update the team member (bumps its version so older tokens re-check it)
+        result = users_col.update_one(*versioned_update(member_id, update_data))
         
         if result.modified_count:
             # Get updated member
-            updated_member = users_col.find_one({"_id": ObjectId(member_id)}, {"password": 0})
+            updated_member = users_col.find_one({"_id": ObjectId(member_id)}, USER_PROJECTION)
+            user_directory.replace(member, updated_member)
             return jsonify({
                 "message": "Team member updated successfully",
                 "member": {
@@ -280,6 +275,7 @@ def update_team_member(member_id):
         return jsonify({"error": "Failed to update team member"}), 500
 
 @team_bp.route("/team/stats", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def team_stats():
     users_col = current_app.config["USERS_COLLECTION"]
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
@@ -287,12 +283,8 @@ def team_stats():
     safety_col = current_app.config["SAFETY_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get current user to determine scope
-        current_user = users_col.find_one({"email": decoded["email"]})
+        current_user = resolve_identity(users_col)
         if not current_user:
             return jsonify({"error": "User not found"}), 404
         
@@ -303,7 +295,7 @@ def team_stats():
         elif current_user["role"] == "Manager":
             query = {"role": {"$in": ["Worker", "Supervisor"]}}
         else:
-            query = {"email": decoded["email"]}
+            query = {"email": current_user["email"]}
         
         # Get team members count
         total_members = users_col.count_documents(query)
@@ -344,18 +336,15 @@ def team_stats():
         return jsonify({"error": "Failed to fetch team statistics"}), 500
 
 @team_bp.route("/team/attendance", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def team_attendance():
     attendance_col = current_app.config["ATTENDANCE_COLLECTION"]
     users_col = current_app.config["USERS_COLLECTION"]
     
     try:
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Get date range from query parameters (default to last 7 days)
         start_date = request.args.get('start_date', 
-            (datetime.now().date() - datetime.timedelta(days=7)).isoformat())
+            (datetime.now().date() - timedelta(days=7)).isoformat())
         end_date = request.args.get('end_date', datetime.now().date().isoformat())
         
         # Get attendance data
@@ -1,39 +1,34 @@
 # user_routes.py or add to existing auth_routes.py
-from flask import Blueprint, request, jsonify, current_app
-import jwt
+from flask import Blueprint, request, jsonify, current_app, g
 from bson import ObjectId
+from utils.auth import auth_required, STAFF_ROLES
+from utils.user_directory import versioned_update, USER_PROJECTION
+from utils.change_feed import record_deletion
+from utils.pagination import CursorError, page_params, paginate_find, page_response
 
 # Blueprint instance
 user_bp = Blueprint("users", __name__)
 
-# Helper function to verify JWT token
-def verify_token():
-    token = request.headers.get("Authorization", None)
-    if not token:
-        return None, jsonify({"error": "Missing token"}), 401
-
-    try:
-        if token.startswith("Bearer "):
-            token = token[7:]
-        decoded = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
-        return decoded, None, None
-    except jwt.ExpiredSignatureError:
-        return None, jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return None, jsonify({"error": "Invalid token"}), 401
-
 # ---------------- GET ALL USERS ----------------
 @user_bp.route("/users", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_users():
     try:
-        users_col = current_app.config["USERS_COLLECTION"]
-        
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
-        # Get all users (you might want to add filters based on role)
-        users = list(users_col.find({}, {"password": 0}))  # Exclude passwords
+        user_directory = current_app.config["USER_DIRECTORY"]
+        
+        # Keyset pagination (`limit` / `after`); without them the full list is returned
+        try:
+            limit, after = page_params()
+        except CursorError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # One page straight from Mongo, or all users from the in-process directory (passwords excluded)
+        next_cursor = None
+        if limit:
+            users_col = current_app.config["USERS_COLLECTION"]
+            users, next_cursor = paginate_find(users_col, {}, None, limit, after, USER_PROJECTION)
+        else:
+            users = user_directory.list_users()
         
         # Convert ObjectId to string for JSON serialization
         users_list = []
@@ -41,6 +36,8 @@ def get_users():
             user["_id"] = str(user["_id"])
             users_list.append(user)
         
+        if limit:
+            return page_response(users_list, next_cursor), 200
         return jsonify(users_list), 200
         
     except Exception as e:
@@ -49,21 +46,18 @@ def get_users():
 
 # ---------------- GET USERS BY ROLE ----------------
 @user_bp.route("/users/role/<role>", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_users_by_role(role):
     try:
-        users_col = current_app.config["USERS_COLLECTION"]
-        
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        user_directory = current_app.config["USER_DIRECTORY"]
         
         # Validate role
         valid_roles = ["Worker", "Supervisor", "Manager"]
         if role not in valid_roles:
             return jsonify({"error": "Invalid role"}), 400
         
-        # Get users by role
-        users = list(users_col.find({"role": role}, {"password": 0}))  # Exclude passwords
+        # Get users by role (served from the in-process directory, passwords excluded)
+        users = user_directory.list_users([role])
         
         # Convert ObjectId to string for JSON serialization
         users_list = []
@@ -79,20 +73,17 @@ def get_users_by_role(role):
 
 # ---------------- GET USER BY ID ----------------
 @user_bp.route("/users/<user_id>", methods=["GET"])
+@auth_required(*STAFF_ROLES)
 def get_user(user_id):
     try:
         users_col = current_app.config["USERS_COLLECTION"]
         
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
-        
         # Validate ObjectId
         if not ObjectId.is_valid(user_id):
             return jsonify({"error": "Invalid user ID"}), 400
         
         # Get user by ID
-        user = users_col.find_one({"_id": ObjectId(user_id)}, {"password": 0})
+        user = users_col.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -107,13 +98,11 @@ def get_user(user_id):
 
 # ---------------- UPDATE USER ----------------
 @user_bp.route("/users/<user_id>", methods=["PUT"])
+@auth_required(*STAFF_ROLES)
 def update_user(user_id):
     try:
         users_col = current_app.config["USERS_COLLECTION"]
-        
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        user_directory = current_app.config["USER_DIRECTORY"]
         
         # Validate ObjectId
         if not ObjectId.is_valid(user_id):
@@ -140,15 +129,13 @@ def update_user(user_id):
             if update_data["role"] not in valid_roles:
                 return jsonify({"error": "Invalid role"}), 400
         
-        # Update the user
-        result = users_col.update_one(
-            {"_id": ObjectId(user_id)}, 
-            {"$set": update_data}
-        )
+        # Update the user (bumps its version so older tokens re-check it)
+        result = users_col.update_one(*versioned_update(user_id, update_data))
         
         if result.modified_count:
             # Return updated user (without password)
-            updated_user = users_col.find_one({"_id": ObjectId(user_id)}, {"password": 0})
+            updated_user = users_col.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
+            user_directory.replace(user, updated_user)
             updated_user["_id"] = str(updated_user["_id"])
             
             return jsonify({
@@ -164,13 +151,13 @@ def update_user(user_id):
 
 # ---------------- DELETE USER ----------------
 @user_bp.route("/users/<user_id>", methods=["DELETE"])
+@auth_required(*STAFF_ROLES)
 def delete_user(user_id):
     try:
         users_col = current_app.config["USERS_COLLECTION"]
+        user_directory = current_app.config["USER_DIRECTORY"]
         
-        decoded, error_response, status_code = verify_token()
-        if error_response:
-            return error_response, status_code
+        decoded = g.claims
         
         # Validate ObjectId
         if not ObjectId.is_valid(user_id):
@@ -187,8 +174,10 @@ def delete_user(user_id):
         
         # Delete the user
         result = users_col.delete_one({"_id": ObjectId(user_id)})
+        user_directory.invalidate(user)
         
         if result.deleted_count:
+            record_deletion(users_col, user_id)
             return jsonify({"message": "User deleted successfully"}), 200
         else:
             return jsonify({"error": "User not found"}), 404
@@ -0,0 +1,120 @@
+# bench_progress_report.py
+# Times generate_progress_report against the old per-worker filtering on synthetic data.
+# Run from backend/:  python scripts/bench_progress_report.py [workers ...]
+import os
+import random
+import sys
+import time
+from datetime import datetime, date, timedelta
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blueprints.supervisor.progress_routes import generate_progress_report
+
+TASKS_PER_WORKER = 25
+ATTENDANCE_PER_WORKER = 250
+TASK_STATUSES = ["Pending", "In Progress", "Completed", "Approved", "Rejected"]
+ATTENDANCE_STATUSES = ["Present", "Absent", "Late", "Leave", "Half Day"]
+
+# ---------------- REFERENCE IMPLEMENTATION ----------------
+# generate_progress_report before tasks/attendance were grouped in one pass
+def old_progress_report(workers, tasks, attendance, start_date, end_date):
+    worker_performance = []
+    for worker in workers:
+        worker_id = str(worker["_id"])
+        worker_tasks = [t for t in tasks if t.get("assignedTo") == worker_id or t.get("assignedTo") == worker.get("email")]
+        completed_tasks = [t for t in worker_tasks if t.get("status") in ["Completed", "Approved"]]
+        worker_attendance = [a for a in attendance if a.get("workerId") == worker_id]
+        present_days = len([a for a in worker_attendance if a.get("status") == "Present"])
+        worker_performance.append({
+            "worker_id": worker_id,
+            "worker_name": worker.get("name", "Unknown"),
+            "tasks_assigned": len(worker_tasks),
+            "tasks_completed": len(completed_tasks),
+            "completion_rate": (len(completed_tasks) / len(worker_tasks) * 100) if len(worker_tasks) > 0 else 0,
+            "attendance_days": present_days,
+            "performance_score": old_performance_score(worker_tasks, worker_attendance)
+        })
+
+    task_status_count = {
+        "total": len(tasks),
+        "completed": len([t for t in tasks if t.get("status") in ["Completed", "Approved"]]),
+        "in_progress": len([t for t in tasks if t.get("status") == "In Progress"]),
+        "pending": len([t for t in tasks if t.get("status") == "Pending"]),
+        "overdue": len([t for t in tasks if
+            t.get("deadline") and
+            datetime.strptime(t["deadline"], "%Y-%m-%d").date() < datetime.now().date() and
+            t.get("status") not in ["Completed", "Approved"]
+        ])
+    }
+
+    attendance_summary = {
+        "total_records": len(attendance),
+        "present": len([a for a in attendance if a.get("status") == "Present"]),
+        "absent": len([a for a in attendance if a.get("status") == "Absent"]),
+        "late": len([a for a in attendance if a.get("status") == "Late"]),
+        "leave": len([a for a in attendance if a.get("status") == "Leave"]),
+        "attendance_rate": (len([a for a in attendance if a.get("status") == "Present"]) / len(attendance) * 100) if len(attendance) > 0 else 0
+    }
+
+    return {
+        "date_range": {"start": start_date, "end": end_date},
+        "worker_performance": worker_performance,
+        "task_summary": task_status_count,
+        "attendance_summary": attendance_summary,
+        "generated_at": datetime.now().isoformat()
+    }
+
+def old_performance_score(tasks, attendance):
+    if not tasks:
+        return 0
+    completed_tasks = len([t for t in tasks if t.get("status") in ["Completed", "Approved"]])
+    task_score = (completed_tasks / len(tasks)) * 50
+    if attendance:
+        present_days = len([a for a in attendance if a.get("status") == "Present"])
+        attendance_score = (present_days / len(attendance)) * 50
+    else:
+        attendance_score = 0
+    return round(task_score + attendance_score, 2)
+
+# ---------------- SYNTHETIC DATA ----------------
+# Helper function to build workers, tasks (assigned by id or email) and attendance rows
+def synthetic_data(worker_count, seed=42):
+    rng = random.Random(seed)
+    workers = [{"_id": ObjectId(), "name": f"Worker {i}", "email": f"worker{i}@example.com"} for i in range(worker_count)]
+    today = date.today()
+    tasks = []
+    for _ in range(worker_count * TASKS_PER_WORKER):
+        worker = rng.choice(workers)
+        tasks.append({
+            "assignedTo": str(worker["_id"]) if rng.random() < 0.7 else worker["email"],
+            "status": rng.choice(TASK_STATUSES),
+            "deadline": (today + timedelta(days=rng.randint(-30, 30))).isoformat()
+        })
+    attendance = [
+        {"workerId": str(rng.choice(workers)["_id"]), "status": rng.choice(ATTENDANCE_STATUSES)}
+        for _ in range(worker_count * ATTENDANCE_PER_WORKER)
+    ]
+    return workers, tasks, attendance
+
+# Helper function to time one report build
+def timed(report_fn, *args):
+    started = time.perf_counter()
+    report = report_fn(*args)
+    return time.perf_counter() - started, report
+
+def main(worker_counts):
+    print(f"{'workers':>8} {'tasks':>7} {'attendance':>11} {'old':>9} {'new':>9}")
+    for worker_count in worker_counts:
+        workers, tasks, attendance = synthetic_data(worker_count)
+        args = (workers, tasks, attendance, "2025-01-01", "2025-12-31")
+        old_seconds, old_report = timed(old_progress_report, *args)
+        new_seconds, new_report = timed(generate_progress_report, *args)
+        old_report.pop("generated_at")
+        new_report.pop("generated_at")
+        if old_report != new_report:
+            raise SystemExit(f"Reports differ for {worker_count} workers")
+        print(f"{worker_count:>8} {len(tasks):>7} {len(attendance):>11} {old_seconds:>8.3f}s {new_seconds:>8.3f}s")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [100, 200, 400, 800])
@@ -0,0 +1,16 @@
+# conftest.py
+import os
+import sys
+
+# The backend is run from its own directory (imports look like `from utils.x import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock.collection
+
+# mongomock's bulk builder predates the `sort` argument pymongo>=4.9 passes for UpdateOne
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+def _add_update_without_sort(self, *args, sort=None, **kwargs):
+    return _add_update(self, *args, **kwargs)
+
+mongomock.collection.BulkOperationBuilder.add_update = _add_update_without_sort
@@ -0,0 +1,109 @@
+# test_alert_notifications.py
+from datetime import datetime, timedelta, timezone
+import time
+import jwt
+import pytest
+from flask import Flask
+import blueprints.notifications as notifications
+from blueprints.notifications import socketio, alert_rooms, send_alert_update_notification, send_bulk_alert_update_notification
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test-secret-key-with-enough-bytes-for-hs256"
+    app.config["ALERT_COALESCE_WINDOW"] = 0.1
+    socketio.init_app(app, async_mode="threading")
+    return app
+
+@pytest.fixture
+def sent(monkeypatch):
+    events = []
+    monkeypatch.setattr(notifications, "_emit", lambda event, payload, rooms, namespace='/alerts': events.append((event, payload, set(rooms))))
+    return events
+
+# Helper function to sign a token the way /login does
+def token(app, **claims):
+    claims.setdefault("exp", datetime.now(timezone.utc) + timedelta(hours=1))
+    return jwt.encode(claims, app.config["SECRET_KEY"], algorithm="HS256")
+
+# Helper function to wait for background emits
+def wait_for(events, count, timeout=2):
+    deadline = time.monotonic() + timeout
+    while len(events) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return events
+
+# ---------------- ROOMS ----------------
+def test_alert_rooms_are_staff_plus_assignees():
+    assert alert_rooms("w1", "", None) == {"role:Manager", "role:Supervisor", "user:w1"}
+
+def test_connect_requires_a_valid_token(app):
+    assert not socketio.test_client(app, namespace="/alerts").is_connected("/alerts")
+    assert not socketio.test_client(app, namespace="/alerts", auth={"token": "garbage"}).is_connected("/alerts")
+    expired = token(app, email="a@x.com", role="Worker", exp=datetime.now(timezone.utc) - timedelta(minutes=1))
+    assert not socketio.test_client(app, namespace="/alerts", auth={"token": expired}).is_connected("/alerts")
+
+def test_clients_only_receive_their_rooms(app):
+    app.config["ALERT_COALESCE_WINDOW"] = 0
+    manager = socketio.test_client(app, namespace="/alerts", auth={"token": token(app, email="m@x.com", role="Manager")})
+    assignee = socketio.test_client(app, namespace="/alerts", auth={"token": token(app, email="w1@x.com", role="Worker")})
+    bystander = socketio.test_client(app, namespace="/alerts", auth={"token": token(app, email="w2@x.com", role="Worker")})
+    with app.app_context():
+        send_alert_update_notification("safety-1", {"assignedTo": "w1@x.com"})
+    assert [m["name"] for m in manager.get_received("/alerts")] == ["alert_update"]
+    assert [m["name"] for m in assignee.get_received("/alerts")] == ["alert_update"]
+    assert bystander.get_received("/alerts") == []
+
+# ---------------- COALESCING ----------------
+def test_updates_within_the_window_are_merged(app, sent):
+    with app.app_context():
+        send_alert_update_notification("safety-1", {"status": "In Progress"})
+        send_alert_update_notification("safety-1", {"status": "Resolved", "assignedTo": "w2"}, previous={"assignedTo": "w1"})
+        send_alert_update_notification("safety-2", {"status": "Open"})
+    wait_for(sent, 2)
+    by_alert = {payload["alertId"]: (payload, rooms) for _, payload, rooms in sent}
+    payload, rooms = by_alert["safety-1"]
+    assert payload["updates"] == {"status": "Resolved", "assignedTo": "w2"}
+    assert payload["coalesced"] == 2
+    assert {"user:w1", "user:w2"} <= rooms
+    assert by_alert["safety-2"][0]["coalesced"] == 1
+    assert len(sent) == 2
+
+def test_zero_window_emits_immediately(app, sent):
+    app.config["ALERT_COALESCE_WINDOW"] = 0
+    with app.app_context():
+        send_alert_update_notification("safety-1", {"status": "Open"})
+    assert sent[0][0] == "alert_update"
+    assert "coalesced" not in sent[0][1]
+
+def test_bulk_change_is_folded_into_pending_updates(app, sent):
+    with app.app_context():
+        send_alert_update_notification("safety-1", {"status": "In Progress"})
+        send_bulk_alert_update_notification(["safety-1", "safety-3"], {"status": "Resolved"})
+    assert sent[0][0] == "alerts_bulk_update"
+    wait_for(sent, 2)
+    assert sent[1][1]["updates"] == {"status": "Resolved"}
+
+# ---------------- ROUTES ----------------
+def test_safety_report_updates_are_sent_as_alert_updates(app, sent):
+    import mongomock
+    from bson import ObjectId
+    from blueprints.supervisor.safety_reports_routes import safety_reports_bp
+    from utils.auth import init_auth
+
+    db = mongomock.MongoClient()["test"]
+    app.config["SAFETY_COLLECTION"] = db["safety"]
+    app.config["USERS_COLLECTION"] = db["users"]
+    app.config["ALERT_COALESCE_WINDOW"] = 0
+    init_auth(app)
+    app.register_blueprint(safety_reports_bp, url_prefix="/api")
+    report_id = db["safety"].insert_one({"workerId": "", "status": "Open", "resolved": False, "assignedTo": "w1"}).inserted_id
+
+    headers = {"Authorization": "Bearer " + token(app, email="sup@x.com", role="Supervisor")}
+    response = app.test_client().put(f"/api/safety-reports/{report_id}", json={"status": "Resolved", "resolved": True}, headers=headers)
+    assert response.status_code == 200
+
+    event, payload, rooms = sent[0]
+    assert event == "alert_update" and payload["alertId"] == f"safety-{report_id}"
+    assert payload["updates"]["status"] == "Resolved" and "updatedAt" not in payload["updates"]
+    assert {"role:Supervisor", "user:w1"} <= rooms
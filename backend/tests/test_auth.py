@@ -0,0 +1,47 @@
+# test_auth.py
+import mongomock
+import pytest
+from flask import Flask, g
+from utils.auth import resolve_identity
+from utils.user_directory import UserDirectory
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    users = mongomock.MongoClient()["test"]["users"]
+    app.config["USERS_COLLECTION"] = users
+    app.config["USER_DIRECTORY"] = UserDirectory(users)
+    return app
+
+# Helper function to resolve the caller for a token carrying `claims`
+def identity(app, **claims):
+    with app.test_request_context("/api/profile"):
+        g.claims = claims
+        return resolve_identity(app.config["USERS_COLLECTION"])
+
+# Helper function to count the queries made on a collection
+def count_queries(monkeypatch, collection):
+    calls = []
+    find_one = collection.find_one
+    monkeypatch.setattr(collection, "find_one", lambda *a, **k: (calls.append(a), find_one(*a, **k))[1])
+    return calls
+
+def test_a_cold_cache_checks_the_user_once_and_then_trusts_the_claims(app, monkeypatch):
+    users = app.config["USERS_COLLECTION"]
+    user_id = str(users.insert_one({"email": "a@x.com", "name": "A", "role": "Worker", "version": 2}).inserted_id)
+    queries = count_queries(monkeypatch, users)
+
+    claims = {"uid": user_id, "uver": 2, "email": "a@x.com", "name": "A", "role": "Worker"}
+    assert identity(app, **claims)["name"] == "A"
+    assert identity(app, **claims)["name"] == "A"
+    assert len(queries) == 1
+
+def test_deleted_users_are_not_resolved_from_their_claims(app):
+    claims = {"uid": "0123456789abcdef01234567", "uver": 0, "email": "gone@x.com", "name": "Gone", "role": "Manager"}
+    assert identity(app, **claims) is None
+
+def test_a_newer_stored_version_beats_stale_claims(app):
+    users = app.config["USERS_COLLECTION"]
+    user_id = str(users.insert_one({"email": "a@x.com", "name": "A", "role": "Supervisor", "version": 3}).inserted_id)
+    claims = {"uid": user_id, "uver": 1, "email": "a@x.com", "name": "A", "role": "Worker"}
+    assert identity(app, **claims)["role"] == "Supervisor"
@@ -0,0 +1,92 @@
+# test_bulk_alert_actions.py
+from datetime import datetime, timedelta, timezone
+import jwt
+import mongomock
+import pytest
+from bson import ObjectId
+from flask import Flask
+import blueprints.supervisor.alerts_routes as alerts_routes
+from blueprints.supervisor.alerts_routes import alerts_bp
+from utils.auth import init_auth
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test-secret-key-with-enough-bytes-for-hs256"
+    db = mongomock.MongoClient().db
+    app.config["SAFETY_COLLECTION"] = db["safety"]
+    app.config["EMERGENCY_COLLECTION"] = db["emergencies"]
+    init_auth(app)
+    app.register_blueprint(alerts_bp, url_prefix="/api")
+    return app
+
+@pytest.fixture
+def notified(monkeypatch):
+    sent = []
+    monkeypatch.setattr(alerts_routes, "send_bulk_alert_update_notification",
+                        lambda ids, updates, previous=(): sent.append((sorted(ids), set(previous))))
+    return sent
+
+# Helper function to send a bulk action as a supervisor
+def bulk(app, alert_ids, action):
+    claims = {"email": "sup@site.com", "name": "Sup", "role": "Supervisor", "exp": datetime.now(timezone.utc) + timedelta(hours=1)}
+    token = jwt.encode(claims, app.config["SECRET_KEY"], algorithm="HS256")
+    response = app.test_client().post("/api/alerts/bulk", json={"alertIds": alert_ids, "action": action},
+                                      headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    return {d["alertId"]: d.get("error", "success") for d in response.get_json()["results"]["details"]}
+
+# Helper function to count the calls made on a collection
+def count_calls(monkeypatch, collection, calls):
+    for name in ["find", "find_one", "update_one", "update_many", "bulk_write"]:
+        original = getattr(collection, name)
+        monkeypatch.setattr(collection, name, lambda *a, __name=name, __original=original, **k: (calls.append(__name), __original(*a, **k))[1])
+
+def test_mixed_batch_reports_what_was_written(app, notified, monkeypatch):
+    safety, emergencies = app.config["SAFETY_COLLECTION"], app.config["EMERGENCY_COLLECTION"]
+    open_report = safety.insert_one({"status": "Open", "resolved": False, "assignedTo": "w1@site.com"}).inserted_id
+    acknowledged = safety.insert_one({"status": "In Progress", "resolved": False}).inserted_id
+    emergency = emergencies.insert_one({"status": "Open", "resolved": False, "assignedTo": "w2@site.com"}).inserted_id
+    missing = ObjectId()
+
+    calls = []
+    count_calls(monkeypatch, safety, calls)
+    count_calls(monkeypatch, emergencies, calls)
+    outcomes = bulk(app, [f"safety-{open_report}", f"safety-{acknowledged}", f"emergency-{emergency}", f"emergency-{missing}", "bogus"], "acknowledge")
+
+    assert outcomes == {
+        f"safety-{open_report}": "success",
+        f"safety-{acknowledged}": "Alert not found or no changes made",
+        f"emergency-{emergency}": "success",
+        f"emergency-{missing}": "Alert not found or no changes made",
+        "bogus": "Invalid alert ID format",
+    }
+    # One write and one read-back per collection
+    assert calls.count("update_many") == 2 and len(calls) == 4
+    assert notified[0][1] == {"w1@site.com", "w2@site.com"}
+
+def test_alert_removed_by_another_writer_is_not_reported(app, notified, monkeypatch):
+    safety = app.config["SAFETY_COLLECTION"]
+    raced = safety.insert_one({"status": "Open", "resolved": False}).inserted_id
+    kept = safety.insert_one({"status": "Open", "resolved": False}).inserted_id
+
+    # Another worker deletes `raced` just before this request's write lands
+    update_many = safety.update_many
+    def racing_update_many(query, update, **kwargs):
+        safety.delete_one({"_id": raced})
+        return update_many(query, update, **kwargs)
+    monkeypatch.setattr(safety, "update_many", racing_update_many)
+
+    outcomes = bulk(app, [f"safety-{raced}", f"safety-{kept}"], "resolve")
+    assert outcomes == {f"safety-{raced}": "Alert not found or no changes made", f"safety-{kept}": "success"}
+    assert notified[0][0] == [f"safety-{kept}"]
+
+def test_assign_to_me_reaches_the_previous_assignees(app, notified):
+    emergencies = app.config["EMERGENCY_COLLECTION"]
+    first = emergencies.insert_one({"status": "Open", "assignedTo": "w1@site.com"}).inserted_id
+    second = emergencies.insert_one({"status": "Open"}).inserted_id
+
+    outcomes = bulk(app, [f"emergency-{first}", f"emergency-{second}"], "assign-to-me")
+    assert set(outcomes.values()) == {"success"}
+    assert emergencies.find_one({"_id": first})["assignedTo"] == "sup@site.com"
+    assert notified[0][1] == {"w1@site.com"}
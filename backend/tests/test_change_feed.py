@@ -0,0 +1,212 @@
+# test_change_feed.py
+import time
+import mongomock
+import pytest
+from bson import ObjectId
+from flask import Flask
+from utils.events import EventBus
+from utils.change_feed import (
+    ChangeFeed, touch, stamped_update, without_stamps, is_own_write, record_deletion, UPDATED_AT, UPDATED_FROM, utc_now
+)
+
+FOREIGN = "0123456789ab.cafe0000"
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["test"]
+
+# Helper function to collect bus events for some topics
+def recorder(bus, *topics):
+    events = []
+    for topic in topics:
+        bus.subscribe(topic, lambda topic, event: events.append(event))
+    return events
+
+# Helper function to wait until `check()` holds
+def eventually(check, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+# ---------------- STAMPS ----------------
+def test_every_write_gets_a_new_own_stamp():
+    first, second = touch({"a": 1}), touch({"a": 1})
+    assert first[UPDATED_FROM] != second[UPDATED_FROM]
+    assert is_own_write(first[UPDATED_FROM]) and is_own_write(second[UPDATED_FROM])
+    assert not is_own_write(FOREIGN) and not is_own_write(None)
+    assert without_stamps(first) == {"a": 1}
+    # Stored dates keep whole milliseconds; anything finer would make stamps compare unequal
+    assert first[UPDATED_AT].microsecond % 1000 == 0
+
+def test_stamped_update_leaves_no_op_writes_unmodified(db):
+    doc_id = db.items.insert_one({"status": "open"}).inserted_id
+    assert db.items.update_one(*stamped_update({"_id": doc_id}, {"status": "open"})).modified_count == 0
+    assert db.items.update_one(*stamped_update({"_id": doc_id}, {"status": "done"})).modified_count == 1
+    assert UPDATED_AT in db.items.find_one({"_id": doc_id})
+
+# ---------------- CHANGE STREAM EVENTS ----------------
+# Helper function to build a change stream document
+def change(op, doc_id, updated_fields=None, full_document=None):
+    event = {"operationType": op, "ns": {"coll": "safety"}, "documentKey": {"_id": doc_id}, "fullDocument": full_document}
+    if op == "update":
+        event["updateDescription"] = {"updatedFields": updated_fields or {}}
+    return event
+
+def test_echo_comes_from_the_write_not_the_looked_up_document(app, db):
+    feed = ChangeFeed(app, EventBus(), [db.safety])
+    doc_id = ObjectId()
+    ours, theirs = touch({"status": "a"}), {"status": "b", UPDATED_AT: utc_now(), UPDATED_FROM: FOREIGN}
+
+    # Our write, but another process wrote again before the lookup
+    event = feed._stream_event(change("update", doc_id, ours, {"_id": doc_id, **theirs}))
+    assert event["echo"] is True
+    assert event["updates"] == {"status": "a"}
+
+    # Their write, looked up after ours
+    assert feed._stream_event(change("update", doc_id, theirs, {"_id": doc_id, **ours}))["echo"] is False
+    # An unstamped write (e.g. from the mongo shell) is never ours
+    assert feed._stream_event(change("update", doc_id, {"status": "c"}, {"_id": doc_id, **ours}))["echo"] is False
+
+def test_insert_and_delete_events(app, db):
+    feed = ChangeFeed(app, EventBus(), [db.safety])
+    doc_id = ObjectId()
+    inserted = feed._stream_event(change("insert", doc_id, full_document={"_id": doc_id, **touch({"status": "a"})}))
+    assert (inserted["op"], inserted["echo"], inserted["updates"]) == ("insert", True, {"status": "a"})
+    deleted = feed._stream_event(change("delete", doc_id))
+    assert (deleted["op"], deleted["document"], deleted["echo"]) == ("delete", None, False)
+
+class FakeStream:
+    """Just enough of a pymongo ChangeStream to drive _watch()"""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def alive(self):
+        return True
+
+    def try_next(self):
+        if not self.changes:
+            time.sleep(0.01)
+            return None
+        self.resume_token = {"n": len(self.changes)}
+        return self.changes.pop(0)
+
+class FakeCollection:
+    name = "safety"
+
+    def __init__(self, streams):
+        self.database = self
+        self.streams = streams
+
+    def watch(self, *args, **kwargs):
+        return self.streams.pop(0)
+
+def test_a_bad_event_doesnt_stop_the_feed(app):
+    doc_id = ObjectId()
+    good = change("insert", doc_id, full_document={"_id": doc_id, "status": "a"})
+    streams = [FakeStream([{"operationType": "insert"}]), FakeStream([good])]
+    bus = EventBus(app.logger)
+    events = recorder(bus, "safety")
+    feed = ChangeFeed(app, bus, [FakeCollection(streams)], retry_delay=0)
+    feed.start()
+    try:
+        assert eventually(lambda: events)
+        assert events[0]["id"] == str(doc_id)
+        assert feed.mode == "change_stream" and feed.thread.is_alive()
+    finally:
+        feed.stop()
+
+# ---------------- POLLING FALLBACK ----------------
+def test_polling_publishes_stamped_writes_once(app, db):
+    # mongomock has no change streams, so the feed falls back to polling
+    bus = EventBus(app.logger)
+    events = recorder(bus, "safety", "users")
+    feed = ChangeFeed(app, bus, [db.safety, db.users], poll_interval=0.05, lookback=1)
+    feed.start()
+    try:
+        assert eventually(lambda: feed.mode == "poll")
+        foreign_id = db.safety.insert_one({"status": "open", UPDATED_AT: utc_now(), UPDATED_FROM: FOREIGN}).inserted_id
+        own_id = db.users.insert_one(touch({"name": "A"})).inserted_id
+        db.users.insert_one({"name": "unstamped"})
+        assert eventually(lambda: len(events) >= 2)
+        time.sleep(0.2)
+        by_id = {event["id"]: event for event in events}
+        assert len(events) == 2
+        assert (by_id[str(foreign_id)]["op"], by_id[str(foreign_id)]["echo"]) == ("insert", False)
+        assert by_id[str(own_id)]["echo"] is True
+        assert UPDATED_AT not in by_id[str(foreign_id)]["updates"]
+
+        # A later write to the same document is published again, as an update
+        db.safety.update_one({"_id": foreign_id}, {"$set": {
+            "status": "closed", UPDATED_AT: utc_now(), UPDATED_FROM: FOREIGN,
+        }})
+        assert eventually(lambda: len(events) == 3)
+        assert events[2]["document"]["status"] == "closed"
+    finally:
+        feed.stop()
+
+def test_polling_sees_deletes_through_tombstones_and_never_reads_passwords(app, db):
+    from utils.user_directory import UserDirectory
+    app.config["DELETIONS_COLLECTION"] = db.deletions
+    bus = EventBus(app.logger)
+    events = recorder(bus, "users")
+    directory = UserDirectory(db.users)
+    bus.subscribe("users", directory.apply_change)
+    feed = ChangeFeed(app, bus, [db.users], deletions=db.deletions, poll_interval=0.05, lookback=1)
+    feed.start()
+    try:
+        assert eventually(lambda: feed.mode == "poll")
+        user_id = db.users.insert_one({"name": "A", "password": "p", UPDATED_AT: utc_now(), UPDATED_FROM: FOREIGN}).inserted_id
+        assert eventually(lambda: len(events) == 1)
+        assert "password" not in events[0]["document"]
+        assert directory.get_by_id(str(user_id))["name"] == "A"
+
+        # Deleted by another process: only its tombstone is left to poll
+        db.users.delete_one({"_id": user_id})
+        db.deletions.insert_one({"collection": "users", "documentId": str(user_id), UPDATED_AT: utc_now(), UPDATED_FROM: FOREIGN})
+        assert eventually(lambda: len(events) == 2)
+        assert (events[1]["op"], events[1]["id"], events[1]["echo"]) == ("delete", str(user_id), False)
+        assert directory.peek(user_id=str(user_id)) is None
+    finally:
+        feed.stop()
+
+def test_delete_routes_leave_own_tombstones(app, db):
+    with app.app_context():
+        record_deletion(db.users, "abc")
+    app.config["DELETIONS_COLLECTION"] = db.deletions
+    with app.app_context():
+        record_deletion(db.users, "abc")
+    tombstone = db.deletions.find_one()
+    assert db.deletions.count_documents({}) == 1
+    assert (tombstone["collection"], tombstone["documentId"]) == ("users", "abc")
+    assert is_own_write(tombstone[UPDATED_FROM])
+
+def test_polled_updates_of_old_documents_are_updates(app, db):
+    feed = ChangeFeed(app, EventBus(), [db.safety])
+    old_id = ObjectId.from_datetime(utc_now().replace(year=2020))
+    event = feed._poll_event("safety", {"_id": old_id, "status": "x", UPDATED_AT: utc_now(), UPDATED_FROM: FOREIGN})
+    assert event["op"] == "update"
+
+# ---------------- RESPONSES ----------------
+def test_cached_users_carry_no_stamps(db):
+    from utils.user_directory import UserDirectory
+    user_id = db.users.insert_one(touch({"name": "A", "email": "a@x.com", "password": "p"})).inserted_id
+    directory = UserDirectory(db.users)
+    assert set(directory.get_by_id(str(user_id))) == {"_id", "name", "email"}
+    directory.apply_change("users", {"source": "poll", "id": str(user_id), "document": db.users.find_one({"_id": user_id})})
+    assert set(directory.peek(user_id=str(user_id))) == {"_id", "name", "email"}
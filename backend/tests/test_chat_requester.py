@@ -0,0 +1,46 @@
+# test_chat_requester.py
+from datetime import datetime, timedelta, timezone
+import jwt
+import pytest
+from flask import Flask
+from blueprints.chat import chat_bp, requester_key
+from utils.auth import init_auth, authenticate_request
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test-secret-key-with-enough-bytes-for-hs256"
+    init_auth(app)
+    app.register_blueprint(chat_bp, url_prefix="/api")
+    return app
+
+# Helper function to sign a token the way /login does
+def token(app, email):
+    claims = {"email": email, "role": "Worker", "exp": datetime.now(timezone.utc) + timedelta(hours=1)}
+    return {"Authorization": "Bearer " + jwt.encode(claims, app.config["SECRET_KEY"], algorithm="HS256")}
+
+@pytest.mark.parametrize("method,path", [
+    ("post", "/api/chat"),
+    ("post", "/api/chat/stream"),
+    ("post", "/api/chat/stream/abc/cancel"),
+    ("delete", "/api/chat/session/abc"),
+])
+def test_chat_routes_require_a_token(app, method, path):
+    response = getattr(app.test_client(), method)(path, json={"message": "hi"})
+    assert response.status_code == 401
+
+def test_callers_behind_one_address_get_their_own_queue_key(app):
+    keys = set()
+    for email in ["a@site.com", "b@site.com", "c@site.com"]:
+        with app.test_request_context("/api/chat", headers=token(app, email), environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+            authenticate_request()
+            keys.add(requester_key())
+    assert keys == {"a@site.com", "b@site.com", "c@site.com"}
+
+def test_the_session_id_does_not_change_the_key(app):
+    keys = set()
+    for session_id in ["one", "two", "three"]:
+        with app.test_request_context("/api/chat", json={"sessionId": session_id}, headers=token(app, "a@site.com")):
+            authenticate_request()
+            keys.add(requester_key())
+    assert keys == {"a@site.com"}
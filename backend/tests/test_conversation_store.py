@@ -0,0 +1,52 @@
+# test_conversation_store.py
+from flask import Flask
+from blueprints.chat import prepare_turn, finish_turn
+from utils.conversation_store import ConversationStore
+
+def make_app():
+    app = Flask(__name__)
+    app.config["CONVERSATION_STORE"] = ConversationStore(token_budget=3000)
+    return app
+
+def test_new_sessions_send_the_whole_window_until_there_is_a_context():
+    app = make_app()
+    store = app.config["CONVERSATION_STORE"]
+    with app.app_context():
+        prompt, options, conversation, _ = prepare_turn({"message": "hi"}, "hi")
+        assert options == {}
+        finish_turn(store, conversation, "hi", "hello", [1, 2, 3])
+
+        prompt, options, _, prior = prepare_turn({"sessionId": conversation["sessionId"]}, "next")
+    assert options == {"context": [1, 2, 3]}
+    assert prompt == "user: next\nassistant:"
+    assert [m["content"] for m in prior] == ["hi", "hello"]
+
+def test_a_cached_reply_keeps_the_context_and_is_replayed_as_text():
+    app = make_app()
+    store = app.config["CONVERSATION_STORE"]
+    with app.app_context():
+        _, _, conversation, _ = prepare_turn({}, "hi")
+        finish_turn(store, conversation, "hi", "hello", [1, 2, 3])
+        # Reply cache hit: no new context
+        finish_turn(store, conversation, "again", "cached", None)
+
+        prompt, options, _, _ = prepare_turn(conversation, "next")
+    assert options == {"context": [1, 2, 3]}
+    assert prompt == "user: again\nassistant: cached\nuser: next\nassistant:"
+
+    with app.app_context():
+        finish_turn(store, conversation, "next", "fresh", [4, 5])
+        prompt, options, _, _ = prepare_turn(conversation, "last")
+    assert options == {"context": [4, 5]}
+    assert prompt == "user: last\nassistant:"
+
+def test_legacy_history_is_still_answered():
+    app = make_app()
+    store = app.config["CONVERSATION_STORE"]
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    with app.app_context():
+        prompt, options, conversation, _ = prepare_turn({"history": history}, "next")
+        finished = finish_turn(store, conversation, "next", "sure", None)
+    assert options == {}
+    assert prompt.endswith("user: next\nassistant:")
+    assert [m["content"] for m in finished["history"]] == ["hi", "hello", "next", "sure"]
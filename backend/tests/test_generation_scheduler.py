@@ -0,0 +1,83 @@
+# test_generation_scheduler.py
+import threading
+import pytest
+from utils.generation_scheduler import GenerationScheduler, SchedulerRejected
+
+def test_free_slots_are_granted_immediately():
+    scheduler = GenerationScheduler(max_concurrent=2)
+    first, second = scheduler.enqueue("a"), scheduler.enqueue("b")
+    assert scheduler.wait(first, 0) and scheduler.wait(second, 0)
+    assert scheduler.stats()["running"] == 2
+
+def test_waiting_users_are_served_round_robin():
+    scheduler = GenerationScheduler(max_concurrent=1, max_per_user=3)
+    running = scheduler.enqueue("busy")
+    a1, a2, a3 = scheduler.enqueue("a"), scheduler.enqueue("a"), scheduler.enqueue("a")
+    b1 = scheduler.enqueue("b")
+    assert [scheduler.position(t) for t in (a1, b1, a2, a3)] == [1, 2, 3, 4]
+
+    served = []
+    current = running
+    for _ in range(4):
+        scheduler.release(current)
+        current = next(t for t in (a1, a2, a3, b1) if t.state == "running")
+        served.append(current)
+    # b doesn't wait behind all of a's requests
+    assert served == [a1, b1, a2, a3]
+
+def test_per_user_limit_is_429():
+    scheduler = GenerationScheduler(max_concurrent=1, max_per_user=2)
+    scheduler.enqueue("a")
+    scheduler.enqueue("a")
+    with pytest.raises(SchedulerRejected) as e:
+        scheduler.enqueue("a")
+    assert e.value.status == 429
+    # Other users are unaffected
+    scheduler.enqueue("b")
+
+def test_full_queue_is_503():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=1)
+    scheduler.enqueue("a")
+    scheduler.enqueue("b")
+    with pytest.raises(SchedulerRejected) as e:
+        scheduler.enqueue("c")
+    assert e.value.status == 503
+    assert e.value.retry_after
+
+def test_releasing_a_queued_ticket_drops_it():
+    scheduler = GenerationScheduler(max_concurrent=1)
+    running = scheduler.enqueue("a")
+    queued = scheduler.enqueue("b")
+    scheduler.release(queued)
+    scheduler.release(queued)
+    assert scheduler.stats()["queued"] == 0
+    scheduler.release(running)
+    assert scheduler.stats() == {"running": 0, "queued": 0, "users": 0, "admitted": 2, "rejected": 0, "timedOut": 0}
+
+def test_slot_times_out_and_frees_its_place():
+    scheduler = GenerationScheduler(max_concurrent=1, max_wait=0.05)
+    holder = scheduler.enqueue("a")
+    with pytest.raises(SchedulerRejected) as e:
+        with scheduler.slot("b"):
+            pass
+    assert e.value.status == 503
+    assert scheduler.stats()["timedOut"] == 1
+    assert scheduler.stats()["queued"] == 0
+    scheduler.release(holder)
+
+def test_slot_waits_for_a_release():
+    scheduler = GenerationScheduler(max_concurrent=1, max_wait=5)
+    holder = scheduler.enqueue("a")
+    entered = threading.Event()
+
+    def worker():
+        with scheduler.slot("b"):
+            entered.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not entered.wait(0.05)
+    scheduler.release(holder)
+    assert entered.wait(1)
+    thread.join(1)
+    assert scheduler.stats()["running"] == 0
@@ -0,0 +1,90 @@
+# test_live_counters.py
+from datetime import date
+import time
+import mongomock
+import pytest
+from flask import Flask
+from utils.live_counters import LiveCounters, DASHBOARD_COUNTERS
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    db = mongomock.MongoClient()["test"]
+    app.config["TASKS_COLLECTION"] = db["tasks"]
+    app.config["ATTENDANCE_COLLECTION"] = db["attendance"]
+    app.config["SAFETY_COLLECTION"] = db["safety"]
+    app.config["EMERGENCY_COLLECTION"] = db["emergencies"]
+    return app
+
+# Helper function to wait until `check()` holds
+def eventually(check, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+ALL_ZERO = dict.fromkeys(DASHBOARD_COUNTERS, 0)
+
+def test_fresh_values_after_a_full_offer(app):
+    counters = LiveCounters(app)
+    today = date.today().isoformat()
+    assert counters.fresh_values() is None
+    counters.offer(ALL_ZERO, counters.snapshot_marks(), today)
+    assert counters.fresh_values() == ALL_ZERO
+
+def test_change_during_a_count_keeps_the_counter_dirty(app):
+    counters = LiveCounters(app)
+    marks = counters.snapshot_marks()
+    counters.mark_dirty("tasks")
+    counters.offer(ALL_ZERO, marks, date.today().isoformat())
+    assert counters.fresh_values() is None
+
+def test_echo_events_are_ignored(app):
+    counters = LiveCounters(app)
+    counters.offer(ALL_ZERO, counters.snapshot_marks(), date.today().isoformat())
+    counters.mark_dirty("tasks", {"echo": True})
+    assert counters.fresh_values() == ALL_ZERO
+
+def test_partial_recount_doesnt_carry_yesterdays_attendance(app):
+    counters = LiveCounters(app)
+    counters.offer(ALL_ZERO, counters.snapshot_marks(), "2000-01-01")
+    # After midnight only the tasks counter is recounted
+    counters.offer({"pendingTasks": 1}, counters.snapshot_marks(), date.today().isoformat())
+    assert counters.fresh_values() is None
+    with counters.cond:
+        counters._mark_due(date.today().isoformat())
+        assert "todayAttendance" in counters.dirty
+        assert "pendingTasks" not in counters.dirty
+
+def test_full_recount_runs_on_schedule_despite_other_changes(app):
+    counters = LiveCounters(app, debounce=0, refresh_interval=0.3)
+    counters.subscribe()
+    try:
+        assert eventually(lambda: counters.values.get("todayAttendance") == 0)
+        # A write the bus never hears about, while tasks keep changing
+        app.config["ATTENDANCE_COLLECTION"].insert_one({"date": date.today().isoformat()})
+        deadline = time.monotonic() + 1.5
+        while time.monotonic() < deadline and counters.values.get("todayAttendance") != 1:
+            counters.mark_dirty("tasks")
+            time.sleep(0.05)
+        assert counters.values["todayAttendance"] == 1
+    finally:
+        counters.unsubscribe()
+
+def test_subscribers_see_each_change_once(app):
+    counters = LiveCounters(app, debounce=0.05, refresh_interval=60)
+    counters.subscribe()
+    try:
+        assert eventually(lambda: counters.version > 0)
+        version = counters.version
+        for _ in range(5):
+            app.config["TASKS_COLLECTION"].insert_one({"status": "pending"})
+            counters.mark_dirty("tasks")
+        version, values = counters.wait(version, 2)
+        if values["pendingTasks"] != 5:
+            version, values = counters.wait(version, 2)
+        assert values["pendingTasks"] == 5
+    finally:
+        counters.unsubscribe()
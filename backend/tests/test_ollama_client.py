@@ -0,0 +1,153 @@
+# test_ollama_client.py
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import socket
+import threading
+import time
+import pytest
+import requests
+import utils.ollama_client as ollama_client
+from utils.ollama_client import OllamaClient
+
+# ---------------- STUB OLLAMA SERVER ----------------
+class StubHandler(BaseHTTPRequestHandler):
+    """Minimal /api/generate: plain or NDJSON-streamed, with failure modes set on the server"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.server.connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        if self.server.resets:
+            # Drop the connection without answering, like a restarted server
+            self.server.resets -= 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(self.server.delay)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            chunks = [{"response": word, "done": False} for word in self.server.words]
+            chunks.append({"response": "", "done": True, "context": [1, 2, 3]})
+            for chunk in chunks:
+                line = (json.dumps(chunk) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            out = json.dumps({"response": "".join(self.server.words), "done": True, "context": [1, 2, 3]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (timeouts, closed streams) are expected here
+        pass
+
+@pytest.fixture
+def stub():
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    server.connections = 0
+    server.requests = []
+    server.resets = 0
+    server.status = 200
+    server.delay = 0
+    server.words = ["Hello", " there", "!"]
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ollama_client, "RETRY_BACKOFF", 0)
+
+# Helper function to get a port nothing listens on
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# ---------------- TESTS ----------------
+def test_generate_reuses_one_pooled_connection(stub):
+    client = OllamaClient(base_url=stub.url)
+    for _ in range(3):
+        assert client.generate("hi")["response"] == "Hello there!"
+    assert stub.connections == 1
+    assert stub.requests[0]["model"] == "llama3"
+    assert stub.requests[0]["stream"] is False
+
+def test_generate_passes_options(stub):
+    client = OllamaClient(base_url=stub.url)
+    client.generate("hi", options={"num_predict": 8}, context=[4])
+    assert stub.requests[0]["options"] == {"num_predict": 8}
+    assert stub.requests[0]["context"] == [4]
+
+def test_reset_connection_is_retried(stub):
+    stub.resets = 1
+    client = OllamaClient(base_url=stub.url, retries=2)
+    assert client.generate("hi")["done"] is True
+    assert len(stub.requests) == 2
+
+def test_retries_give_up_after_the_limit(stub):
+    stub.resets = 5
+    client = OllamaClient(base_url=stub.url, retries=2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.generate("hi")
+    assert len(stub.requests) == 3
+
+def test_refused_connection_raises_after_retries():
+    client = OllamaClient(base_url=f"http://127.0.0.1:{closed_port()}", retries=1)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.generate("hi")
+
+def test_read_timeout_is_not_retried(stub):
+    stub.delay = 0.5
+    client = OllamaClient(base_url=stub.url, read_timeout=0.1, retries=2)
+    with pytest.raises(requests.exceptions.Timeout):
+        client.generate("hi")
+    assert len(stub.requests) == 1
+
+def test_http_error_is_raised(stub):
+    stub.status = 500
+    client = OllamaClient(base_url=stub.url)
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.generate("hi")
+
+def test_stream_generate_yields_chunks_and_returns_the_connection(stub):
+    client = OllamaClient(base_url=stub.url)
+    chunks = list(client.stream_generate("hi"))
+    assert [chunk["response"] for chunk in chunks] == ["Hello", " there", "!", ""]
+    assert chunks[-1]["done"] is True
+    assert stub.requests[0]["stream"] is True
+
+    # The finished stream's connection serves the next request
+    client.generate("again")
+    assert stub.connections == 1
+
+def test_closing_a_stream_early_releases_it(stub):
+    client = OllamaClient(base_url=stub.url)
+    stream = client.stream_generate("hi")
+    assert next(stream)["response"] == "Hello"
+    stream.close()
+    assert client.generate("again")["done"] is True
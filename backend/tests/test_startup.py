@@ -0,0 +1,31 @@
+# test_startup.py
+import time
+import mongomock
+from flask import Flask
+from pymongo import MongoClient
+from utils.indexes import init_indexes, mongo_reachable
+from utils.migrations import init_migrations
+
+COLLECTIONS = ["USERS_COLLECTION", "TASKS_COLLECTION", "ATTENDANCE_COLLECTION", "SAFETY_COLLECTION", "EMERGENCY_COLLECTION", "DELETIONS_COLLECTION"]
+
+# Helper function to build an app whose collections live on `client`
+def make_app(client):
+    app = Flask(__name__)
+    app.config["STARTUP_PING_TIMEOUT"] = 0.5
+    db = client["construction_app"]
+    for name in COLLECTIONS:
+        app.config[name] = db[name.split("_")[0].lower()]
+    return app
+
+def test_unreachable_mongo_skips_the_startup_bootstrap_quickly():
+    app = make_app(MongoClient("mongodb://127.0.0.1:1/", connect=False))
+    started = time.monotonic()
+    init_indexes(app)
+    init_migrations(app)
+    assert time.monotonic() - started < 2
+
+def test_reachable_mongo_gets_its_indexes():
+    app = make_app(mongomock.MongoClient())
+    assert mongo_reachable(app)
+    init_indexes(app)
+    assert "email_1" in app.config["USERS_COLLECTION"].index_information()
@@ -0,0 +1,37 @@
+# test_work_hours.py
+import mongomock
+import pytest
+from utils.migrations import backfill_attendance_minutes
+from utils.work_hours import HHMM_PATTERN, time_to_minutes, _parse_minutes_expr
+
+@pytest.mark.parametrize("value,minutes", [
+    ("00:00", 0), ("09:30", 570), ("23:59", 1439),
+    ("9:30", None), ("09:30:00", None), ("24:00", None), ("09:60", None),
+    ("09:30\n", None), (" 09:30", None), ("", None), (None, None), (570, None),
+])
+def test_only_exact_hh_mm_is_parsed(value, minutes):
+    assert time_to_minutes(value) == minutes
+
+def test_the_pipeline_parser_checks_the_same_pattern():
+    expr = _parse_minutes_expr("checkIn")
+    string_branch = expr["$cond"][1]["$cond"][0]["$and"]
+    assert {"$eq": [{"$strLenBytes": "$checkIn"}, 5]} in string_branch
+    assert {"$regexMatch": {"input": "$checkIn", "regex": HHMM_PATTERN}} in string_branch
+
+def test_old_attendance_gets_its_minute_fields_once():
+    attendance = mongomock.MongoClient()["test"]["attendance"]
+    attendance.insert_many([
+        {"n": 1, "checkIn": "08:00", "checkOut": "17:30"},
+        {"n": 2, "checkIn": "08:00"},
+        {"n": 3, "checkIn": "8:00", "checkOut": ""},
+        {"n": 4, "checkIn": "08:00", "checkOut": "12:00", "checkInMinutes": 480, "checkOutMinutes": 720},
+    ])
+    config = {"ATTENDANCE_COLLECTION": attendance}
+    assert backfill_attendance_minutes(config) == 3
+    assert backfill_attendance_minutes(config) == 0
+
+    by_n = {record["n"]: record for record in attendance.find()}
+    assert (by_n[1]["checkInMinutes"], by_n[1]["checkOutMinutes"]) == (480, 1050)
+    assert by_n[2]["checkInMinutes"] == 480 and "checkOutMinutes" not in by_n[2]
+    assert (by_n[3]["checkInMinutes"], by_n[3]["checkOutMinutes"]) == (None, None)
+    assert by_n[1]["updatedAt"] is not None and "updatedAt" not in by_n[4]
@@ -0,0 +1,145 @@
+# auth.py
+from flask import request, jsonify, current_app, g
+from collections import OrderedDict
+from functools import wraps
+import threading
+import time
+import jwt
+from bson import ObjectId
+from utils.user_directory import get_user_directory
+from utils.user_resolver import get_user_by_id, get_user_by_email
+
+# Roles allowed on the supervisor/manager screens
+STAFF_ROLES = ("Manager", "Supervisor")
+
+# ---------------- VERIFIED TOKEN CACHE ----------------
+class TokenCache:
+    """Bounded LRU of already-verified tokens, each kept until its `exp`"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()     # raw token -> (exp timestamp, claims)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        """Claims for a token verified earlier, or None"""
+        with self.lock:
+            entry = self.tokens.get(token)
+            if entry and entry[0] > time.time():
+                self.tokens.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                # Expired: make the caller re-verify so it gets the proper "Token expired" error
+                self.tokens.pop(token, None)
+            self.misses += 1
+            return None
+
+    def put(self, token, claims):
+        """Remember a verified token until its exp claim"""
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        with self.lock:
+            self.tokens[token] = (exp, claims)
+            self.tokens.move_to_end(token)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+    def clear(self):
+        """Drop everything (e.g. after rotating SECRET_KEY)"""
+        with self.lock:
+            self.tokens.clear()
+
+    def stats(self):
+        """Cache size and hit/miss counts"""
+        with self.lock:
+            return {"tokens": len(self.tokens), "hits": self.hits, "misses": self.misses}
+
+# Helper function to decode a bearer token, using the verified-token cache when configured
+def decode_token(token):
+    cache = current_app.config.get("TOKEN_CACHE")
+    claims = cache.get(token) if cache else None
+    if claims is None:
+        claims = jwt.decode(token, str(current_app.config["SECRET_KEY"]), algorithms=["HS256"])
+        if cache:
+            cache.put(token, claims)
+    # Callers get their own copy so they can't change the cached claims
+    return dict(claims)
+
+# ---------------- REQUEST AUTHENTICATION ----------------
+def authenticate_request():
+    """Decode the Authorization header once per request into g.claims / g.auth_error"""
+    g.claims = None
+    g.auth_error = None
+
+    token = request.headers.get("Authorization", None)
+    if not token:
+        g.auth_error = "Missing token"
+        return
+
+    try:
+        if token.startswith("Bearer "):
+            token = token[7:]
+        g.claims = decode_token(token)
+    except jwt.ExpiredSignatureError:
+        g.auth_error = "Token expired"
+    except jwt.InvalidTokenError:
+        g.auth_error = "Invalid token"
+
+# Helper function to verify JWT token
+def verify_token():
+    """(claims, None, None) for an authenticated request, else (None, error response, 401)"""
+    if "auth_error" not in g:
+        # The before_request hook didn't run (e.g. a bare app context); authenticate now
+        authenticate_request()
+    if g.auth_error:
+        return None, jsonify({"error": g.auth_error}), 401
+    return g.claims, None, None
+
+def auth_required(*roles):
+    """Reject the request with 401 unless it carries a valid token, and with 403 unless its role is in `roles`"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            decoded, error_response, status_code = verify_token()
+            if error_response:
+                return error_response, status_code
+            if roles and decoded.get("role") not in roles:
+                return jsonify({"error": "Insufficient permissions"}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ---------------- CALLER IDENTITY ----------------
+def resolve_identity(users_col):
+    """The caller's user (_id, email, name, role) from the token claims, reloaded only when they are stale"""
+    claims = g.claims
+    user_id = claims.get("uid")
+    if not user_id:
+        # Token issued before the uid/uver claims: look the caller up by email
+        return get_user_by_email(users_col, claims.get("email"))
+    
+    # The claims are only trusted while this process's directory knows the user at a version no
+    # newer than the token's. A miss (cold cache, another worker's user, an evicted or deleted
+    # user) or a newer version costs one indexed lookup, which also warms the directory.
+    directory = get_user_directory()
+    cached = directory.peek(user_id=user_id) if directory else None
+    if not cached or cached.get("version", 0) > claims.get("uver", 0):
+        return get_user_by_id(users_col, user_id)
+    
+    return {
+        "_id": ObjectId(user_id),
+        "email": claims.get("email"),
+        "name": claims.get("name"),
+        "role": claims.get("role"),
+        "version": claims.get("uver", 0)
+    }
+
+# ---------------- APP INTEGRATION ----------------
+def init_auth(app):
+    """Authenticate every request before it reaches a blueprint"""
+    app.config.setdefault("TOKEN_CACHE", TokenCache(app.config.get("TOKEN_CACHE_SIZE", 1024)))
+    app.before_request(authenticate_request)
@@ -0,0 +1,255 @@
+# change_feed.py
+from flask import current_app, has_app_context
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+import os
+import secrets
+import threading
+
+# Every write stamps when it happened and which process made it: the stamp is what the
+# polling fallback scans for, and the origin lets a process recognise its own writes.
+# updatedFrom is "<process id>.<write nonce>", so it changes on every write and always
+# shows up in a change stream's updatedFields (even for two writes from the same process).
+UPDATED_AT = "updatedAt"
+UPDATED_FROM = "updatedFrom"
+STAMP_FIELDS = (UPDATED_AT, UPDATED_FROM)
+
+# Projection that keeps the stamps out of API responses
+STAMP_PROJECTION = {UPDATED_AT: 0, UPDATED_FROM: 0}
+
+# Polled documents whose first stamp is this close to their ObjectId time were just inserted
+INSERT_WINDOW_SECONDS = 2
+
+# Fields never read into feed events (they would sit in every process's memory for nothing)
+FEED_EXCLUDED_FIELDS = ("password",)
+FEED_PROJECTION = {field: 0 for field in FEED_EXCLUDED_FIELDS}
+
+# Helper function to get the current time as pymongo reads dates back (naive UTC, whole
+# milliseconds), so stamps, the poll watermark and de-duplication all compare alike
+def utc_now():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+# Random id per worker process (keyed by pid so forked workers don't share their parent's)
+_origins = {}
+
+# Helper function to identify this worker process in write stamps
+def write_origin():
+    pid = os.getpid()
+    if pid not in _origins:
+        _origins[pid] = secrets.token_hex(6)
+    return _origins[pid]
+
+# Helper function to tell whether an updatedFrom stamp was written by this process
+def is_own_write(stamp):
+    return isinstance(stamp, str) and stamp.split(".", 1)[0] == write_origin()
+
+def touch(fields):
+    """Copy of a document or $set fields with the change-feed stamps added"""
+    return {**fields, UPDATED_AT: utc_now(), UPDATED_FROM: f"{write_origin()}.{secrets.token_hex(4)}"}
+
+def without_stamps(document):
+    """Copy of a document without the change-feed stamps, for responses and notifications"""
+    return {k: v for k, v in document.items() if k not in STAMP_FIELDS}
+
+def stamped_update(query, update_data):
+    """(filter, update) for an update_one; matches only when a field actually changes, so the
+    stamp doesn't turn a no-op into a modification"""
+    if not update_data:
+        return query, {"$set": update_data}
+    query = {**query, "$or": [{field: {"$ne": value}} for field, value in update_data.items()]}
+    return query, {"$set": touch(update_data)}
+
+# Deleted documents leave nothing to poll for, so delete routes also write a stamped
+# tombstone ({"collection", "documentId"}) that the polling fallback reads back as a delete.
+# The deletions collection has a TTL index; tombstones only need to outlive the poll lookback.
+def record_deletion(collection, document_id):
+    """Leave a tombstone for a document this process deleted (no-op without DELETIONS_COLLECTION)"""
+    deletions = current_app.config.get("DELETIONS_COLLECTION") if has_app_context() else None
+    if deletions is None:
+        return
+    try:
+        deletions.insert_one(touch({"collection": collection.name, "documentId": str(document_id)}))
+    except PyMongoError as e:
+        # The document is gone either way; other processes catch up when their caches expire
+        current_app.logger.error(f"Deletion tombstone error ({collection.name} {document_id}): {str(e)}")
+
+# ---------------- CHANGE FEED ----------------
+# Events published on the event bus, one topic per collection:
+#   {"collection", "op": insert|update|delete, "id", "document", "updates", "source", "echo"}
+# source is "change_stream" or "poll"; echo is True for writes made by this process,
+# which its routes have already published locally ("source": "local").
+
+class ChangeFeed:
+    """Publishes every write to the watched collections, from any process, on the event bus"""
+
+    def __init__(self, app, bus, collections, deletions=None, poll_interval=2, lookback=5, retry_delay=5):
+        self.app = app
+        self.bus = bus
+        self.collections = {collection.name: collection for collection in collections}
+        self.deletions = deletions              # tombstones from record_deletion, read when polling
+        self.poll_interval = poll_interval      # seconds between scans when change streams are unavailable
+        self.lookback = lookback                # rescan window for writes committed out of stamp order
+        self.retry_delay = retry_delay
+        self.resume_token = None
+        self.mode = None                        # "change_stream" or "poll" once running
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start the feed thread (once)"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    # Helper function for the feed thread: change streams when the server has them, else polling
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self._watch()
+            except OperationFailure as e:
+                if self.mode is None:
+                    # Standalone mongod: change streams need a replica set
+                    self._fall_back_to_polling(e)
+                    return
+                # e.g. the resume token fell off the oplog: start over from now
+                self.app.logger.error(f"Change stream error: {str(e)}")
+                self.resume_token = None
+            except PyMongoError as e:
+                self.app.logger.error(f"Change stream error: {str(e)}")
+                self.stopped.wait(self.retry_delay)
+            except Exception as e:
+                if self.mode is None:
+                    # A client without change stream support at all
+                    self._fall_back_to_polling(e)
+                    return
+                # A bad event is skipped (the resume token is already past it); the feed carries on
+                self.app.logger.exception(f"Change stream error: {str(e)}")
+                self.stopped.wait(self.retry_delay)
+
+    # Helper function to switch to polling for the rest of the process's life
+    def _fall_back_to_polling(self, error):
+        self.app.logger.info(f"Change streams unavailable, polling {UPDATED_AT} instead: {str(error)}")
+        self.mode = "poll"
+        self._poll()
+
+    # Helper function to follow the database change stream, resuming after the last event seen
+    def _watch(self):
+        database = next(iter(self.collections.values())).database
+        pipeline = [
+            {"$match": {
+                "ns.coll": {"$in": list(self.collections)},
+                "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+            }},
+            {"$project": {f"fullDocument.{field}": 0 for field in FEED_EXCLUDED_FIELDS}}
+        ]
+        with database.watch(pipeline, full_document="updateLookup", resume_after=self.resume_token, max_await_time_ms=1000) as stream:
+            self.mode = "change_stream"
+            while stream.alive and not self.stopped.is_set():
+                change = stream.try_next()
+                self.resume_token = stream.resume_token
+                if change is not None:
+                    self._publish(self._stream_event(change))
+
+    # Helper function to turn a change stream document into a bus event
+    def _stream_event(self, change):
+        op = change["operationType"]
+        document = change.get("fullDocument")
+        updates = {}
+        if op == "update":
+            updates = dict(change["updateDescription"]["updatedFields"])
+        elif document is not None:
+            updates = dict(document)
+        # The stamp of this write itself (not fullDocument's, which may be a later write's);
+        # a write without one (e.g. from the mongo shell) is never ours
+        if op == "update":
+            stamp = updates.get(UPDATED_FROM)
+        else:
+            stamp = (document or {}).get(UPDATED_FROM)
+        return {
+            "collection": change["ns"]["coll"],
+            "op": "update" if op == "replace" else op,
+            "id": str(change["documentKey"]["_id"]),
+            "document": document,
+            "updates": {k: v for k, v in updates.items() if k not in STAMP_FIELDS and k != "_id"},
+            "source": "change_stream",
+            "echo": is_own_write(stamp)
+        }
+
+    # Helper function to scan each collection (and the deletion tombstones) for recently stamped documents
+    def _poll(self):
+        # Start a lookback early: a write stamped just before the feed started may commit after it
+        since = utc_now() - timedelta(seconds=self.lookback)
+        seen = {}       # (collection, id) -> stamp already published
+        sources = list(self.collections.items())
+        if self.deletions is not None:
+            sources.append((self.deletions.name, self.deletions))
+        while not self.stopped.is_set():
+            scan_started = utc_now()
+            for name, collection in sources:
+                try:
+                    documents = list(collection.find({UPDATED_AT: {"$gte": since}}, FEED_PROJECTION).sort(UPDATED_AT, ASCENDING))
+                except PyMongoError as e:
+                    self.app.logger.error(f"Change poll error ({name}): {str(e)}")
+                    continue
+                for document in documents:
+                    key = (name, str(document["_id"]))
+                    if seen.get(key) == document[UPDATED_AT]:
+                        continue
+                    seen[key] = document[UPDATED_AT]
+                    try:
+                        if collection is self.deletions:
+                            event = self._deletion_event(document)
+                        else:
+                            event = self._poll_event(name, document)
+                        if event:
+                            self._publish(event)
+                    except Exception as e:
+                        self.app.logger.exception(f"Change poll error ({name} {key[1]}): {str(e)}")
+
+            # Rescan the last `lookback` seconds: a write stamped just before this scan may commit after it
+            since = max(since, scan_started - timedelta(seconds=self.lookback))
+            seen = {key: stamp for key, stamp in seen.items() if stamp >= since}
+            self.stopped.wait(self.poll_interval)
+
+    # Helper function to turn a polled document into a bus event
+    def _poll_event(self, name, document):
+        stamp = document[UPDATED_AT]
+        created = document["_id"].generation_time.replace(tzinfo=None) if isinstance(document["_id"], ObjectId) else None
+        is_insert = created is not None and (stamp - created).total_seconds() < INSERT_WINDOW_SECONDS
+        return {
+            "collection": name,
+            "op": "insert" if is_insert else "update",
+            "id": str(document["_id"]),
+            "document": document,
+            # Polling can't tell which fields changed: updates carry the whole stored document
+            "updates": {k: v for k, v in document.items() if k not in STAMP_FIELDS and k != "_id"},
+            # Polling sees the latest write only: echo when that one was ours
+            "source": "poll",
+            "echo": is_own_write(document.get(UPDATED_FROM))
+        }
+
+    # Helper function to turn a polled tombstone into a bus event (None for an unwatched collection)
+    def _deletion_event(self, tombstone):
+        if tombstone.get("collection") not in self.collections:
+            return None
+        return {
+            "collection": tombstone["collection"],
+            "op": "delete",
+            "id": tombstone["documentId"],
+            "document": None,
+            "updates": {},
+            "source": "poll",
+            "echo": is_own_write(tombstone.get(UPDATED_FROM))
+        }
+
+    # Helper function to publish a feed event inside an app context (subscribers use current_app)
+    def _publish(self, event):
+        with self.app.app_context():
+            self.bus.publish(event["collection"], event)
+
@@ -0,0 +1,70 @@
+# chat_history.py
+import math
+
+# llama3 averages roughly four characters per token on English text; each
+# message also pays for its "role: " prefix and newline.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Longest summary the model is asked to write
+SUMMARY_MAX_TOKENS = 256
+# Generation-scheduler queue the background summaries share
+SUMMARY_QUEUE_USER = "chat-summary"
+
+# ---------------- TOKEN ESTIMATES ----------------
+def estimate_tokens(text):
+    """Approximate llama3 token count for a piece of text"""
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+def message_tokens(messages):
+    """Approximate token count of a list of chat messages"""
+    return sum(estimate_tokens(msg.get("content")) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+def split_to_budget(messages, budget):
+    """(older, recent): the newest messages that fit in `budget` tokens, and everything before them"""
+    used = 0
+    start = len(messages)
+    while start > 0:
+        cost = estimate_tokens(messages[start - 1].get("content")) + MESSAGE_OVERHEAD_TOKENS
+        # The latest message is always kept, even when it alone is over budget
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start -= 1
+    return messages[:start], messages[start:]
+
+# ---------------- ROLLING SUMMARY ----------------
+def summary_message(summary):
+    """Message that carries the summary of the turns folded out of the window"""
+    return {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+
+# Helper function to build the prompt asking the model to fold turns into the summary
+def build_summary_prompt(previous_summary, messages):
+    prompt_text = (
+        "Update the summary of a construction-site safety assistant conversation. "
+        "Keep names, sites, hazards, decisions and open questions; drop small talk. "
+        "Answer with the summary only, in under 150 words.\n\n"
+    )
+    if previous_summary:
+        prompt_text += f"Current summary: {previous_summary}\n\n"
+    prompt_text += "New messages:\n"
+    for msg in messages:
+        prompt_text += f"{msg['role']}: {msg['content']}\n"
+    prompt_text += "\nUpdated summary:"
+    return prompt_text
+
+def make_summarizer(ollama_client, scheduler=None, max_tokens=SUMMARY_MAX_TOKENS):
+    """summarize(previous_summary, messages) -> new summary text, generated by `ollama_client`"""
+    def generate(prompt_text):
+        return ollama_client.generate(prompt_text, options={"num_predict": max_tokens})
+
+    def summarize(previous_summary, messages):
+        prompt_text = build_summary_prompt(previous_summary, messages)
+        if scheduler is None:
+            response_data = generate(prompt_text)
+        else:
+            # Summaries queue like one more user, so they never crowd out live chats
+            with scheduler.slot(SUMMARY_QUEUE_USER):
+                response_data = generate(prompt_text)
+        return response_data.get("response", "").strip()
+    return summarize
@@ -0,0 +1,150 @@
+# conversation_store.py
+from flask import current_app
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import secrets
+import threading
+import time
+from utils.chat_history import message_tokens, split_to_budget
+
+# When the window overflows it is cut back to this share of the budget, so the
+# summary is refreshed once every few turns rather than on every turn.
+FOLD_RATIO = 0.75
+
+# ---------------- CONVERSATION STORE ----------------
+class ConversationStore:
+    """Process-wide LRU/TTL store of chat sessions keyed by session id"""
+
+    def __init__(self, ttl=1800, max_sessions=1000, token_budget=3000, summarize=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # Prompt tokens allowed for the message window, and the longest Ollama context kept
+        self.token_budget = token_budget
+        # summarize(previous_summary, messages) -> summary; runs off the request thread
+        self.summarize = summarize
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary") if summarize else None
+        self.lock = threading.Lock()
+        # session id -> {"expires_at", "context", "unseen", "messages", "summary", "pending", "summarizing"}
+        self.sessions = OrderedDict()
+
+    # Helper function to fetch a live session while holding the lock
+    def _live(self, session_id):
+        session = self.sessions.get(session_id)
+        if not session:
+            return None
+        if session["expires_at"] < time.monotonic():
+            self.sessions.pop(session_id, None)
+            return None
+        session["expires_at"] = time.monotonic() + self.ttl
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def create(self):
+        """Start an empty session and return its id"""
+        session_id = secrets.token_urlsafe(16)
+        with self.lock:
+            self.sessions[session_id] = {
+                "expires_at": time.monotonic() + self.ttl,
+                "context": None,
+                "unseen": [],           # turns answered from the reply cache, not in the context
+                "messages": [],
+                "summary": None,
+                "pending": [],          # folded out of the window, not yet in the summary
+                "summarizing": False
+            }
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id):
+        """Copy of a session's Ollama context (and the turns it hasn't seen), summary and message window,
+        or None when unknown/expired"""
+        with self.lock:
+            session = self._live(session_id) if session_id else None
+            if not session:
+                return None
+            return {
+                "context": list(session["context"]) if session["context"] else None,
+                "unseen": list(session["unseen"]),
+                "summary": session["summary"],
+                "messages": list(session["messages"])
+            }
+
+    def append_turn(self, session_id, user_message, reply, context=None, keep_context=False):
+        """Record one user/assistant exchange and the context Ollama returned for it
+        (keep_context: the reply came from the cache, so the session's context stays as it was)"""
+        with self.lock:
+            session = self._live(session_id)
+            if not session:
+                return False
+            turn = [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": reply}
+            ]
+            session["messages"].extend(turn)
+
+            # Fold the oldest turns out of the window and into the rolling summary
+            if message_tokens(session["messages"]) > self.token_budget:
+                older, session["messages"] = split_to_budget(session["messages"], self.token_budget * FOLD_RATIO)
+                session["pending"].extend(older)
+                if not session["summarizing"]:
+                    # Never let turns pile up without bound if the summarizer keeps failing
+                    _, session["pending"] = split_to_budget(session["pending"], self.token_budget)
+                self._schedule_summary(session_id, session)
+
+            if keep_context and session["context"] and message_tokens(session["unseen"] + turn) <= self.token_budget:
+                # The next prompt replays this turn as text on top of the unchanged context
+                session["unseen"].extend(turn)
+            elif context and len(context) <= self.token_budget:
+                session["context"] = context
+                session["unseen"] = []
+            else:
+                # Past the budget the context is dropped; the next turn restarts from summary + window
+                session["context"] = None
+                session["unseen"] = []
+            return True
+
+    # Helper function to start a background summary of the pending turns while holding the lock
+    def _schedule_summary(self, session_id, session):
+        if not self.executor or session["summarizing"] or not session["pending"]:
+            return
+        session["summarizing"] = True
+        self.executor.submit(self._summarize, session_id, session["summary"], list(session["pending"]))
+
+    # Helper function run on the summary thread
+    def _summarize(self, session_id, previous_summary, messages):
+        try:
+            summary = self.summarize(previous_summary, messages)
+        except Exception:
+            # The turns stay pending and are retried with the next fold
+            summary = None
+
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return
+            session["summarizing"] = False
+            if not summary:
+                return
+            session["summary"] = summary
+            summarized = {id(msg) for msg in messages}
+            session["pending"] = [msg for msg in session["pending"] if id(msg) not in summarized]
+            # Turns folded while this summary was being written
+            self._schedule_summary(session_id, session)
+
+    def delete(self, session_id):
+        """End a session; True when it existed"""
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        """Number of sessions held and how many are being summarized"""
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "summarizing": sum(1 for session in self.sessions.values() if session["summarizing"])
+            }
+
+# Helper function to get the app's conversation store
+def get_conversation_store():
+    return current_app.config["CONVERSATION_STORE"]
@@ -0,0 +1,44 @@
+# events.py
+from flask import current_app, has_app_context
+import threading
+
+# Topics are collection names ("tasks", "attendance", "safety", "emergencies", "users");
+# an event is a dict describing the change, e.g. {"collection": "tasks", "op": "update"}.
+
+# ---------------- EVENT BUS ----------------
+class EventBus:
+    """In-process publish/subscribe for data-change events"""
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.subscribers = {}       # topic -> list of callbacks
+
+    def subscribe(self, topic, callback):
+        """Call callback(topic, event) for every event published on `topic`; returns an unsubscribe function"""
+        with self.lock:
+            self.subscribers.setdefault(topic, []).append(callback)
+
+        def unsubscribe():
+            with self.lock:
+                callbacks = self.subscribers.get(topic, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+        return unsubscribe
+
+    def publish(self, topic, event=None):
+        """Deliver an event to the topic's subscribers; a failing subscriber doesn't stop the others"""
+        with self.lock:
+            callbacks = list(self.subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(topic, event or {})
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Event subscriber error ({topic}): {str(e)}")
+
+# Helper function to publish a change made by this process (no-op without a configured bus)
+def publish_change(collection, op, **details):
+    bus = current_app.config.get("EVENT_BUS") if has_app_context() else None
+    if bus:
+        bus.publish(collection, {"collection": collection, "op": op, "source": "local", **details})
@@ -0,0 +1,72 @@
+# fanout.py
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import pymongo
+from pymongo.errors import PyMongoError
+import time
+
+DEFAULT_QUERY_TIMEOUT = 5  # seconds
+
+class FanoutTimeout(TimeoutError):
+    """Raised when a fanned-out query doesn't finish within its timeout"""
+
+    def __init__(self, name):
+        super().__init__(f"Query '{name}' timed out")
+        self.name = name
+
+# Helper function to run one query inside the app context with a driver-side timeout
+def _run(app, fn, timeout):
+    with app.app_context():
+        # Lets the driver abandon the operation too, so a slow query doesn't hold a pool thread
+        with pymongo.timeout(timeout):
+            return fn()
+
+# ---------------- QUERY FAN-OUT ----------------
+def fan_out(queries, timeout=DEFAULT_QUERY_TIMEOUT, timeouts=None):
+    """Run independent reads ({name: callable}) at the same time and return {name: result}"""
+    timeouts = timeouts or {}
+    app = current_app._get_current_object()
+    executor = app.config.get("FANOUT_EXECUTOR")
+
+    results = {}
+
+    # No pool configured: run the queries one after another
+    if executor is None:
+        for name, fn in queries.items():
+            try:
+                results[name] = _run(app, fn, timeouts.get(name, timeout))
+            except PyMongoError as e:
+                if e.timeout:
+                    raise FanoutTimeout(name)
+                raise
+        return results
+
+    started = time.monotonic()
+    futures = {
+        name: executor.submit(_run, app, fn, timeouts.get(name, timeout))
+        for name, fn in queries.items()
+    }
+
+    try:
+        for name, future in futures.items():
+            # Each query's timeout counts from submission, so waiting on one doesn't extend another
+            remaining = max(0, timeouts.get(name, timeout) - (time.monotonic() - started))
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeout:
+                raise FanoutTimeout(name)
+            except PyMongoError as e:
+                if e.timeout:
+                    raise FanoutTimeout(name)
+                raise
+    finally:
+        for future in futures.values():
+            future.cancel()
+    return results
+
+# ---------------- APP INTEGRATION ----------------
+def init_fanout(app):
+    """Create the bounded thread pool fan_out() submits to"""
+    max_workers = app.config.get("FANOUT_MAX_WORKERS", 8)
+    if max_workers:
+        app.config["FANOUT_EXECUTOR"] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
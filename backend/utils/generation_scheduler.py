@@ -0,0 +1,152 @@
+# generation_scheduler.py
+from flask import current_app
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import threading
+import time
+
+class SchedulerRejected(Exception):
+    """Raised when a generation can't be admitted (status is 429 or 503)"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+class Ticket:
+    """One generation waiting for, or holding, a model slot"""
+
+    def __init__(self, user):
+        self.user = user
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.state = "queued"           # queued -> running -> done
+
+# ---------------- GENERATION SCHEDULER ----------------
+class GenerationScheduler:
+    """Concurrency limit for Ollama generations, with a round-robin queue per user"""
+
+    def __init__(self, max_concurrent=2, max_queue=20, max_per_user=2, max_wait=30):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue          # waiting generations across all users
+        self.max_per_user = max_per_user    # waiting + running generations per user
+        self.max_wait = max_wait            # seconds a generation may wait for a slot
+        self.lock = threading.Lock()
+        self.queues = OrderedDict()         # user -> deque of waiting tickets, in round-robin order
+        self.per_user = {}                  # user -> waiting + running count
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    # Helper function to hand free slots to the next users in rotation while holding the lock
+    def _dispatch(self):
+        while self.running < self.max_concurrent and self.queues:
+            user, queue = next(iter(self.queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self.queues.move_to_end(user)
+            else:
+                del self.queues[user]
+            self.queued -= 1
+            self.running += 1
+            ticket.state = "running"
+            ticket.event.set()
+
+    def enqueue(self, user):
+        """Queue a generation for `user`; raises SchedulerRejected (429/503) instead of queueing too much"""
+        with self.lock:
+            if self.per_user.get(user, 0) >= self.max_per_user:
+                self.rejected += 1
+                raise SchedulerRejected(429, "Too many chat requests in progress, wait for the current answer", 5)
+            if self.running >= self.max_concurrent and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerRejected(503, "The assistant is busy, try again shortly", 10)
+
+            ticket = Ticket(user)
+            self.per_user[user] = self.per_user.get(user, 0) + 1
+            self.queues.setdefault(user, deque()).append(ticket)
+            self.queued += 1
+            self.admitted += 1
+            self._dispatch()
+            return ticket
+
+    def wait(self, ticket, timeout=None):
+        """True once the ticket holds a slot, False if `timeout` passes first"""
+        return ticket.event.wait(timeout)
+
+    def position(self, ticket):
+        """1-based place of a waiting ticket in the round-robin order (0 once it's running)"""
+        with self.lock:
+            if ticket.state != "queued":
+                return 0
+            queue = self.queues.get(ticket.user, ())
+            try:
+                round_index = list(queue).index(ticket)
+            except ValueError:
+                return 0
+            # Every user is served once per round: count the rounds before this ticket's,
+            # then the users ahead of this one in the current rotation
+            ahead = sum(min(len(other), round_index) for other in self.queues.values())
+            for user, other in self.queues.items():
+                if user == ticket.user:
+                    break
+                if len(other) > round_index:
+                    ahead += 1
+            return ahead + 1
+
+    def release(self, ticket):
+        """Give back a ticket's slot, or drop it from the queue if it never got one; safe to repeat"""
+        with self.lock:
+            if ticket.state == "done":
+                return
+            if ticket.state == "running":
+                self.running -= 1
+            else:
+                queue = self.queues.get(ticket.user)
+                if queue and ticket in queue:
+                    queue.remove(ticket)
+                    self.queued -= 1
+                    if not queue:
+                        del self.queues[ticket.user]
+            ticket.state = "done"
+            self.per_user[ticket.user] -= 1
+            if not self.per_user[ticket.user]:
+                del self.per_user[ticket.user]
+            self._dispatch()
+
+    def expire(self, ticket):
+        """Drop a ticket that waited longer than max_wait"""
+        with self.lock:
+            self.timed_out += 1
+        self.release(ticket)
+
+    @contextmanager
+    def slot(self, user):
+        """Hold a model slot for the body of the with-block, waiting up to max_wait for one"""
+        ticket = self.enqueue(user)
+        try:
+            if not self.wait(ticket, self.max_wait):
+                self.expire(ticket)
+                raise SchedulerRejected(503, "Timed out waiting for the assistant, try again shortly", 10)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        """Slots in use, queue depth and admission counters"""
+        with self.lock:
+            return {
+                "running": self.running,
+                "queued": self.queued,
+                "users": len(self.per_user),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timedOut": self.timed_out
+            }
+
+# Helper function to get the app's generation scheduler
+def get_generation_scheduler():
+    return current_app.config["GENERATION_SCHEDULER"]
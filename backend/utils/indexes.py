@@ -0,0 +1,158 @@
+# indexes.py
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+import pymongo
+import click
+
+# Seconds a startup bootstrap waits for Mongo before skipping (the driver default is 30)
+STARTUP_PING_TIMEOUT = 3
+
+# ---------------- INDEX SPECS ----------------
+# Indexes the route handlers rely on, keyed by the app.config collection name.
+# Each entry is (index name, key list, extra create_index options).
+INDEX_SPECS = {
+    "USERS_COLLECTION": [
+        # login, register, task/attendance assignee lookups by email
+        ("email_1", [("email", ASCENDING)], {"unique": True}),
+        # /users/role/<role>, /safety/workers, /new-workers (role + keyset on created_at, _id)
+        ("role_1_created_at_-1__id_-1", [("role", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+        # change-feed polling fallback (documents stamped since the last scan)
+        ("updatedAt_1", [("updatedAt", ASCENDING)], {}),
+    ],
+    "ATTENDANCE_COLLECTION": [
+        # one record per worker per day; also serves workerId + date range queries
+        ("workerId_1_date_1", [("workerId", ASCENDING), ("date", ASCENDING)], {"unique": True}),
+        # /attendance/today, /attendance/stats, /team/attendance, /team/stats
+        ("date_1_status_1", [("date", ASCENDING), ("status", ASCENDING)], {}),
+        # keyset pagination of /attendance
+        ("timestamp_-1__id_-1", [("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+        # change-feed polling fallback (documents stamped since the last scan)
+        ("updatedAt_1", [("updatedAt", ASCENDING)], {}),
+    ],
+    "TASKS_COLLECTION": [
+        # /team/members counts, /tasks/user/<id>, progress report grouping
+        ("assignedTo_1_status_1", [("assignedTo", ASCENDING), ("status", ASCENDING)], {}),
+        # overdue counts in /tasks/stats and /progress/summary
+        ("status_1_deadline_1", [("status", ASCENDING), ("deadline", ASCENDING)], {}),
+        # completed-in-range lookups in /progress/summary
+        ("status_1_completedAt_1", [("status", ASCENDING), ("completedAt", ASCENDING)], {}),
+        # keyset pagination of /tasks
+        ("createdAt_-1__id_-1", [("createdAt", DESCENDING), ("_id", DESCENDING)], {}),
+        # change-feed polling fallback (documents stamped since the last scan)
+        ("updatedAt_1", [("updatedAt", ASCENDING)], {}),
+    ],
+    "SAFETY_COLLECTION": [
+        # /alerts keyset pages and unresolved counts, newest first
+        ("resolved_1_timestamp_-1__id_-1", [("resolved", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+        # /safety-reports date filter and keyset pages, /safety/stats today counts
+        ("timestamp_-1__id_-1", [("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+        # worker safety history and /team/members unresolved counts
+        ("workerId_1_timestamp_-1", [("workerId", ASCENDING), ("timestamp", DESCENDING)], {}),
+        ("workerId_1_resolved_1", [("workerId", ASCENDING), ("resolved", ASCENDING)], {}),
+        # /supervisor/alerts/assigned
+        ("assignedTo_1_resolved_1", [("assignedTo", ASCENDING), ("resolved", ASCENDING)], {}),
+        # change-feed polling fallback (documents stamped since the last scan)
+        ("updatedAt_1", [("updatedAt", ASCENDING)], {}),
+    ],
+    "EMERGENCY_COLLECTION": [
+        # /alerts keyset pages and unresolved counts, newest first
+        ("resolved_1_timestamp_-1__id_-1", [("resolved", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+        # /emergencies keyset pages and today counts
+        ("timestamp_-1__id_-1", [("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+        # /supervisor/alerts/assigned
+        ("assignedTo_1_resolved_1", [("assignedTo", ASCENDING), ("resolved", ASCENDING)], {}),
+        # change-feed polling fallback (documents stamped since the last scan)
+        ("updatedAt_1", [("updatedAt", ASCENDING)], {}),
+    ],
+    "DELETIONS_COLLECTION": [
+        # change-feed polling fallback; tombstones expire an hour after the delete
+        ("updatedAt_1", [("updatedAt", ASCENDING)], {"expireAfterSeconds": 3600}),
+    ],
+}
+
+# Options that have to match for an existing index to count as the expected one
+COMPARED_OPTIONS = ["unique", "sparse", "expireAfterSeconds", "partialFilterExpression"]
+
+# Helper function to create every declared index
+def ensure_indexes(config, logger=None):
+    """Create the declared indexes and return the names that failed"""
+    failed = []
+    for config_key, specs in INDEX_SPECS.items():
+        collection = config[config_key]
+        for name, keys, options in specs:
+            try:
+                collection.create_index(keys, name=name, **options)
+            except OperationFailure as e:
+                # e.g. duplicate (workerId, date) rows or a conflicting index of the same name
+                failed.append(f"{collection.name}.{name}")
+                if logger:
+                    logger.error(f"Index creation failed for {collection.name}.{name}: {str(e)}")
+    return failed
+
+# Helper function to compare live indexes with INDEX_SPECS
+def check_index_drift(config):
+    """Return missing, mismatched and unexpected indexes per collection"""
+    drift = {}
+    for config_key, specs in INDEX_SPECS.items():
+        collection = config[config_key]
+        existing = collection.index_information()
+        report = {"missing": [], "mismatched": [], "unexpected": []}
+
+        for name, keys, options in specs:
+            info = existing.get(name)
+            if not info:
+                report["missing"].append(name)
+                continue
+            live_keys = [(field, int(direction)) for field, direction in info["key"]]
+            same_options = all(info.get(opt) == options.get(opt) for opt in COMPARED_OPTIONS)
+            if live_keys != [(field, direction) for field, direction in keys] or not same_options:
+                report["mismatched"].append(name)
+
+        declared = {name for name, _, _ in specs}
+        report["unexpected"] = [name for name in existing if name != "_id_" and name not in declared]
+
+        if report["missing"] or report["mismatched"] or report["unexpected"]:
+            drift[collection.name] = report
+    return drift
+
+# ---------------- APP INTEGRATION ----------------
+def mongo_reachable(app):
+    """Quick ping so startup work is skipped, rather than stalled, while Mongo is down"""
+    try:
+        with pymongo.timeout(app.config.get("STARTUP_PING_TIMEOUT", STARTUP_PING_TIMEOUT)):
+            app.config["USERS_COLLECTION"].database.command("ping")
+        return True
+    except PyMongoError as e:
+        app.logger.error(f"MongoDB unreachable at startup: {str(e)}")
+        return False
+
+def init_indexes(app):
+    """Ensure indexes at startup and register the `flask ensure-indexes` command"""
+    if app.config.get("ENSURE_INDEXES_ON_STARTUP", True) and mongo_reachable(app):
+        try:
+            ensure_indexes(app.config, app.logger)
+            drift = check_index_drift(app.config)
+            if drift:
+                app.logger.warning(f"Index drift detected: {drift}")
+        except PyMongoError as e:
+            # Don't block startup when Mongo is unreachable; the CLI can be re-run later
+            app.logger.error(f"Index bootstrap skipped: {str(e)}")
+
+    @app.cli.command("ensure-indexes")
+    @click.option("--check", is_flag=True, help="Only report drift, don't create anything.")
+    def ensure_indexes_command(check):
+        """Create the indexes the routes expect and report drift"""
+        if not check:
+            failed = ensure_indexes(app.config, app.logger)
+            for name in failed:
+                click.echo(f"FAILED  {name}")
+
+        drift = check_index_drift(app.config)
+        if not drift:
+            click.echo("Indexes match the expected specs.")
+            return
+        for collection_name, report in drift.items():
+            for kind in ["missing", "mismatched", "unexpected"]:
+                for name in report[kind]:
+                    click.echo(f"{kind.upper():<11} {collection_name}.{name}")
+        raise SystemExit(1)
@@ -0,0 +1,144 @@
+# live_counters.py
+from datetime import date
+import threading
+import time
+from utils.fanout import fan_out
+
+# Dashboard counter -> (collection topic, config key, filter for a given day)
+DASHBOARD_COUNTERS = {
+    "pendingTasks": ("tasks", "TASKS_COLLECTION", lambda today: {"status": {"$in": ["pending", "in-progress"]}}),
+    "todayAttendance": ("attendance", "ATTENDANCE_COLLECTION", lambda today: {"date": today}),
+    "safetyIssues": ("safety", "SAFETY_COLLECTION", lambda today: {"resolved": False}),
+    "activeEmergencies": ("emergencies", "EMERGENCY_COLLECTION", lambda today: {"resolved": False})
+}
+
+def dashboard_queries(config, names, today):
+    """{counter: count callable} for fan_out(), limited to `names`"""
+    queries = {}
+    for name in names:
+        _, config_key, query = DASHBOARD_COUNTERS[name]
+        collection = config[config_key]
+        queries[name] = lambda collection=collection, query=query(today): collection.count_documents(query)
+    return queries
+
+# ---------------- LIVE COUNTERS ----------------
+class LiveCounters:
+    """Dashboard counters recomputed once per change and shared by every subscriber"""
+
+    def __init__(self, app, debounce=0.5, refresh_interval=60, max_age=60):
+        self.app = app
+        self.debounce = debounce                    # lets a burst of writes land before counting
+        self.refresh_interval = refresh_interval    # full recount while anyone is subscribed
+        self.max_age = max_age                      # oldest snapshot /dashboard/stats may serve
+        self.cond = threading.Condition()
+        self.values = {}                # counter -> count
+        self.computed_at = {}           # counter -> time.monotonic() of its last count
+        self.days = {}                  # counter -> the day it was counted on (todayAttendance depends on it)
+        self.dirty = set(DASHBOARD_COUNTERS)
+        self.marks = dict.fromkeys(DASHBOARD_COUNTERS, 0)   # changes seen per counter
+        self.version = 0
+        self.subscribers = 0
+        self.next_full_recount = time.monotonic() + refresh_interval
+        self.thread = None
+
+    def mark_dirty(self, topic, event=None):
+        """Event-bus callback: the counters over `topic` need recounting"""
+        if event and event.get("echo"):
+            # This process's own write, already marked when its route published it
+            return
+        with self.cond:
+            for name, (counter_topic, _, _) in DASHBOARD_COUNTERS.items():
+                if counter_topic == topic:
+                    self.dirty.add(name)
+                    self.marks[name] += 1
+            self.cond.notify_all()
+
+    def snapshot_marks(self):
+        """Change marks to pass back to offer() with counts taken after this call"""
+        with self.cond:
+            return dict(self.marks)
+
+    def offer(self, counts, marks, today):
+        """Store fresh counts; a counter stays dirty if it changed again while it was being counted"""
+        with self.cond:
+            now = time.monotonic()
+            changed = False
+            for name, count in counts.items():
+                if self.values.get(name) != count:
+                    self.values[name] = count
+                    changed = True
+                self.computed_at[name] = now
+                self.days[name] = today
+                if self.marks[name] == marks[name]:
+                    self.dirty.discard(name)
+            if changed:
+                self.version += 1
+            self.cond.notify_all()
+
+    def fresh_values(self):
+        """All counters if none is dirty, stale or from another day, else None"""
+        today = date.today().isoformat()
+        with self.cond:
+            if self.dirty or len(self.values) < len(DASHBOARD_COUNTERS):
+                return None
+            if any(self.days.get(name) != today for name in DASHBOARD_COUNTERS):
+                return None
+            if time.monotonic() - min(self.computed_at.values()) > self.max_age:
+                return None
+            return dict(self.values)
+
+    def subscribe(self):
+        """Register a subscriber (starting the counting thread on first use)"""
+        with self.cond:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="live-counters", daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+
+    def wait(self, version, timeout):
+        """(version, counters) once the counters are newer than `version`, or the current ones after `timeout`"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version > version, timeout)
+            return self.version, dict(self.values)
+
+    # Helper function to mark counters due a recount by the clock while holding the lock:
+    # all of them every refresh_interval, and any counted on an earlier day
+    def _mark_due(self, today):
+        now = time.monotonic()
+        if now >= self.next_full_recount:
+            # On a fixed schedule, so a steady stream of other changes can't postpone it
+            self.next_full_recount = now + self.refresh_interval
+            if self.subscribers:
+                self.dirty.update(DASHBOARD_COUNTERS)
+        for name, day in self.days.items():
+            if day != today:
+                self.dirty.add(name)
+
+    # Helper function for the counting thread: one shared recount per burst of changes
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.dirty and self.subscribers,
+                                   max(0, self.next_full_recount - time.monotonic()))
+                self._mark_due(date.today().isoformat())
+                if not (self.dirty and self.subscribers):
+                    continue
+            time.sleep(self.debounce)
+
+            with self.cond:
+                names = set(self.dirty)
+                marks = dict(self.marks)
+            today = date.today().isoformat()
+            try:
+                with self.app.app_context():
+                    counts = fan_out(dashboard_queries(self.app.config, names, today))
+            except Exception as e:
+                self.app.logger.error(f"Live counters error: {str(e)}")
+                time.sleep(self.refresh_interval / 4)
+                continue
+            self.offer(counts, marks, today)
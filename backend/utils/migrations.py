@@ -0,0 +1,88 @@
+# migrations.py
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import click
+from utils.change_feed import touch
+from utils.indexes import mongo_reachable
+from utils.work_hours import MINUTE_FIELDS, with_minutes
+
+# ---------------- DATA MIGRATIONS ----------------
+# Idempotent fixes for documents written by older versions of the routes.
+# Each entry is (name, function(config) -> number of documents changed).
+# Updates carry the change-feed stamps like any route write, so other processes see them.
+
+# Helper function to send UpdateOne operations in unordered batches and count the changes
+def _bulk_update(collection, operations, batch_size):
+    changed = 0
+    batch = []
+    for operation in operations:
+        batch.append(operation)
+        if len(batch) >= batch_size:
+            changed += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        changed += collection.bulk_write(batch, ordered=False).modified_count
+    return changed
+
+# Helper function to move tasks from the manager route's old `created_at` to the `createdAt`
+# every task list sorts and paginates on
+def backfill_task_created_at(config, batch_size=500):
+    tasks_col = config["TASKS_COLLECTION"]
+    query = {"createdAt": {"$exists": False}, "created_at": {"$exists": True}}
+    operations = (
+        UpdateOne(
+            {"_id": task["_id"], "createdAt": {"$exists": False}},
+            {"$set": touch({"createdAt": task["created_at"]}), "$unset": {"created_at": ""}}
+        )
+        for task in tasks_col.find(query, {"created_at": 1})
+    )
+    return _bulk_update(tasks_col, operations, batch_size)
+
+# Helper function to add checkInMinutes/checkOutMinutes to attendance written before them,
+# so /attendance/stats doesn't parse the strings of every old record on every call
+def backfill_attendance_minutes(config, batch_size=500):
+    attendance_col = config["ATTENDANCE_COLLECTION"]
+    query = {"$or": [
+        {field: {"$exists": True}, minutes_field: {"$exists": False}}
+        for field, minutes_field in MINUTE_FIELDS.items()
+    ]}
+    projection = {field: 1 for field in MINUTE_FIELDS}
+
+    def operations():
+        for record in attendance_col.find(query, projection):
+            times = {field: record[field] for field in MINUTE_FIELDS if field in record}
+            # Matches only while the times are unchanged, so a concurrent edit isn't overwritten
+            minutes = {k: v for k, v in with_minutes(times).items() if k not in MINUTE_FIELDS}
+            yield UpdateOne({"_id": record["_id"], **times}, {"$set": touch(minutes)})
+
+    return _bulk_update(attendance_col, operations(), batch_size)
+
+MIGRATIONS = [
+    ("tasks.createdAt", backfill_task_created_at),
+    ("attendance.minutes", backfill_attendance_minutes),
+]
+
+def run_migrations(config, logger=None):
+    """Run every migration and return {name: documents changed}"""
+    results = {}
+    for name, migration in MIGRATIONS:
+        results[name] = migration(config)
+        if logger and results[name]:
+            logger.info(f"Migration {name}: {results[name]} documents updated")
+    return results
+
+# ---------------- APP INTEGRATION ----------------
+def init_migrations(app):
+    """Run migrations at startup and register the `flask migrate` command"""
+    if app.config.get("RUN_MIGRATIONS_ON_STARTUP", True) and mongo_reachable(app):
+        try:
+            run_migrations(app.config, app.logger)
+        except PyMongoError as e:
+            # Don't block startup when Mongo is unreachable; the CLI can be re-run later
+            app.logger.error(f"Migrations skipped: {str(e)}")
+
+    @app.cli.command("migrate")
+    def migrate_command():
+        """Backfill documents written by older versions of the routes"""
+        for name, changed in run_migrations(app.config, app.logger).items():
+            click.echo(f"{name:<20} {changed} updated")
@@ -0,0 +1,84 @@
+# ollama_client.py
+from flask import current_app
+from requests.adapters import HTTPAdapter
+import requests
+import json
+import time
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_MODEL = "llama3"
+RETRY_BACKOFF = 0.2  # seconds, multiplied by the attempt number
+
+# ---------------- OLLAMA CLIENT ----------------
+class OllamaClient:
+    """Keep-alive HTTP client for the Ollama generate API"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, model=DEFAULT_MODEL, connect_timeout=3.05,
+                 read_timeout=120, retries=2, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        # read_timeout bounds the gap between bytes, so a long stream is fine but a stalled model isn't
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+
+        self.session = requests.Session()
+        # Retries are handled in _post so that read timeouts are never retried
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # Helper function to POST to Ollama, retrying refused or reset connections
+    def _post(self, path, payload, stream=False):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(f"{self.base_url}{path}", json=payload,
+                                             stream=stream, timeout=self.timeout)
+                break
+            except requests.exceptions.ConnectionError as e:
+                # A timeout means the model is slow, not that the connection went stale
+                if isinstance(e, requests.exceptions.Timeout) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                time.sleep(RETRY_BACKOFF * attempt)
+
+        if not response.ok:
+            response.close()
+        response.raise_for_status()
+        return response
+
+    def generate(self, prompt, **options):
+        """Full (non-streamed) generate response as a dict"""
+        payload = {"model": self.model, "prompt": prompt, "stream": False, **options}
+        return self._post("/api/generate", payload).json()
+
+    def stream_generate(self, prompt, **options):
+        """Yield each JSON chunk of a streamed generate response; the connection returns to the pool when done"""
+        payload = {"model": self.model, "prompt": prompt, "stream": True, **options}
+        response = self._post("/api/generate", payload, stream=True)
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+    def close(self):
+        """Close every pooled connection"""
+        self.session.close()
+
+# Helper function to get the app's Ollama client
+def get_ollama_client():
+    return current_app.config["OLLAMA_CLIENT"]
+
+# ---------------- APP INTEGRATION ----------------
+def init_ollama(app):
+    """Create the shared Ollama client from OLLAMA_* config"""
+    app.config["OLLAMA_CLIENT"] = OllamaClient(
+        base_url=app.config.get("OLLAMA_BASE_URL", DEFAULT_BASE_URL),
+        model=app.config.get("OLLAMA_MODEL", DEFAULT_MODEL),
+        connect_timeout=app.config.get("OLLAMA_CONNECT_TIMEOUT", 3.05),
+        read_timeout=app.config.get("OLLAMA_READ_TIMEOUT", 120),
+        retries=app.config.get("OLLAMA_RETRIES", 2),
+        pool_size=app.config.get("OLLAMA_POOL_SIZE", 10)
+    )
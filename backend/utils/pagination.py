@@ -0,0 +1,92 @@
+# pagination.py
+from flask import request, jsonify
+from bson import ObjectId
+from bson.errors import InvalidId
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class CursorError(ValueError):
+    """Raised for a malformed `limit` or `after` parameter"""
+
+# ---------------- CURSOR TOKENS ----------------
+def encode_cursor(sort_value, doc_id):
+    """Opaque token for the position just after (sort_value, _id)"""
+    raw = json.dumps([sort_value, str(doc_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(token):
+    """(sort_value, ObjectId) from a token made by encode_cursor"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        sort_value, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return sort_value, ObjectId(doc_id)
+    except (binascii.Error, ValueError, TypeError, InvalidId):
+        raise CursorError("Invalid cursor")
+
+# Helper function to read `limit` / `after` from the query string
+def page_params():
+    """(limit, after) for a paginated request, or (None, None) for a legacy full listing"""
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    if limit is None and after is None:
+        return None, None
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise CursorError("Invalid limit")
+    if limit < 1:
+        raise CursorError("Invalid limit")
+    return min(limit, MAX_PAGE_SIZE), (decode_cursor(after) if after else None)
+
+# ---------------- KEYSET QUERIES ----------------
+def sort_spec(sort_field):
+    """Newest-first sort on (sort_field, _id), or just _id when there is no sort field"""
+    if sort_field is None:
+        return [("_id", -1)]
+    return [(sort_field, -1), ("_id", -1)]
+
+def keyset_query(query, sort_field, after):
+    """`query` restricted to documents that sort after the `after` position"""
+    if not after:
+        return query
+    sort_value, doc_id = after
+    if sort_field is None:
+        position = {"_id": {"$lt": doc_id}}
+    elif sort_value is None:
+        # Missing/null sort values come last in a descending sort
+        position = {sort_field: None, "_id": {"$lt": doc_id}}
+    else:
+        position = {"$or": [
+            {sort_field: {"$lt": sort_value}},
+            {sort_field: sort_value, "_id": {"$lt": doc_id}},
+            {sort_field: None}
+        ]}
+    return {"$and": [query, position]} if query else position
+
+def keyset_sort_key(doc, sort_field="timestamp"):
+    """Python sort key matching sort_spec(sort_field), for merging pages from several collections"""
+    sort_value = doc.get(sort_field)
+    # Mongo orders null/missing below every string
+    return (sort_value is not None, sort_value if sort_value is not None else "", doc["_id"])
+
+def cursor_after(doc, sort_field):
+    """Token pointing just past `doc`"""
+    return encode_cursor(doc.get(sort_field) if sort_field else None, doc["_id"])
+
+def paginate_find(collection, query, sort_field, limit, after, projection=None):
+    """One page of `collection.find(query)` plus the cursor for the next page"""
+    docs = list(collection.find(keyset_query(query, sort_field, after), projection)
+                .sort(sort_spec(sort_field))
+                .limit(limit + 1))
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, cursor_after(docs[-1], sort_field)
+    return docs, None
+
+def page_response(items, next_cursor):
+    """JSON body for a paginated list endpoint"""
+    return jsonify({"items": items, "nextCursor": next_cursor})
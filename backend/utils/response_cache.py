@@ -0,0 +1,74 @@
+# response_cache.py
+from flask import current_app
+from collections import OrderedDict
+import hashlib
+import json
+import re
+import threading
+import time
+
+# ---------------- CACHE KEYS ----------------
+def normalize_message(message):
+    """Lower-cased message with whitespace collapsed and trailing punctuation dropped"""
+    return re.sub(r"\s+", " ", message or "").strip().lower().rstrip("?!. ")
+
+def cache_key(model, message, history):
+    """Key for a reply: the model, the normalized message and a fingerprint of the history before it"""
+    fingerprint = json.dumps(
+        [model, normalize_message(message), [[msg.get("role"), msg.get("content")] for msg in history]],
+        separators=(",", ":")
+    )
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+# Helper function to split a cached reply into SSE-sized pieces (words with their trailing space)
+def replay_chunks(reply):
+    return re.findall(r"\s*\S+\s*", reply) or [reply]
+
+# ---------------- RESPONSE CACHE ----------------
+class ResponseCache:
+    """Process-wide LRU/TTL cache of assistant replies"""
+
+    def __init__(self, max_entries=500, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.replies = OrderedDict()    # key -> (cached_at, reply)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(reply, age in seconds) for a cached key, or (None, None)"""
+        with self.lock:
+            entry = self.replies.get(key)
+            if entry and entry[0] + self.ttl > time.time():
+                self.replies.move_to_end(key)
+                self.hits += 1
+                return entry[1], int(time.time() - entry[0])
+            if entry:
+                self.replies.pop(key, None)
+            self.misses += 1
+            return None, None
+
+    def put(self, key, reply):
+        """Cache a reply; empty replies are never cached"""
+        if not reply:
+            return
+        with self.lock:
+            self.replies[key] = (time.time(), reply)
+            self.replies.move_to_end(key)
+            while len(self.replies) > self.max_entries:
+                self.replies.popitem(last=False)
+
+    def clear(self):
+        """Drop everything (e.g. after changing the model or the prompt format)"""
+        with self.lock:
+            self.replies.clear()
+
+    def stats(self):
+        """Cache size and hit/miss counts"""
+        with self.lock:
+            return {"entries": len(self.replies), "hits": self.hits, "misses": self.misses}
+
+# Helper function to get the app's response cache
+def get_response_cache():
+    return current_app.config["RESPONSE_CACHE"]
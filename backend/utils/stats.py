@@ -0,0 +1,50 @@
+# stats.py
+
+# ---------------- FACET STATISTICS ----------------
+# A stats spec maps a result name to either
+#   - a filter dict: the number of matching documents is returned, or
+#   - a list of pipeline stages: the documents that sub-pipeline produces are returned.
+# The whole spec runs as a single $facet aggregation, i.e. one round trip per collection.
+
+def build_facet_pipeline(spec, match=None):
+    """$facet pipeline for a stats spec, optionally pre-filtered by `match`"""
+    facets = {}
+    for name, definition in spec.items():
+        if isinstance(definition, list):
+            facets[name] = definition
+        else:
+            facets[name] = [{"$match": definition}, {"$count": "count"}]
+
+    pipeline = [{"$match": match}] if match else []
+    pipeline.append({"$facet": facets})
+    return pipeline
+
+def facet_stats(collection, spec, match=None):
+    """Run a stats spec against `collection` and return {name: count or documents}"""
+    result = next(collection.aggregate(build_facet_pipeline(spec, match)), {})
+
+    stats = {}
+    for name, definition in spec.items():
+        rows = result.get(name, [])
+        if isinstance(definition, list):
+            stats[name] = rows
+        else:
+            stats[name] = rows[0]["count"] if rows else 0
+    return stats
+
+# ---------------- GROUPED COUNTS ----------------
+def grouped_counts(collection, match, fields):
+    """Document counts per value of `fields` ({value: n} for one field, {(v1, v2): n} for several)"""
+    if isinstance(fields, str):
+        group_id = f"${fields}"
+    else:
+        group_id = {field: f"${field}" for field in fields}
+
+    counts = {}
+    for row in collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}}
+    ]):
+        key = row["_id"] if isinstance(fields, str) else tuple(row["_id"].get(field) for field in fields)
+        counts[key] = row["count"]
+    return counts
@@ -0,0 +1,68 @@
+# stream_registry.py
+from flask import current_app
+import secrets
+import threading
+
+# How a chat stream ended
+OUTCOMES = ("completed", "cancelled", "disconnected", "failed")
+
+# ---------------- STREAM REGISTRY ----------------
+class StreamRegistry:
+    """Open chat streams by stream id (so they can be cancelled) and counters for how they ended"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}               # stream id -> cancel event
+        self.started = 0
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.delivered_tokens = 0       # tokens of streams that ran to the end
+        self.cancelled_tokens = 0       # generated before an explicit cancel
+        self.wasted_tokens = 0          # generated for clients that had already gone away
+
+    def open(self):
+        """Register a new stream; returns (stream id, cancel event)"""
+        stream_id = secrets.token_urlsafe(12)
+        cancel_event = threading.Event()
+        with self.lock:
+            self.streams[stream_id] = cancel_event
+            self.started += 1
+        return stream_id, cancel_event
+
+    def cancel(self, stream_id):
+        """Ask an open stream to stop; False when no such stream is open"""
+        with self.lock:
+            cancel_event = self.streams.get(stream_id)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        return True
+
+    def close(self, stream_id, outcome, tokens):
+        """Unregister a stream and count how it ended and the tokens it generated"""
+        with self.lock:
+            self.streams.pop(stream_id, None)
+            self.outcomes[outcome] += 1
+            if outcome == "completed":
+                self.delivered_tokens += tokens
+            elif outcome == "cancelled":
+                self.cancelled_tokens += tokens
+            elif outcome == "disconnected":
+                self.wasted_tokens += tokens
+
+    def stats(self):
+        """Open streams, how finished streams ended and where their tokens went"""
+        with self.lock:
+            return {
+                "open": len(self.streams),
+                "started": self.started,
+                **self.outcomes,
+                "tokens": {
+                    "delivered": self.delivered_tokens,
+                    "cancelled": self.cancelled_tokens,
+                    "wasted": self.wasted_tokens
+                }
+            }
+
+# Helper function to get the app's stream registry
+def get_stream_registry():
+    return current_app.config["STREAM_REGISTRY"]
@@ -0,0 +1,207 @@
+# user_directory.py
+from flask import current_app, has_app_context
+from bson import ObjectId
+from collections import OrderedDict
+import threading
+import time
+from utils.change_feed import touch, STAMP_FIELDS, STAMP_PROJECTION
+
+# Users are cached (and served) without their password or change-feed stamps
+USER_PROJECTION = {"password": 0, **STAMP_PROJECTION}
+
+# ---------------- USER DIRECTORY CACHE ----------------
+class UserDirectory:
+    """Process-wide LRU/TTL cache of user documents keyed by id, email and role"""
+
+    def __init__(self, users_col, ttl=300, max_users=5000):
+        self.users_col = users_col
+        self.ttl = ttl
+        self.max_users = max_users
+        self.lock = threading.RLock()
+        self.users = OrderedDict()      # user id -> (expires_at, user)
+        self.emails = {}                # email -> user id
+        self.listings = {}              # tuple of roles (None = everyone) -> (expires_at, [user ids])
+        self.generation = 0             # bumped on every write so in-flight listings can't go stale
+        self.hits = 0
+        self.misses = 0
+
+    # Helper function to store a user while holding the lock
+    def _store(self, user, expires_at):
+        user_id = str(user["_id"])
+        previous = self.users.pop(user_id, None)
+        if previous and previous[1].get("email") != user.get("email"):
+            self.emails.pop(previous[1].get("email"), None)
+        self.users[user_id] = (expires_at, user)
+        if user.get("email"):
+            self.emails[user["email"]] = user_id
+        while len(self.users) > self.max_users:
+            _, (_, evicted) = self.users.popitem(last=False)
+            self.emails.pop(evicted.get("email"), None)
+
+    # Helper function to fetch a live cache entry while holding the lock
+    def _cached(self, user_id):
+        entry = self.users.get(user_id)
+        if not entry:
+            return None
+        if entry[0] < time.monotonic():
+            self.users.pop(user_id, None)
+            self.emails.pop(entry[1].get("email"), None)
+            return None
+        self.users.move_to_end(user_id)
+        return entry[1]
+
+    def get_by_id(self, user_id):
+        """User for an ObjectId string, loaded from Mongo on a miss"""
+        with self.lock:
+            user = self._cached(user_id)
+            if user:
+                self.hits += 1
+                return dict(user)
+            self.misses += 1
+            generation = self.generation
+        user = self.users_col.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
+        if user:
+            self.put(user, generation)
+            return dict(user)
+        return None
+
+    def get_by_email(self, email):
+        """User for an email address, loaded from Mongo on a miss"""
+        with self.lock:
+            user_id = self.emails.get(email)
+            user = self._cached(user_id) if user_id else None
+            if user:
+                self.hits += 1
+                return dict(user)
+            self.misses += 1
+            generation = self.generation
+        user = self.users_col.find_one({"email": email}, USER_PROJECTION)
+        if user:
+            self.put(user, generation)
+            return dict(user)
+        return None
+
+    def peek(self, user_id=None, email=None):
+        """Cached user for an id or email without falling back to Mongo"""
+        with self.lock:
+            if email and not user_id:
+                user_id = self.emails.get(email)
+            user = self._cached(user_id) if user_id else None
+            return dict(user) if user else None
+
+    def list_users(self, roles=None):
+        """All users, or the users with one of `roles`, served from memory when cached"""
+        key = tuple(sorted(roles)) if roles else None
+        now = time.monotonic()
+        with self.lock:
+            listing = self.listings.get(key)
+            if listing and listing[0] >= now:
+                users = [self._cached(user_id) for user_id in listing[1]]
+                if all(users):
+                    self.hits += 1
+                    return [dict(user) for user in users]
+            self.misses += 1
+            generation = self.generation
+
+        if key is None:
+            query = {}
+        elif len(key) == 1:
+            query = {"role": key[0]}
+        else:
+            query = {"role": {"$in": list(key)}}
+        users = list(self.users_col.find(query, USER_PROJECTION))
+
+        with self.lock:
+            if generation != self.generation:
+                # A user changed while we were reading; serve this result but don't cache it
+                return [dict(user) for user in users]
+            expires_at = time.monotonic() + self.ttl
+            for user in users:
+                self._store(user, expires_at)
+            # Listings larger than the LRU can't be served from it, so don't keep them
+            if len(users) <= self.max_users:
+                self.listings[key] = (expires_at, [str(user["_id"]) for user in users])
+        return [dict(user) for user in users]
+
+    def put(self, user, generation=None):
+        """Cache a user read from Mongo, unless a write happened since `generation`"""
+        user = {k: v for k, v in user.items() if k != "password" and k not in STAMP_FIELDS}
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._store(user, time.monotonic() + self.ttl)
+
+    def current_generation(self):
+        """Write counter to pass back to put() after a read"""
+        with self.lock:
+            return self.generation
+
+    def add(self, user):
+        """Cache a newly created user and drop listings for its role"""
+        with self.lock:
+            self._drop_listings(user.get("role"))
+            self.put(user)
+
+    def invalidate(self, user):
+        """Forget a user document and every listing it could appear in"""
+        with self.lock:
+            user_id = str(user["_id"]) if user.get("_id") else self.emails.get(user.get("email"))
+            if user_id:
+                cached = self.users.pop(user_id, None)
+                if cached:
+                    self.emails.pop(cached[1].get("email"), None)
+                    self._drop_listings(cached[1].get("role"))
+            self.emails.pop(user.get("email"), None)
+            self._drop_listings(user.get("role"))
+
+    def replace(self, old_user, new_user):
+        """Swap a cached user for its updated version in place"""
+        with self.lock:
+            self.invalidate(old_user)
+            self._drop_listings(new_user.get("role"))
+            self.put(new_user)
+
+    def clear(self):
+        """Drop everything"""
+        with self.lock:
+            self.users.clear()
+            self.emails.clear()
+            self.listings.clear()
+            self.generation += 1
+
+    def apply_change(self, topic, event):
+        """Event-bus callback: refresh a user another worker process changed"""
+        if event.get("source") == "local" or event.get("echo") or not event.get("id"):
+            # Our own writes already update the cache in the route that made them
+            return
+        if event.get("document"):
+            self.replace({"_id": event["id"]}, event["document"])
+        else:
+            self.invalidate({"_id": event["id"]})
+
+    def stats(self):
+        """Cache size and hit/miss counts"""
+        with self.lock:
+            return {"users": len(self.users), "listings": len(self.listings), "hits": self.hits, "misses": self.misses}
+
+    # Helper function to drop cached listings for a role while holding the lock
+    def _drop_listings(self, role):
+        self.generation += 1
+        for key in list(self.listings):
+            if key is None or role is None or role in key:
+                self.listings.pop(key, None)
+
+# Helper function to build a user update that bumps the version tokens are checked against
+def versioned_update(user_id, update_data):
+    """(filter, update) for a user write; matches only when a field actually changes"""
+    query = {"_id": ObjectId(user_id)}
+    if not update_data:
+        return query, {"$set": update_data}
+    query["$or"] = [{field: {"$ne": value}} for field, value in update_data.items()]
+    return query, {"$set": touch(update_data), "$inc": {"version": 1}}
+
+# Helper function to get the app's user directory (None when not configured)
+def get_user_directory():
+    if not has_app_context():
+        return None
+    return current_app.config.get("USER_DIRECTORY")
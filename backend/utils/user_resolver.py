@@ -0,0 +1,189 @@
+# user_resolver.py
+from flask import g, has_app_context
+from bson import ObjectId
+import re
+from utils.user_directory import USER_PROJECTION, get_user_directory
+
+# Helper function to validate ObjectId
+def is_valid_objectid(objectid_str):
+    """Check if a string is a valid MongoDB ObjectId"""
+    if not objectid_str:
+        return False
+    if not isinstance(objectid_str, str):
+        return False
+    if len(objectid_str) != 24:
+        return False
+    return re.match(r'^[a-f0-9]{24}$', objectid_str) is not None
+
+# ---------------- REQUEST IDENTITY MAP ----------------
+# Helper function to get (or create) the identity map for the current request
+def _identity_map():
+    if "user_identity_map" not in g:
+        g.user_identity_map = {"by_id": {}, "by_email": {}, "hits": 0, "misses": 0}
+    return g.user_identity_map
+
+def remember_user(user, user_id=None, email=None):
+    """Store a user document (or a negative result) under its _id and email"""
+    if not has_app_context():
+        return
+    identity_map = _identity_map()
+    if user:
+        identity_map["by_id"][str(user["_id"])] = user
+        if user.get("email"):
+            identity_map["by_email"][user["email"]] = user
+    else:
+        # Remember misses too so an unknown id/email is only queried once
+        if user_id:
+            identity_map["by_id"][user_id] = None
+        if email:
+            identity_map["by_email"][email] = None
+
+# Helper function to load a user from the process-wide directory, or Mongo without one
+def _load(users_col, key_type, value, query):
+    directory = get_user_directory()
+    if directory:
+        if key_type == "by_id":
+            return directory.get_by_id(value)
+        return directory.get_by_email(value)
+    return users_col.find_one(query, USER_PROJECTION)
+
+def _lookup(users_col, key_type, value, query):
+    if not has_app_context():
+        return _load(users_col, key_type, value, query)
+
+    identity_map = _identity_map()
+    if value in identity_map[key_type]:
+        identity_map["hits"] += 1
+        return identity_map[key_type][value]
+
+    identity_map["misses"] += 1
+    user = _load(users_col, key_type, value, query)
+    if key_type == "by_id":
+        remember_user(user, user_id=value)
+    else:
+        remember_user(user, email=value)
+    return user
+
+# ---------------- SINGLE-USER LOOKUPS ----------------
+def get_user_by_id(users_col, user_id):
+    """User for an ObjectId string, loaded at most once per request"""
+    if not is_valid_objectid(user_id):
+        return None
+    return _lookup(users_col, "by_id", user_id, {"_id": ObjectId(user_id)})
+
+def get_user_by_email(users_col, email):
+    """User for an email address, loaded at most once per request"""
+    if not email or not isinstance(email, str):
+        return None
+    return _lookup(users_col, "by_email", email, {"email": email})
+
+def get_user(users_col, identifier):
+    """User for an ObjectId string, falling back to email for anything else"""
+    if is_valid_objectid(identifier):
+        return get_user_by_id(users_col, identifier)
+    return get_user_by_email(users_col, identifier)
+
+def identity_map_stats():
+    """Hit/miss counts for the current request"""
+    if not has_app_context() or "user_identity_map" not in g:
+        return {"hits": 0, "misses": 0}
+    identity_map = g.user_identity_map
+    return {"hits": identity_map["hits"], "misses": identity_map["misses"]}
+
+# ---------------- BATCHED USER RESOLUTION ----------------
+class UserLookup:
+    """In-memory join table for users referenced by a page of records"""
+
+    def __init__(self, users_by_id, users_by_email):
+        self.users_by_id = users_by_id
+        self.users_by_email = users_by_email
+
+    def by_id(self, value):
+        """User for an ObjectId string, or None"""
+        if not is_valid_objectid(value):
+            return None
+        return self.users_by_id.get(value)
+
+    def by_email(self, value):
+        """User for an email address, or None"""
+        if not value or not isinstance(value, str):
+            return None
+        return self.users_by_email.get(value)
+
+    def get(self, value):
+        """User for an ObjectId string, falling back to email for anything else"""
+        if is_valid_objectid(value):
+            return self.by_id(value)
+        return self.by_email(value)
+
+def load_users(users_col, records, fields, projection=None):
+    """Resolve every user referenced by `fields` in `records` with one `$in` query per key type"""
+    ids = set()
+    emails = set()
+    for record in records:
+        for field in fields:
+            value = record.get(field)
+            if is_valid_objectid(value):
+                ids.add(value)
+            elif value and isinstance(value, str):
+                emails.add(value)
+
+    if projection is None:
+        projection = USER_PROJECTION
+
+    users_by_id = {}
+    users_by_email = {}
+
+    # Serve what the process-wide directory already holds
+    directory = get_user_directory() if projection is USER_PROJECTION else None
+    fetched = []
+    if directory:
+        generation = directory.current_generation()
+        for user_id in list(ids):
+            user = directory.peek(user_id=user_id)
+            if user:
+                users_by_id[user_id] = user
+                users_by_email[user.get("email")] = user
+                ids.discard(user_id)
+        for email in list(emails):
+            user = directory.peek(email=email)
+            if user:
+                users_by_id[str(user["_id"])] = user
+                users_by_email[email] = user
+                emails.discard(email)
+
+    if ids:
+        for user in users_col.find({"_id": {"$in": [ObjectId(i) for i in ids]}}, projection):
+            fetched.append(user)
+            users_by_id[str(user["_id"])] = user
+            if user.get("email"):
+                users_by_email[user["email"]] = user
+    # Skip emails the id query already returned
+    emails -= set(users_by_email)
+    if emails:
+        for user in users_col.find({"email": {"$in": list(emails)}}, projection):
+            fetched.append(user)
+            users_by_id[str(user["_id"])] = user
+            users_by_email[user["email"]] = user
+
+    # Let single-record lookups later in the request reuse full documents from this batch
+    if projection is USER_PROJECTION:
+        for user in users_by_id.values():
+            remember_user(user)
+    if directory:
+        for user in fetched:
+            directory.put(user, generation)
+
+    return UserLookup(users_by_id, users_by_email)
+
+# ---------------- APP INTEGRATION ----------------
+def init_identity_map(app):
+    """Report identity map hit/miss counts on every response that used it"""
+
+    @app.after_request
+    def add_identity_map_headers(response):
+        if "user_identity_map" in g:
+            stats = identity_map_stats()
+            response.headers["X-User-Map-Hits"] = str(stats["hits"])
+            response.headers["X-User-Map-Misses"] = str(stats["misses"])
+        return response
@@ -0,0 +1,61 @@
+# work_hours.py
+import re
+
+# Attendance stores check-in/out as "HH:MM" strings; the numeric copies let
+# aggregations sum worked time without parsing strings on every read.
+MINUTE_FIELDS = {"checkIn": "checkInMinutes", "checkOut": "checkOutMinutes"}
+
+# Exactly "HH:MM" (00:00-23:59); the Python and aggregation parsers both use it so a
+# record counts toward worked hours in every view or in none
+HHMM_PATTERN = r"^([01][0-9]|2[0-3]):[0-5][0-9]$"
+
+# Helper function to convert an "HH:MM" string to minutes after midnight
+def time_to_minutes(value):
+    """Minutes after midnight for an "HH:MM" string, or None when it can't be parsed"""
+    if not isinstance(value, str) or not re.fullmatch(HHMM_PATTERN, value):
+        return None
+    return int(value[:2]) * 60 + int(value[3:])
+
+def with_minutes(fields):
+    """Copy of an attendance insert/$set dict with the numeric check-in/out fields added"""
+    stamped = dict(fields)
+    for field, minutes_field in MINUTE_FIELDS.items():
+        if field in fields:
+            stamped[minutes_field] = time_to_minutes(fields[field])
+    return stamped
+
+# ---------------- AGGREGATION EXPRESSIONS ----------------
+# Helper function to parse an "HH:MM" field inside a pipeline (records written before the numeric fields);
+# accepts exactly what time_to_minutes accepts
+def _parse_minutes_expr(field):
+    value = f"${field}"
+    minutes = {"$add": [
+        {"$multiply": [{"$toInt": {"$substrBytes": [value, 0, 2]}}, 60]},
+        {"$toInt": {"$substrBytes": [value, 3, 2]}}
+    ]}
+    # $cond only evaluates the branch it takes, so $regexMatch only ever sees strings;
+    # the length check stops "$" matching before a trailing newline, as fullmatch does
+    exact = {"$and": [
+        {"$eq": [{"$strLenBytes": value}, 5]},
+        {"$regexMatch": {"input": value, "regex": HHMM_PATTERN}}
+    ]}
+    return {"$cond": [{"$eq": [{"$type": value}, "string"]}, {"$cond": [exact, minutes, None]}, None]}
+
+def minutes_expr(field):
+    """Stored minutes for checkIn/checkOut, falling back to parsing the string"""
+    return {"$ifNull": [f"${MINUTE_FIELDS[field]}", _parse_minutes_expr(field)]}
+
+def has_times_expr():
+    """True when both checkIn and checkOut are non-empty strings"""
+    return {"$and": [{"$gt": ["$checkIn", ""]}, {"$gt": ["$checkOut", ""]}]}
+
+def worked_minutes_expr():
+    """Minutes between check-in and check-out, 0 when either is missing or invalid"""
+    return {"$let": {
+        "vars": {"start": minutes_expr("checkIn"), "end": minutes_expr("checkOut")},
+        "in": {"$cond": [
+            {"$and": [{"$ne": ["$$start", None]}, {"$ne": ["$$end", None]}]},
+            {"$max": [0, {"$subtract": ["$$end", "$$start"]}]},
+            0
+        ]}
+    }}
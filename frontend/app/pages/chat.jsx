@@ -16,6 +16,7 @@ import {
   Easing
 } from 'react-native';
 import axios from 'axios';
+import * as SecureStore from 'expo-secure-store';
 import { Ionicons } from '@expo/vector-icons';
 import getBaseUrl from "../baseurl";
 
@@ -29,6 +30,8 @@ export default function ChatApp() {
   ]);
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // Server-side conversation: only the new message is sent with each turn
+  const [sessionId, setSessionId] = useState(null);
   const scrollViewRef = useRef(null);
   const fadeAnim = useRef(new Animated.Value(0)).current;
 
@@ -58,11 +61,16 @@ export default function ChatApp() {
     setIsLoading(true);
 
     try {
+      const token = await SecureStore.getItemAsync('authToken');
       const response = await axios.post(`${API_BASE_URL}/api/chat`, {
         message: inputMessage.trim(),
-        history: messages.map(m => ({ role: m.role, content: m.content }))
+        sessionId
+      }, {
+        headers: { Authorization: `Bearer ${token}` }
       });
 
+      setSessionId(response.data.sessionId);
+
       const assistantMessage = {
         role: 'assistant',
         content: response.data.reply,
@@ -126,12 +134,24 @@ export default function ChatApp() {
     </Animated.View>
   );
 
-  const clearChat = () => {
+  const clearChat = async () => {
     setMessages([{
       role: 'assistant',
       content: 'Hello! I\'m your Llama3 assistant. How can I help you today?',
       timestamp: new Date()
     }]);
+
+    // End the server-side session too (it would otherwise expire on its own)
+    if (!sessionId) return;
+    setSessionId(null);
+    try {
+      const token = await SecureStore.getItemAsync('authToken');
+      await axios.delete(`${API_BASE_URL}/api/chat/session/${sessionId}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+    } catch (error) {
+      console.error('Chat session error:', error);
+    }
   };
 
   return (